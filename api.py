@@ -0,0 +1,122 @@
+"""
+A headless JSON-over-HTTP API for the RAG system, for service-to-service traffic.
+
+Run with `uv run api.py --port 8000`. Endpoints:
+
+- `POST /query` with `{"question": "..."}` returns the question's `Response` (the schema of `RAG.query`), or
+  `{"error": "..."}` with status 400 for a malformed request or 500 if the query failed.
+- `GET /health` returns `{"status": "ok"}` once the RAG system has started up and its clients are warm (see
+  `BaseRAG.warm`), and `{"status": "starting"}` with status 503 before then, for readiness checks.
+- `GET /metrics` returns the request counts, the coalescing stats, the latency histograms of each pipeline stage and
+  the cache hit counts (see `tracing.HistogramExporter`), and the boto3 connection pool metrics.
+
+Requests are handled asynchronously, and identical concurrent questions run once: the RAG's single-flight (see
+`single_flight.py`) coalesces a question with the identical one in flight, and the response cache answers it once that
+one is done. Concurrent questions aren't held back to batch distinct ones together, since nothing in the pipeline can
+be shared between them (e.g., the Knowledge Base's Retrieve API takes one query per call). Connections are kept alive
+between requests.
+As for `ui.py`, `USE_SOLUTION`, `RESULT_STORE`, and `SHARED_CACHE` are read from the environment.
+"""
+
+import argparse
+import asyncio
+import logging
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from aws_clients import pool_metrics
+from cli import env_options, start_rag
+from constants import API_KEEPALIVE_TIMEOUT, API_PORT
+from rag_base import BaseRAG, Response
+from tracing import HistogramExporter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    bad_requests: int = 0
+    failed: int = 0
+
+
+def make_app(startup: Future[BaseRAG]) -> web.Application:
+    """
+    Args:
+        startup (Future[BaseRAG]): The RAG system to serve, once it has started up (see `cli.start_rag`).
+    """
+    stats = RequestStats()
+
+    async def answer(question: str) -> Response:
+        # shielded, since cancelling the wrapper of a `concurrent.futures.Future` cancels the (shared) future itself
+        rag = await asyncio.shield(asyncio.wrap_future(startup))
+        return await rag.aquery(question)
+
+    async def query(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        question = body.get("question") if isinstance(body, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            stats.bad_requests += 1
+            return web.json_response({"error": 'Expected a JSON object with a "question" string'}, status=400)
+        stats.queries += 1
+        try:
+            response = await answer(question)
+        except Exception as e:
+            stats.failed += 1
+            logger.exception("Query failed: %r", question)
+            return web.json_response({"error": repr(e)}, status=500)
+        return web.json_response(response)
+
+    async def health(request: web.Request) -> web.Response:
+        if not startup.done():
+            return web.json_response({"status": "starting"}, status=503)
+        if (error := startup.exception()) is not None:
+            return web.json_response({"status": "failed", "error": repr(error)}, status=503)
+        return web.json_response({"status": "ok"})
+
+    async def metrics(request: web.Request) -> web.Response:
+        result: dict[str, Any] = {
+            "requests": asdict(stats),
+            "connection_pools": {name: asdict(metrics) for name, metrics in pool_metrics().items()},
+        }
+        if startup.done() and startup.exception() is None:
+            rag = startup.result()
+            if rag.single_flight is not None:
+                coalescing = rag.single_flight.stats
+                result["single_flight"] = {**asdict(coalescing), "coalesce_rate": coalescing.coalesce_rate}
+            if rag.tracer is not None:
+                for exporter in rag.tracer.exporters:
+                    if isinstance(exporter, HistogramExporter):
+                        result["stages"] = exporter.summary()
+        return web.json_response(result)
+
+    app = web.Application()
+    app.router.add_post("/query", query)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=API_PORT, help="the port to listen on")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    load_dotenv()
+    # the RAG's clients are created, and their SDKs imported, while the server starts listening
+    app = make_app(start_rag(**env_options()))
+    # per-request access logs would cost more than the lean requests they log
+    web.run_app(app, host=args.host, port=args.port, keepalive_timeout=API_KEEPALIVE_TIMEOUT, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
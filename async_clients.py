@@ -0,0 +1,199 @@
+import copy
+import threading
+import time
+from collections.abc import Callable, Mapping
+from typing import Any, cast
+
+from cleanlab_codex.internal.validator import process_score_metadata, update_scores_based_on_thresholds
+from cleanlab_codex.types.validator import ThresholdedTrustworthyRAGScore
+from cleanlab_codex.validator import Validator
+
+from blocking_io import run_blocking
+from context_assembly import estimate_tokens
+from eval_routing import EvalRouter
+from rate_limit import Scheduler
+from tiered_validation import TieredValidation, ValidationPlan
+from tracing import record, stage
+
+
+def _record_eval_scores(scores: Mapping[str, Any]) -> None:
+    # responses replaced by expert answers don't carry the evals that flagged them, so the trace keeps them (for the
+    # result store, see result_store.py)
+    evals = [
+        {"name": name} | {key: score[key] for key in ("score", "is_bad", "skipped") if key in score}
+        for name, score in scores.items()
+        if isinstance(score, Mapping) and "score" in score
+    ]
+    record("eval_scores", evals)
+
+
+_tlm_rags_lock = threading.Lock()
+
+
+class AsyncValidator(Validator):
+    """
+    A Codex `Validator` whose `validate_async` never blocks the event loop.
+
+    The upstream `validate_async` awaits TrustworthyRAG scoring but then performs the Codex expert answer lookup
+    synchronously. This version runs that lookup on the shared I/O thread pool instead.
+
+    Validation and expert answer lookups are recorded as stages of the current trace. If a `scheduler` is set,
+    validations wait for its "tlm" rate limiter. If `eval_router` is set, evals it rules out for the query are
+    skipped. If `tiered_validation` is set, local checks run first and TrustworthyRAG only runs the evals that are
+    still needed (or not at all).
+    """
+
+    scheduler: Scheduler | None = None
+    eval_router: EvalRouter | None = None
+    tiered_validation: TieredValidation | None = None
+
+    def validate(
+        self,
+        *,
+        query: str,
+        context: str,
+        response: str,
+        prompt: str | None = None,
+        form_prompt: Callable[[str, str], str] | None = None,
+        metadata: dict[str, Any] | None = None,
+        log_results: bool = True,
+    ) -> dict[str, Any]:
+        if self.scheduler is not None:
+            self.scheduler.acquire("tlm", estimate_tokens(context + query + response))
+        with stage("validate"):
+            results = super().validate(
+                query=query,
+                context=context,
+                response=response,
+                prompt=prompt,
+                form_prompt=form_prompt,
+                metadata=metadata,
+                log_results=log_results,
+            )
+        _record_eval_scores(results)
+        return results
+
+    async def validate_async(
+        self,
+        *,
+        query: str,
+        context: str,
+        response: str,
+        prompt: str | None = None,
+        form_prompt: Callable[[str, str], str] | None = None,
+        metadata: dict[str, Any] | None = None,
+        log_results: bool = True,
+    ) -> dict[str, Any]:
+        if self.scheduler is not None:
+            await run_blocking(self.scheduler.acquire, "tlm", estimate_tokens(context + query + response))
+        with stage("validate"):
+            scores, is_bad_response = await self.detect_async(query, context, response, prompt, form_prompt)
+        _record_eval_scores(scores)
+        expert_answer = None
+        if is_bad_response:
+            final_metadata = metadata.copy() if metadata else {}
+            if log_results:
+                final_metadata.update(process_score_metadata(scores, self._bad_response_thresholds))
+            with stage("expert_answer_lookup"):
+                expert_answer = await run_blocking(self._remediate, query=query, metadata=final_metadata)
+
+        return {
+            "expert_answer": expert_answer,
+            "is_bad_response": is_bad_response,
+            **scores,
+        }
+
+    async def lookup_expert_answer(self, query: str) -> str | None:
+        """
+        Looks up an expert answer for `query` in the Codex project, regardless of whether a response is bad.
+
+        Like every Codex lookup, this adds `query` to the project for SMEs to answer if it isn't already there.
+
+        Args:
+            query (str): The user query to look up.
+
+        Returns:
+            str | None: The expert answer, if there is one.
+        """
+        with stage("speculative_expert_answer_lookup"):
+            return await run_blocking(self._remediate, query=query)
+
+    def detect(
+        self,
+        *,
+        query: str,
+        context: str,
+        response: str,
+        prompt: str | None = None,
+        form_prompt: Callable[[str, str], str] | None = None,
+    ) -> tuple[ThresholdedTrustworthyRAGScore, bool]:
+        if self.tiered_validation is None and self.eval_router is None:
+            return super().detect(
+                query=query, context=context, response=response, prompt=prompt, form_prompt=form_prompt
+            )
+        plan = self._plan(query, context, response)
+        if plan.tlm_evals is None:
+            return cast(ThresholdedTrustworthyRAGScore, plan.local_scores), True
+        start = time.perf_counter()
+        scores = self._tlm_rag_with(plan.tlm_evals).score(
+            response=response, query=query, context=context, prompt=prompt, form_prompt=form_prompt
+        )
+        if self.tiered_validation is not None:
+            self.tiered_validation.record_tlm_call(time.perf_counter() - start)
+        return self._combine(scores, plan)
+
+    async def detect_async(
+        self,
+        query: str,
+        context: str,
+        response: str,
+        prompt: str | None = None,
+        form_prompt: Callable[[str, str], str] | None = None,
+    ) -> tuple[ThresholdedTrustworthyRAGScore, bool]:
+        if self.tiered_validation is None and self.eval_router is None:
+            return await super().detect_async(query, context, response, prompt, form_prompt)
+        plan = self._plan(query, context, response)
+        if plan.tlm_evals is None:
+            return cast(ThresholdedTrustworthyRAGScore, plan.local_scores), True
+        start = time.perf_counter()
+        scores = await self._tlm_rag_with(plan.tlm_evals).score_async(
+            response=response, query=query, context=context, prompt=prompt, form_prompt=form_prompt
+        )
+        if self.tiered_validation is not None:
+            self.tiered_validation.record_tlm_call(time.perf_counter() - start)
+        return self._combine(scores, plan)
+
+    def _plan(self, query: str, context: str, response: str) -> ValidationPlan:
+        evals = [eval.name for eval in self._tlm_rag.get_evals()]
+        threshold = self._bad_response_thresholds.get_threshold
+        plan = ValidationPlan(local_scores={}, is_bad_response=False, tlm_evals=evals)
+        if self.eval_router is not None:
+            plan = self.eval_router.route(query, response, evals, threshold)
+            record("skipped_evals", ",".join(sorted(plan.local_scores)) or "none")
+        if self.tiered_validation is not None:
+            assert plan.tlm_evals is not None
+            routed_scores = plan.local_scores
+            plan = self.tiered_validation.plan(context, response, plan.tlm_evals, threshold)
+            plan.local_scores.update(routed_scores)
+            record("validation_tier", "local" if plan.tlm_evals is None else "tlm")
+        return plan
+
+    def _combine(self, scores: Any, plan: ValidationPlan) -> tuple[ThresholdedTrustworthyRAGScore, bool]:
+        thresholded = update_scores_based_on_thresholds(scores=scores, thresholds=self._bad_response_thresholds)
+        is_bad_response = plan.is_bad_response or any(score["is_bad"] for score in thresholded.values())
+        return cast(ThresholdedTrustworthyRAGScore, {**thresholded, **plan.local_scores}), is_bad_response
+
+    def _tlm_rag_with(self, evals: list[str]) -> Any:
+        """Returns a TrustworthyRAG that runs only the given evals (which are a subset of the configured evals)."""
+        configured = self._tlm_rag.get_evals()
+        if len(evals) == len(configured):
+            return self._tlm_rag
+        key = tuple(evals)
+        with _tlm_rags_lock:
+            tlm_rags = self.__dict__.setdefault("_tlm_rags", {})
+            if key not in tlm_rags:
+                # a shallow copy shares the client state (API key, event loop, rate limiting) of the original
+                tlm_rag = copy.copy(self._tlm_rag)
+                tlm_rag._evals = [eval for eval in configured if eval.name in evals]
+                tlm_rags[key] = tlm_rag
+            return tlm_rags[key]
@@ -0,0 +1,171 @@
+"""
+Shared, tuned boto3 clients.
+
+boto3 clients are thread-safe and each holds a connection pool, so rather than every `RAG` instance (and every script)
+creating clients of its own with default settings, `get_client` creates one client per service and configuration and
+hands it out everywhere. The clients are configured from `constants.py`: connection pools sized for `MAX_CONCURRENCY`,
+explicit timeouts, TCP keepalive, and "adaptive" retries, which back off *and* rate-limit the client when Bedrock
+throttles it, rather than letting every thread retry into the quota at once.
+
+Each client also counts its requests in flight, to show how close its connection pool is to saturation (see
+`pool_metrics`).
+
+boto3 takes a while to import, and each client a while to create, so both happen on first use; `LazyClient` defers
+creating a client until it is first called.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+import tracing
+from constants import (
+    AWS_CONNECT_TIMEOUT,
+    AWS_MAX_ATTEMPTS,
+    AWS_READ_TIMEOUT,
+    AWS_RETRY_MODE,
+    AWS_TCP_KEEPALIVE,
+    MAX_CONCURRENCY,
+)
+
+if TYPE_CHECKING:
+    from botocore.config import Config  # type: ignore
+
+# error codes with which AWS services signal that a quota was exceeded
+THROTTLING_ERRORS = frozenset({"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"})
+
+
+@dataclass
+class PoolMetrics:
+    """Request counts of a shared client, to size its connection pool."""
+
+    max_pool_connections: int
+    requests: int = 0  # HTTP requests sent, including retries
+    in_flight: int = 0  # requests waiting for a response right now
+    peak_in_flight: int = 0
+    saturated: int = 0  # requests sent while all of the pool's connections were busy (so they had to wait for one)
+    throttled: int = 0  # responses with a throttling error
+    errors: int = 0  # requests that failed without a response (e.g., timeouts)
+
+    @property
+    def utilization(self) -> float:
+        """The peak fraction of the connection pool in use."""
+        return self.peak_in_flight / self.max_pool_connections
+
+
+_clients: dict[tuple[str, str, str], Any] = {}
+_metrics: dict[tuple[str, str, str], PoolMetrics] = {}
+_lock = threading.Lock()  # also guards the metrics, which are updated from many threads
+
+
+def client_config(**overrides: Any) -> "Config":
+    """
+    Builds the botocore `Config` for shared clients.
+
+    Args:
+        **overrides: `Config` options that replace the defaults from `constants.py`, e.g., `read_timeout=300`.
+
+    Returns:
+        Config: The client configuration.
+    """
+    from botocore.config import Config
+
+    options: dict[str, Any] = {
+        "region_name": os.environ["AWS_REGION"],
+        "max_pool_connections": MAX_CONCURRENCY,
+        "connect_timeout": AWS_CONNECT_TIMEOUT,
+        "read_timeout": AWS_READ_TIMEOUT,
+        "tcp_keepalive": AWS_TCP_KEEPALIVE,
+        "retries": {"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+    }
+    options.update(overrides)
+    return Config(**options)
+
+
+def get_client(service_name: str, **overrides: Any) -> Any:
+    """
+    Returns the shared boto3 client for a service, creating it on first use.
+
+    Args:
+        service_name (str): The AWS service, e.g., "bedrock-runtime".
+        **overrides: `Config` options that replace the defaults (see `client_config`); clients with different
+            options are separate.
+
+    Returns:
+        The boto3 client.
+    """
+    config = client_config(**overrides)
+    key = (service_name, config.region_name, repr(sorted(overrides.items())))
+    with _lock:
+        if key not in _clients:
+            import boto3  # type: ignore
+
+            # boto3's default session isn't thread-safe, so each client is created from a session of its own
+            client = boto3.session.Session().client(service_name, config=config)
+            metrics = PoolMetrics(max_pool_connections=config.max_pool_connections)
+            _register_metrics(client, metrics)
+            _clients[key] = client
+            _metrics[key] = metrics
+        return _clients[key]
+
+
+class LazyClient:
+    """
+    Stands in for the shared boto3 client for a service, which is created (see `get_client`) when it is first used.
+
+    Call `resolve` to create the client ahead of its first use, e.g., from a background thread at startup.
+    """
+
+    def __init__(self, service_name: str, **overrides: Any) -> None:
+        self.service_name = service_name
+        self._overrides = overrides
+        self._client: Any = None
+
+    def resolve(self) -> Any:
+        """Returns the client, creating it if needed."""
+        if self._client is None:
+            self._client = get_client(self.service_name, **self._overrides)
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+
+def pool_metrics() -> dict[str, PoolMetrics]:
+    """Returns a snapshot of the request counts of each shared client, by service name (and region, if several)."""
+    with _lock:
+        regions = {region for _, region, _ in _metrics}
+        snapshot = {}
+        for (service_name, region, overrides), metrics in _metrics.items():
+            name = service_name if len(regions) == 1 else f"{service_name}@{region}"
+            if overrides != "[]":
+                name = f"{name}{overrides}"
+            snapshot[name] = PoolMetrics(**vars(metrics))
+        return snapshot
+
+
+def _register_metrics(client: Any, metrics: PoolMetrics) -> None:
+    def before_send(**kwargs: Any) -> None:
+        with _lock:
+            metrics.requests += 1
+            metrics.saturated += metrics.in_flight >= metrics.max_pool_connections
+            metrics.in_flight += 1
+            metrics.peak_in_flight = max(metrics.peak_in_flight, metrics.in_flight)
+
+    def response_received(parsed_response: dict[str, Any] | None, exception: Exception | None, **kwargs: Any) -> None:
+        # for streaming operations, this is when the response starts, so in_flight doesn't count streams being read
+        with _lock:
+            metrics.in_flight -= 1
+            metrics.errors += exception is not None
+            if parsed_response is not None:
+                metrics.throttled += parsed_response.get("Error", {}).get("Code") in THROTTLING_ERRORS
+
+    client.meta.events.register("before-send", before_send)
+    client.meta.events.register("response-received", response_received)
+    client.meta.events.register("after-call", _record_retries)
+
+
+def _record_retries(parsed: dict[str, Any], **kwargs: Any) -> None:
+    if retries := parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0):
+        tracing.increment("bedrock_retries", retries)
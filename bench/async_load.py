@@ -0,0 +1,82 @@
+"""
+Load benchmark for `RAG.aquery` against stubbed Bedrock / Codex backends.
+
+Compares sequential `RAG.query` calls with `RAG.aquery` at increasing levels of concurrency, showing how throughput
+scales when the event loop keeps many queries in flight. Run with `uv run -m bench.async_load`.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from bench.stubs import StubBedrockAgentRuntime, StubBedrockRuntime, StubValidator
+from rag_base import RAGOptions
+from solutions.part4 import RAG
+
+QUESTION = "What models does Cursor support?"
+
+
+def make_rag(latency: float, cache: bool = False) -> RAG:
+    os.environ.setdefault("RAG_KNOWLEDGE_BASE_ID", "stub")  # only passed through to the stub
+    options: RAGOptions = {
+        "bedrock_runtime": StubBedrockRuntime(latency),
+        "bedrock_agent_runtime": StubBedrockAgentRuntime(latency),
+        "validator": StubValidator(latency),
+    }
+    if not cache:
+        options["retrieval_cache"] = None
+        options["response_cache"] = None
+    return RAG(**options)
+
+
+def report(label: str, latencies: list[float], elapsed: float) -> None:
+    print(
+        f"{label:>16}  {len(latencies) / elapsed:8.1f} QPS  "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} ms  max {max(latencies) * 1000:7.1f} ms"
+    )
+
+
+def bench_sync(rag: RAG, num_queries: int) -> None:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(num_queries):
+        query_start = time.perf_counter()
+        rag.query(QUESTION)
+        latencies.append(time.perf_counter() - query_start)
+    report("query", latencies, time.perf_counter() - start)
+
+
+async def bench_async(rag: RAG, num_queries: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one() -> None:
+        async with semaphore:
+            query_start = time.perf_counter()
+            await rag.aquery(QUESTION)
+            latencies.append(time.perf_counter() - query_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(num_queries)))
+    report(f"aquery x{concurrency}", latencies, time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated latency per backend call (seconds)")
+    parser.add_argument("--queries", type=int, default=20, help="queries per concurrency level (scaled by level)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64, 256])
+    # every query asks the same question, so by default caching is disabled to measure the backend round trips
+    parser.add_argument("--cache", action="store_true", help="enable the retrieval and response caches")
+    args = parser.parse_args()
+
+    rag = make_rag(args.latency, args.cache)
+    bench_sync(rag, args.queries)
+    for concurrency in args.concurrency:
+        asyncio.run(bench_async(rag, args.queries * max(1, concurrency // 4), concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the latency that eval routing (see `eval_routing.py`) saves.
+
+Runs the offline benchmark suite (see `bench.suite`, whose options this accepts) twice, without and with an
+`EvalRouter`, and reports how much faster queries got. Since TrustworthyRAG's latency grows with the number of evals it
+runs, set `--eval-latency` to the latency that each eval adds. Run with `uv run -m bench.eval_routing`.
+
+First, it checks that skipped evals are stored as not having run, so that threshold sweeps (see `threshold_sweep.py`)
+never count them as flagging a response. The check requires the optional `pyarrow` package (`uv sync --extra store`).
+"""
+
+import argparse
+import asyncio
+import itertools
+import sys
+import tempfile
+
+from bench.suite import build_parser, make_rag, run
+from cli import load_questions
+from result_store import ResultStore
+from threshold_sweep import EvalScores
+
+
+def check_sweep(args: argparse.Namespace) -> bool:
+    """Returns whether, with routing, each routed eval flags exactly the stored responses it ran on at threshold 1."""
+    args.route_evals = True
+    rag = make_rag(args)
+    assert rag.eval_router is not None
+    with tempfile.TemporaryDirectory() as directory:
+        rag.result_store = ResultStore(directory)
+
+        async def query_all() -> None:
+            for question in itertools.islice(load_questions(args.questions), 32):
+                await rag.aquery(question)
+
+        asyncio.run(query_all())
+        rag.result_store.close()
+        scores = EvalScores.load(rag.result_store)
+    ok = True
+    for name in sorted(rag.eval_router.stats.run.keys() | rag.eval_router.stats.skipped.keys()):
+        # every stub score is below 1, so each response the eval ran on is flagged, and no other
+        flagged = int(scores.is_bad({name: 1.0}).sum()) if name in scores.names else 0
+        ran = rag.eval_router.stats.run.get(name, 0)
+        print(f"Eval routing check: {name} flags {flagged} stored responses, and ran on {ran}")
+        ok &= flagged == ran
+    return ok
+
+
+def main() -> None:
+    parser = build_parser(__doc__)
+    parser.set_defaults(eval_latency=0.02, concurrency=[1, 8])
+    args = parser.parse_args()
+
+    if not check_sweep(args):
+        print("Evals skipped by routing flag responses in threshold sweeps", file=sys.stderr)
+        sys.exit(1)
+    args.route_evals = False
+    print("Without eval routing:")
+    before = run(args)
+    args.route_evals = True
+    print("With eval routing:")
+    after = run(args)
+    for label, result in after.items():
+        old = before[label]
+        print(
+            f"{label:>12}  p50 {(old['p50'] - result['p50']) * 1000:+6.1f} ms saved  "
+            f"p95 {(old['p95'] - result['p95']) * 1000:+6.1f} ms saved  QPS {result['qps'] / old['qps'] - 1:+.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Latency benchmark for local retrieval (`LocalRetriever` and `HybridRetriever`) as the corpus grows.
+
+The corpus is `example_data/cursor_docs`, grown to the requested number of chunks with copies of its chunks whose
+words are randomly shuffled and resampled, so that postings lists and vocabulary grow as they would in a larger
+collection. Questions are taken from `example_queries.md`. Run with `uv run -m bench.retrieval`.
+
+First, it checks that `HybridRetriever` scores are comparable to `SIMILARITY_SCORE_THRESHOLD`: questions unrelated to
+the corpus must retrieve no chunks above the threshold, or the command fails.
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+
+from bm25 import BM25Index
+from constants import SIMILARITY_SCORE_THRESHOLD
+from embeddings import HashingEmbedder
+from local_index import Chunk, LocalIndex, content_hash
+from retrieval import HybridRetriever, LocalRetriever
+
+
+def load_questions() -> list[str]:
+    lines = Path("example_queries.md").read_text().splitlines()
+    return [line.removeprefix("- ") for line in lines if line.startswith("- ")]
+
+
+# questions unrelated to the Cursor docs
+IRRELEVANT_QUESTIONS = ["asdkjh qwpoeiru zmxncb", "best recipe for banana bread"]
+
+
+def check_relevance(index: LocalIndex) -> bool:
+    """Returns whether the hybrid retriever keeps no chunks (above the score threshold) for irrelevant questions."""
+    retriever = HybridRetriever(index)
+    ok = True
+    for question in IRRELEVANT_QUESTIONS:
+        kept = sum(result["score"] >= SIMILARITY_SCORE_THRESHOLD for result in retriever.retrieve(question))
+        print(f"Relevance check: {question!r} keeps {kept} chunks")
+        ok &= kept == 0
+    return ok
+
+
+def grow_index(base: LocalIndex, num_chunks: int, rng: random.Random) -> LocalIndex:
+    vocabulary = sorted({word for chunk in base.chunks for word in chunk["text"].split()})
+    chunks = list(base.chunks)
+    while len(chunks) < num_chunks:
+        words = rng.choice(base.chunks)["text"].split()
+        rng.shuffle(words)
+        words = [rng.choice(vocabulary) if rng.random() < 0.3 else word for word in words]
+        text = " ".join(words)
+        chunks.append(Chunk(source="synthetic", text=text, hash=content_hash(text)))
+    texts = [chunk["text"] for chunk in chunks]
+    return LocalIndex(chunks, base.embedder.embed(texts), BM25Index.build(texts), base.embedder, base.file_hashes)
+
+
+def bench(label: str, search: Callable[[str], object], questions: list[str], repeat: int) -> None:
+    latencies = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            search(question)
+            latencies.append(time.perf_counter() - start)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{label:>24}  p50 {quantiles[49] * 1000:6.2f} ms  p95 {quantiles[94] * 1000:6.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000, 10_000, 50_000], help="corpus sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="times to run each question")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base = LocalIndex.build(embedder=HashingEmbedder())
+    questions = load_questions()
+    if not check_relevance(base):
+        print("Hybrid retrieval scores don't separate relevant from irrelevant chunks", file=sys.stderr)
+        sys.exit(1)
+    for num_chunks in args.chunks:
+        start = time.perf_counter()
+        index = grow_index(base, num_chunks, rng)
+        print(f"{len(index.chunks)} chunks (built in {time.perf_counter() - start:.1f} s)")
+        bench("dense (LocalRetriever)", LocalRetriever(index).retrieve, questions, args.repeat)
+        bench("keyword (BM25)", partial(index.keyword_search, k=5), questions, args.repeat)
+        bench("hybrid (HybridRetriever)", HybridRetriever(index).retrieve, questions, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
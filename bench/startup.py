@@ -0,0 +1,99 @@
+"""
+Startup time budget for the entry points.
+
+Runs each startup step (importing `cli.py` and `ui.py`, and creating the `RAG` in use) in a fresh interpreter with
+`-X importtime`, and reports its wall time and the modules that took longest to import. The command fails if a step
+exceeds its time budget, or if importing an entry point imports a module that is meant to be imported lazily (the
+Bedrock, Cleanlab, and Gradio SDKs), which is how startup regressions usually creep in. Run with
+`uv run -m bench.startup`.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str
+    code: str  # run in a fresh interpreter, from the repository root
+    budget: float  # seconds
+    lazy_modules: tuple[str, ...] = ()  # top-level packages that the step must not import
+
+
+# the SDKs that are imported when the RAG system first needs them (or is warmed up; see `BaseRAG.warm`)
+LAZY_MODULES = ("boto3", "botocore", "cleanlab_codex", "cleanlab_tlm", "aiohttp", "gradio", "pandas", "pyarrow")
+
+STEPS = (
+    Step("import cli", "import cli", budget=0.5, lazy_modules=LAZY_MODULES),
+    Step("import ui", "import ui", budget=0.5, lazy_modules=LAZY_MODULES),
+    # creating the RAG imports the TLM SDK (for its evals), but no clients
+    Step(
+        "create RAG",
+        "import cli; cli.load_rag_class()()",
+        budget=1.5,
+        lazy_modules=("boto3", "botocore", "cleanlab_codex", "gradio"),
+    ),
+)
+
+
+@dataclass
+class Measurement:
+    seconds: float
+    imports: dict[str, tuple[float, float]]  # module -> (self, cumulative) import time in seconds
+
+
+def measure(step: Step) -> Measurement:
+    code = f"import time\nstart = time.perf_counter()\n{step.code}\nprint(time.perf_counter() - start)"
+    env = {**os.environ, "RAG_KNOWLEDGE_BASE_ID": os.environ.get("RAG_KNOWLEDGE_BASE_ID", "stub")}
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, check=True
+    )
+    imports = {}
+    for line in process.stderr.splitlines():
+        # e.g., "import time:       304 |     149543 |   patch_aiohttp" (in microseconds)
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        imports[module.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return Measurement(seconds=float(process.stdout.split()[-1]), imports=imports)
+
+
+def check(step: Step, measurement: Measurement, budget_scale: float, top: int) -> list[str]:
+    """Prints the measurement of a step, and returns its violations of the budget."""
+    budget = step.budget * budget_scale
+    print(f"{step.name:>12}  {measurement.seconds * 1000:7.1f} ms  (budget {budget * 1000:.0f} ms)")
+    slowest = sorted(measurement.imports.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    for module, (self_time, cumulative) in slowest:
+        print(f"{'':>12}  {self_time * 1000:7.1f} ms  {module} ({cumulative * 1000:.1f} ms with its imports)")
+    violations = []
+    if measurement.seconds > budget:
+        violations.append(f"{step.name} took {measurement.seconds * 1000:.0f} ms (budget {budget * 1000:.0f} ms)")
+    packages = {module.partition(".")[0] for module in measurement.imports}
+    for package in sorted(packages.intersection(step.lazy_modules)):
+        violations.append(f"{step.name} imported {package}, which should be imported lazily")
+    return violations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per step, of which the fastest is reported")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiplies the budgets, for slower machines")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest module imports to show per step")
+    args = parser.parse_args()
+
+    violations = []
+    for step in STEPS:
+        measurement = min((measure(step) for _ in range(args.repeat)), key=lambda m: m.seconds)
+        violations += check(step, measurement, args.budget_scale, args.top)
+    for violation in violations:
+        print(violation)
+    if violations:
+        sys.exit(1)
+    print("All startup steps within budget")
+
+
+if __name__ == "__main__":
+    main()
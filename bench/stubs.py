@@ -0,0 +1,151 @@
+"""
+Local stand-ins for the Bedrock clients and the Codex `Validator`, for benchmarking without AWS/Cleanlab credentials.
+
+Each stub sleeps to simulate the network round trip and returns a response with the same shape as the real service.
+The sleep is either a fixed number of seconds or drawn from a `Latency` distribution with a fixed seed, so runs are
+reproducible.
+"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from cleanlab_codex.validator import BadResponseThresholds
+from cleanlab_tlm.utils.rag import Eval as TrustworthyRAGEval
+from cleanlab_tlm.utils.rag import get_default_evals
+
+from async_clients import AsyncValidator
+
+
+@dataclass
+class Latency:
+    """
+    A distribution of simulated latencies, in seconds.
+
+    `jitter` is the half-width of the "uniform" distribution and the standard deviation of the "normal" and
+    "lognormal" ones (whose `mean` is preserved, to make distributions comparable). Samples are never negative.
+    """
+
+    mean: float
+    jitter: float = 0.0
+    distribution: Literal["fixed", "uniform", "normal", "lognormal"] = "fixed"
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()  # stubs are called from many threads
+
+    def sample(self) -> float:
+        if self.distribution == "fixed" or self.jitter == 0:
+            return self.mean
+        with self._lock:
+            if self.distribution == "uniform":
+                value = self._rng.uniform(self.mean - self.jitter, self.mean + self.jitter)
+            elif self.distribution == "normal":
+                value = self._rng.gauss(self.mean, self.jitter)
+            else:
+                sigma = math.sqrt(math.log1p((self.jitter / self.mean) ** 2))
+                value = self._rng.lognormvariate(math.log(self.mean) - sigma**2 / 2, sigma)
+        return max(0.0, value)
+
+
+def _latency(latency: float | Latency) -> Latency:
+    return latency if isinstance(latency, Latency) else Latency(latency)
+
+
+class StubBedrockAgentRuntime:
+    def __init__(self, latency: float | Latency, num_results: int = 5) -> None:
+        self._latency = _latency(latency)
+        self._num_results = num_results
+
+    def retrieve(self, **kwargs: Any) -> dict[str, Any]:
+        time.sleep(self._latency.sample())
+        question = kwargs["retrievalQuery"]["text"]
+        return {
+            "retrievalResults": [
+                {"content": {"text": f"Stub context {index} for: {question}"}, "score": 1.0 - index / 10}
+                for index in range(self._num_results)
+            ]
+        }
+
+
+class StubBedrockRuntime:
+    def __init__(self, latency: float | Latency) -> None:
+        self._latency = _latency(latency)
+
+    def converse(self, **kwargs: Any) -> dict[str, Any]:
+        time.sleep(self._latency.sample())
+        return {"output": {"message": {"role": "assistant", "content": [{"text": "Stub response."}]}}}
+
+    def converse_stream(self, **kwargs: Any) -> dict[str, Any]:
+        return {"stream": self._stream(["Stub", " response", "."])}
+
+    def _stream(self, pieces: list[str]) -> Iterator[dict[str, Any]]:
+        # the total latency is spread over the pieces, like tokens arriving over the course of a generation
+        latency = self._latency.sample()
+        yield {"messageStart": {"role": "assistant"}}
+        for piece in pieces:
+            time.sleep(latency / len(pieces))
+            yield {"contentBlockDelta": {"delta": {"text": piece}, "contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+
+
+class StubTrustworthyRAG:
+    """
+    Stands in for the `TrustworthyRAG` client of a `Validator`, scoring every response as good.
+
+    Each call takes `latency` plus `eval_latency` for each eval, since TrustworthyRAG runs an LLM call per eval.
+    """
+
+    def __init__(self, latency: float | Latency, evals: list[TrustworthyRAGEval], eval_latency: float = 0.0) -> None:
+        self._latency = _latency(latency)
+        self._evals = evals
+        self._eval_latency = eval_latency
+
+    def get_evals(self) -> list[TrustworthyRAGEval]:
+        return self._evals.copy()
+
+    def _delay(self) -> float:
+        return self._latency.sample() + self._eval_latency * len(self._evals)
+
+    def _scores(self) -> dict[str, Any]:
+        return {
+            "trustworthiness": {"score": 0.9, "log": {"explanation": "Stub explanation."}},
+            **{eval.name: {"score": 0.9} for eval in self._evals},
+        }
+
+    def score(self, **kwargs: Any) -> dict[str, Any]:
+        time.sleep(self._delay())
+        return self._scores()
+
+    async def score_async(self, **kwargs: Any) -> dict[str, Any]:
+        await asyncio.sleep(self._delay())
+        return self._scores()
+
+
+class StubValidator(AsyncValidator):
+    """A `Validator` whose TrustworthyRAG and Codex calls are stubbed; Codex has `expert_answer` for every question."""
+
+    def __init__(
+        self,
+        latency: float | Latency,
+        expert_answer: str | None = None,
+        evals: list[TrustworthyRAGEval] | None = None,
+        eval_latency: float = 0.0,
+    ) -> None:
+        # deliberately skips Validator.__init__, which connects to Codex and TLM
+        self._latency = _latency(latency)
+        self._expert_answer = expert_answer
+        self._tlm_rag = StubTrustworthyRAG(  # type: ignore[assignment]
+            self._latency, evals if evals is not None else get_default_evals(), eval_latency
+        )
+        self._bad_response_thresholds = BadResponseThresholds()
+
+    def _remediate(self, *, query: str, metadata: dict[str, Any] | None = None) -> str | None:
+        time.sleep(self._latency.sample())
+        return self._expert_answer
@@ -0,0 +1,220 @@
+"""
+Offline benchmark suite for `RAG.query` against stubbed Bedrock / Codex backends.
+
+Drives the RAG system with the questions from a file (by default, `example_queries.md`; see `cli.load_questions` for
+the supported formats) at each requested level of concurrency, with retrieval, generation, and validation latencies
+drawn from seeded distributions (see `bench.stubs.Latency`). Reports the p50/p95/p99 latency, the throughput, and
+the peak memory use of each level.
+
+Save the results with `--save-baseline` and compare later runs against them with `--baseline`: the command fails if
+a latency percentile or the throughput regressed by more than the tolerance. Run with
+`uv run -m bench.suite --baseline bench/baseline.json`. Changes in memory use are reported, but don't fail the
+command: peak RSS depends on the Python build, the allocator, and which optional packages are installed, so it isn't
+reproducible across machines.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, TypedDict
+
+from cleanlab_tlm.utils.rag import get_default_evals
+
+from bench.stubs import Latency, StubBedrockAgentRuntime, StubBedrockRuntime, StubValidator
+from cli import load_questions
+from eval_routing import EvalRouter
+from rag_base import RAGOptions
+from solutions.part4 import CUSTOM_EVALS, RAG
+from tiered_validation import TieredValidation
+
+
+class Result(TypedDict):
+    queries: int
+    qps: float
+    p50: float  # seconds
+    p95: float
+    p99: float
+    max_rss_mb: float  # peak resident set size of the process so far
+
+
+# how each metric regresses: latencies regress when they grow, throughput when it shrinks
+LOWER_IS_BETTER = {"p50": True, "p95": True, "p99": True, "qps": False}
+# metrics that are compared with the baseline only for information
+REPORTED = ["max_rss_mb"]
+
+
+def make_rag(args: argparse.Namespace) -> RAG:
+    os.environ.setdefault("RAG_KNOWLEDGE_BASE_ID", "stub")  # only passed through to the stub
+
+    def latency(mean: float, seed: int) -> Latency:
+        return Latency(mean, args.jitter * mean, args.distribution, seed=args.seed + seed)
+
+    options: RAGOptions = {
+        "bedrock_runtime": StubBedrockRuntime(latency(args.generate_latency, 1)),
+        "bedrock_agent_runtime": StubBedrockAgentRuntime(latency(args.retrieve_latency, 2)),
+        "bedrock_agent": None,
+        "validator": StubValidator(
+            latency(args.validate_latency, 3), evals=get_default_evals() + CUSTOM_EVALS, eval_latency=args.eval_latency
+        ),
+    }
+    if args.tiered:
+        options["tiered_validation"] = TieredValidation()
+    if args.route_evals:
+        options["eval_router"] = EvalRouter()
+    if not args.cache:
+        options["retrieval_cache"] = None
+        options["response_cache"] = None
+        options["single_flight"] = None
+    return RAG(**options)
+
+
+def max_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10  # bytes on macOS, KiB on Linux
+
+
+def summarize(latencies: list[float], elapsed: float) -> Result:
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "queries": len(latencies),
+        "qps": len(latencies) / elapsed,
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def run_query(rag: RAG, questions: list[str], concurrency: int) -> Result:
+    def one(question: str) -> float:
+        start = time.perf_counter()
+        rag.query(question)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, questions))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_aquery(rag: RAG, questions: list[str], concurrency: int) -> Result:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(question: str) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await rag.aquery(question)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(question) for question in questions))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run(args: argparse.Namespace) -> dict[str, Result]:
+    questions = list(load_questions(args.questions))
+    if not questions:
+        msg = f"No questions found in {args.questions}"
+        raise ValueError(msg)
+    results = {}
+    for concurrency in args.concurrency:
+        rag = make_rag(args)  # a fresh RAG (and latency seeds) for each level, so each level is reproducible
+        batch = list(itertools.islice(itertools.cycle(questions), args.queries))
+        if args.mode == "query":
+            result = run_query(rag, batch, concurrency)
+        else:
+            result = asyncio.run(run_aquery(rag, batch, concurrency))
+        label = f"{args.mode} x{concurrency}"
+        print(
+            f"{label:>12}  {result['qps']:8.1f} QPS  p50 {result['p50'] * 1000:7.1f} ms  "
+            f"p95 {result['p95'] * 1000:7.1f} ms  p99 {result['p99'] * 1000:7.1f} ms  "
+            f"max RSS {result['max_rss_mb']:6.1f} MiB",
+            flush=True,
+        )
+        if rag.eval_router is not None:
+            print(f"{'':>12}  eval routing: {rag.eval_router.stats}")
+        if rag.tiered_validation is not None:
+            print(f"{'':>12}  tiered validation: {rag.tiered_validation.stats}")
+        results[label] = result
+    return results
+
+
+def compare(results: dict[str, Result], baseline: dict[str, Any], tolerance: float) -> int:
+    """
+    Compares the results with a baseline, printing each metric that changed by more than the tolerance, and the change
+    in each `REPORTED` metric.
+
+    Returns:
+        int: The number of regressions.
+    """
+    regressions = 0
+    for label, result in results.items():
+        if label not in baseline["results"]:
+            print(f"{label}: not in the baseline")
+            continue
+        for metric, lower_is_better in LOWER_IS_BETTER.items():
+            old, new = baseline["results"][label][metric], result[metric]  # type: ignore[literal-required]
+            change = (new - old) / old if old else 0.0
+            if abs(change) <= tolerance:
+                continue
+            regressed = change > 0 if lower_is_better else change < 0
+            regressions += regressed
+            print(f"{label}: {metric} {old:.4g} -> {new:.4g} ({change:+.1%}){' REGRESSION' if regressed else ''}")
+        for metric in REPORTED:
+            old, new = baseline["results"][label][metric], result[metric]  # type: ignore[literal-required]
+            print(f"{label}: {metric} {old:.4g} -> {new:.4g} ({(new - old) / old if old else 0.0:+.1%}, not compared)")
+    return regressions
+
+
+def build_parser(description: str | None = __doc__) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, default=Path("example_queries.md"))
+    parser.add_argument("--queries", type=int, default=100, help="queries per concurrency level (cycling questions)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--mode", choices=["query", "aquery"], default="query", help="the RAG method to drive")
+    parser.add_argument("--retrieve-latency", type=float, default=0.02, help="mean retrieval latency (seconds)")
+    parser.add_argument("--generate-latency", type=float, default=0.1, help="mean generation latency (seconds)")
+    parser.add_argument("--validate-latency", type=float, default=0.05, help="mean validation latency (seconds)")
+    parser.add_argument("--eval-latency", type=float, default=0.0, help="added validation latency per eval (seconds)")
+    parser.add_argument("--tiered", action="store_true", help="run local checks before TrustworthyRAG")
+    parser.add_argument("--route-evals", action="store_true", help="skip evals that are irrelevant to each query")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency jitter, as a fraction of the mean")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "normal", "lognormal"], default="lognormal")
+    parser.add_argument("--seed", type=int, default=0)
+    # with a small set of repeated questions, the caches (and coalescing) would answer most queries
+    parser.add_argument("--cache", action="store_true", help="enable the caches and request coalescing")
+    parser.add_argument("--baseline", type=Path, help="compare the results with this baseline")
+    parser.add_argument("--save-baseline", type=Path, help="save the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change in latency and QPS")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+
+    # read before running, in case the baseline is also being saved to
+    baseline = json.loads(args.baseline.read_text()) if args.baseline is not None else None
+    results = run(args)
+    ignored = {"baseline", "save_baseline", "tolerance"}
+    config = {key: str(value) for key, value in vars(args).items() if key not in ignored}
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps({"config": config, "results": results}, indent=2) + "\n")
+    if baseline is not None:
+        if baseline["config"] != config:
+            print(f"Warning: the baseline was recorded with different settings: {baseline['config']}")
+        if regressions := compare(results, baseline, args.tolerance):
+            print(f"{regressions} regressions compared to {args.baseline}")
+            sys.exit(1)
+        print(f"No regressions compared to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Runs blocking calls from asyncio code.
+
+boto3 (and the Codex SDK) have no asyncio support, so `run_blocking` and `iterate_blocking` run their blocking calls on
+a dedicated thread pool that is sized to match the boto3 connection pool; the event loop itself never blocks on network
+I/O.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+from collections.abc import AsyncGenerator, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import cast
+
+from constants import MAX_CONCURRENCY
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="rag-io")
+    return _executor
+
+
+async def run_blocking[**P, T](func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Runs a blocking function (e.g., a boto3 client call) on the shared I/O thread pool.
+
+    Like `asyncio.to_thread`, the function runs in a copy of the caller's context, so it records into the caller's
+    trace (see `tracing.py`).
+
+    Args:
+        func (Callable): The blocking function to run.
+        *args: Positional arguments for `func`.
+        **kwargs: Keyword arguments for `func`.
+
+    Returns:
+        The return value of `func`.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), partial(context.run, func, *args, **kwargs))
+
+
+_END = object()  # marks the end of an iterator in `iterate_blocking`'s queue
+
+
+def iterate_blocking[**P, T](
+    func: Callable[P, Iterable[T]], *args: P.args, **kwargs: P.kwargs
+) -> AsyncGenerator[T]:
+    """
+    Consumes a blocking iterable (e.g., a boto3 event stream) on the shared I/O thread pool, yielding its items as
+    they arrive.
+
+    If the caller stops iterating early, the iterable is abandoned after its next item. As with `run_blocking`, the
+    iterable is consumed in a copy of the context this is called in.
+
+    Args:
+        func (Callable): A blocking function that returns the iterable; it is also called on the thread pool.
+        *args: Positional arguments for `func`.
+        **kwargs: Keyword arguments for `func`.
+
+    Yields:
+        The items of the iterable returned by `func`.
+    """
+    return _iterate_blocking(contextvars.copy_context(), partial(func, *args, **kwargs))
+
+
+async def _iterate_blocking[T](context: contextvars.Context, func: Callable[[], Iterable[T]]) -> AsyncGenerator[T]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[tuple[object, BaseException | None]] = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item: object, error: BaseException | None = None) -> None:
+        # the event loop is closed if the caller stopped iterating early and then shut the loop down
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+
+    def produce() -> None:
+        try:
+            for item in func():
+                if stop.is_set():
+                    return
+                put(item)
+        except BaseException as e:
+            put(_END, e)
+        else:
+            put(_END)
+
+    loop.run_in_executor(_get_executor(), context.run, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield cast(T, item)
+    finally:
+        stop.set()
@@ -0,0 +1,119 @@
+import json
+import re
+from collections import Counter
+from collections.abc import Sequence
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import numpy.typing as npt
+
+from constants import BM25_B, BM25_K1
+from vector_index import top_k
+
+# common English words, which would otherwise match every chunk phrased like a question ("How do I ...")
+STOPWORDS = frozenset(
+    {
+        "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "could", "do", "does", "for", "from", "had",
+        "has", "have", "how", "i", "if", "in", "into", "is", "it", "its", "me", "my", "no", "not", "of", "on", "or",
+        "our", "so", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to", "was", "we",
+        "were", "what", "when", "where", "which", "who", "why", "will", "with", "would", "you", "your",
+    }
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [word for word in re.findall(r"\w+", text.casefold()) if word not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    An inverted index that scores documents against keyword queries with Okapi BM25.
+
+    Postings are stored in compressed sparse row form: the postings of the term with ID `t` are
+    `doc_ids[offsets[t]:offsets[t + 1]]`, sorted by document. Since each posting's BM25 weight only depends on the
+    document and the term, weights are computed once at build time, and a search just sums the weights of the query
+    terms' postings.
+    """
+
+    def __init__(
+        self,
+        vocabulary: dict[str, int],
+        offsets: npt.NDArray[np.int64],
+        doc_ids: npt.NDArray[np.int32],
+        weights: npt.NDArray[np.float32],
+        num_docs: int,
+    ) -> None:
+        self._vocabulary = vocabulary  # term -> term ID
+        self._offsets = offsets
+        self._doc_ids = doc_ids
+        self._weights = weights
+        self.num_docs = num_docs
+
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """
+        Indexes `texts`, which are later identified by their positions.
+
+        Args:
+            texts (Sequence[str]): The documents to index.
+            k1 (float): Controls how quickly repeated occurrences of a term stop adding to a document's score.
+            b (float): Controls how much scores are normalized by document length (0 = not at all, 1 = fully).
+        """
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        doc_lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        avg_length = float(doc_lengths.mean()) if len(texts) else 0.0
+
+        vocabulary: dict[str, int] = {}
+        postings: list[list[tuple[int, int]]] = []
+        for doc_id, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_id, count))
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+        doc_ids = np.array([doc_id for term_postings in postings for doc_id, _ in term_postings], dtype=np.int32)
+        term_freqs = np.array([count for term_postings in postings for _, count in term_postings], dtype=np.float32)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+
+        idf = np.log1p((len(texts) - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        length_norm = k1 * (1 - b + b * doc_lengths[doc_ids] / max(avg_length, 1.0))
+        weights = np.repeat(idf, np.diff(offsets)) * term_freqs * (k1 + 1) / (term_freqs + length_norm)
+        return cls(vocabulary, offsets, doc_ids, weights.astype(np.float32), len(texts))
+
+    def save(self, path: str | Path | BinaryIO) -> None:
+        np.savez(
+            path,
+            vocabulary=np.array(json.dumps(list(self._vocabulary))),
+            offsets=self._offsets,
+            doc_ids=self._doc_ids,
+            weights=self._weights,
+            num_docs=np.array(self.num_docs),
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BM25Index":
+        with np.load(path) as arrays:
+            terms = json.loads(str(arrays["vocabulary"]))
+            return cls(
+                {term: term_id for term_id, term in enumerate(terms)},
+                arrays["offsets"],
+                arrays["doc_ids"],
+                arrays["weights"],
+                int(arrays["num_docs"]),
+            )
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Returns the (position, BM25 score) pairs of the `k` best matching documents, best first."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            # each document appears at most once in a term's postings, so this needs no np.add.at
+            scores[self._doc_ids[start:end]] += self._weights[start:end]
+        return [(position, score) for position, score in top_k(scores, k) if score > 0]
@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TypedDict
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question for use in a cache key, so trivially different spellings of a question share an entry.
+
+    Args:
+        question (str): The user question.
+
+    Returns:
+        str: The question, case-folded, with whitespace collapsed and trailing punctuation removed.
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").casefold()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0  # entries dropped to stay within the size bound
+    expirations: int = 0  # entries dropped because they outlived the TTL
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class Cache[V](ABC):
+    """
+    A size-bounded key-value cache whose entries expire after a TTL.
+
+    Keys are strings; by convention they start with a namespace (e.g., the retriever fingerprint) so that related
+    entries can be dropped together with `invalidate`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl  # in seconds; None means entries never expire
+        self.stats = CacheStats()
+
+    @abstractmethod
+    def get(self, key: str) -> V | None:
+        """Returns the cached value for `key`, or None on a miss."""
+
+    @abstractmethod
+    def set(self, key: str, value: V, expires_at: float | None = None) -> None:
+        """
+        Caches `value` under `key`, evicting the least recently used entries if the cache is full.
+
+        The entry expires at `expires_at` (a Unix timestamp), by default one TTL from now.
+        """
+
+    @abstractmethod
+    def invalidate(self, prefix: str = "") -> int:
+        """Drops every entry whose key starts with `prefix` (all entries by default) and returns how many there were."""
+
+    def _expires_at(self, expires_at: float | None = None) -> float:
+        if expires_at is not None:
+            return expires_at
+        return time.time() + self.ttl if self.ttl is not None else float("inf")
+
+
+class LRUCache[V](Cache[V]):
+    """An in-memory cache with least-recently-used eviction. Safe to use from multiple threads."""
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        super().__init__(maxsize, ttl)
+        self._entries: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: V, expires_at: float | None = None) -> None:
+        with self._lock:
+            self._entries[key] = (self._expires_at(expires_at), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, prefix: str = "") -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+
+class SQLiteCache[V](Cache[V]):
+    """
+    An on-disk cache backed by a SQLite database, with least-recently-used eviction.
+
+    Values must be JSON-serializable. Entries persist across restarts, and the database can be shared by several
+    processes on the same machine. Each `table` in the database is an independent cache.
+    """
+
+    def __init__(self, path: str | Path, maxsize: int, ttl: float | None = None, table: str = "cache") -> None:
+        super().__init__(maxsize, ttl)
+        if not table.isidentifier():
+            msg = f"Invalid cache table name: {table!r}"
+            raise ValueError(msg)
+        self._table = table
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    def get(self, key: str) -> V | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._db.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._db.execute(f"UPDATE {self._table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.stats.hits += 1
+        result: V = json.loads(value)
+        return result
+
+    def set(self, key: str, value: V, expires_at: float | None = None) -> None:
+        serialized = json.dumps(value)
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, serialized, self._expires_at(expires_at), time.time()),
+            )
+            (size,) = self._db.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()
+            if size > self.maxsize:
+                self._db.execute(
+                    f"DELETE FROM {self._table} WHERE key IN "
+                    f"(SELECT key FROM {self._table} ORDER BY accessed_at LIMIT ?)",
+                    (size - self.maxsize,),
+                )
+                self.stats.evictions += size - self.maxsize
+
+    def invalidate(self, prefix: str = "") -> int:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._lock:
+            cursor = self._db.execute(f"DELETE FROM {self._table} WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",))
+        deleted: int = cursor.rowcount
+        return deleted
+
+
+class CacheSnapshot(TypedDict):
+    """The entries of several caches, as computed ahead of time (see precompute.py)."""
+
+    created_at: float  # Unix timestamp; every entry was computed after it
+    caches: dict[str, dict[str, Any]]  # the entries of each cache, by name (e.g., "responses")
+
+
+def save_snapshot(path: str | Path, snapshot: CacheSnapshot) -> None:
+    """Writes a snapshot as JSON, atomically, so that readers never see a partially written one."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temporary.write_text(json.dumps(snapshot))
+    temporary.replace(path)
+
+
+def load_snapshot(path: str | Path, caches: Mapping[str, Cache[Any] | None]) -> int:
+    """
+    Sets the entries of a snapshot in the caches of the same names.
+
+    Each entry expires one TTL after the snapshot was created, as if it had been set then, so a stale snapshot loads
+    nothing. Caches that are None, or absent from the snapshot, are skipped.
+
+    Args:
+        path (str | Path): The snapshot, as written by `save_snapshot`.
+        caches (Mapping[str, Cache | None]): The caches to fill, by name.
+
+    Returns:
+        int: The number of entries loaded.
+    """
+    snapshot: CacheSnapshot = json.loads(Path(path).read_text())
+    now = time.time()
+    loaded = 0
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        expires_at = snapshot["created_at"] + cache.ttl if cache.ttl is not None else float("inf")
+        if expires_at <= now:
+            continue
+        for key, value in snapshot["caches"].get(name, {}).items():
+            cache.set(key, value, expires_at)
+            loaded += 1
+    return loaded
@@ -1,34 +1,186 @@
+import argparse
+import importlib
+import json
+import logging
 import os
 import pprint
+import sys
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future
+from pathlib import Path
+from typing import TYPE_CHECKING, Unpack
 
 from dotenv import load_dotenv
 
-import patch_aiohttp  # noqa: F401
+from cache import LRUCache, SQLiteCache, load_snapshot
+from constants import (
+    BATCH_MAX_WORKERS,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL,
+)
+from local_index import LocalIndex
+from rag_base import BaseRAG, RAGOptions
+from rate_limit import Scheduler
+from result_store import ResultStore
+from retrieval import HybridRetriever
 
-USE_SOLUTION = os.environ.get("USE_SOLUTION")
-if USE_SOLUTION is not None:
-    if USE_SOLUTION in {"1", "2", "3", "4"}:
-        import importlib
-        solution = importlib.import_module(f"solutions.part{USE_SOLUTION}")
-        RAG = solution.RAG
-    else:
-        msg = f"Invalid USE_SOLUTION value: {USE_SOLUTION}. Expected '1', '2', '3', or '4'."
-        raise ValueError(msg)
-else:
+if TYPE_CHECKING:
     from rag import RAG
 
+logger = logging.getLogger(__name__)
+
+USE_SOLUTION = os.environ.get("USE_SOLUTION")
+if USE_SOLUTION is not None and USE_SOLUTION not in {"1", "2", "3", "4"}:
+    msg = f"Invalid USE_SOLUTION value: {USE_SOLUTION}. Expected '1', '2', '3', or '4'."
+    raise ValueError(msg)
+
+
+def load_rag_class() -> type["RAG"]:
+    """
+    Imports the `RAG` class in use: the workshop's (`rag.py`), or that of the solution selected with `USE_SOLUTION`.
+
+    Only the selected module is imported, and only when this is first called (it imports the TLM SDK).
+    """
+    module = importlib.import_module("rag" if USE_SOLUTION is None else f"solutions.part{USE_SOLUTION}")
+    rag_class: type[RAG] = module.RAG
+    return rag_class
+
+
+def env_options() -> RAGOptions:
+    """
+    Returns the RAG options that servers (`ui.py`, `api.py`) take from the environment:
+
+    - `RESULT_STORE`: a directory to keep a record of each query in (see result_store.py).
+    - `SHARED_CACHE`: a SQLite database to keep the retrieval and response caches in, shared by processes (see
+      serve.py) and kept across restarts.
+    - `CACHE_SNAPSHOT`: a snapshot of precomputed cache entries (see precompute.py) to load into the caches.
+    - `RATE_LIMIT`: if set (to anything but "0" or ""), calls to the backends queue for the quotas in `RATE_LIMITS`
+      (see rate_limit.py; set these to your account's quotas first) rather than failing with throttling errors.
+    """
+    options: RAGOptions = {}
+    if "RESULT_STORE" in os.environ:
+        options["result_store"] = ResultStore(os.environ["RESULT_STORE"])
+    if "SHARED_CACHE" in os.environ:
+        path = Path(os.environ["SHARED_CACHE"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        options["retrieval_cache"] = SQLiteCache(path, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL, table="retrieval")
+        options["response_cache"] = SQLiteCache(path, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, table="responses")
+    if "CACHE_SNAPSHOT" in os.environ:
+        # the caches the RAG would create by default, if they aren't shared
+        options.setdefault("retrieval_cache", LRUCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL))
+        options.setdefault("response_cache", LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL))
+        snapshot = os.environ["CACHE_SNAPSHOT"]
+        caches = {"retrieval": options["retrieval_cache"], "responses": options["response_cache"]}
+        try:
+            loaded = load_snapshot(snapshot, caches)
+        except FileNotFoundError:
+            # e.g., the precompute job hasn't run yet; the caches warm up with traffic instead
+            logger.warning("Cache snapshot %s not found", snapshot)
+        else:
+            logger.info("Loaded %d cache entries from %s", loaded, snapshot)
+    if os.environ.get("RATE_LIMIT", "0") not in ("0", ""):
+        options["scheduler"] = Scheduler.from_defaults()
+    return options
+
+
+def start_rag(**options: Unpack[RAGOptions]) -> Future[BaseRAG]:
+    """
+    Imports, creates, and warms up (see `BaseRAG.warm`) the `RAG` in use on a background thread, so that startup can
+    continue meanwhile.
+    """
+    future: Future[BaseRAG] = Future()
+
+    def start() -> None:
+        try:
+            rag = load_rag_class()(**options)
+            rag.warm()
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(rag)
+
+    threading.Thread(target=start, name="rag-startup", daemon=True).start()
+    return future
+
+
+def load_questions(path: Path) -> Iterator[str]:
+    """
+    Reads questions from a file, lazily.
+
+    JSONL files contain either a JSON string or an object with a string "question" field on each line; other lines
+    are skipped with a warning that gives their line number. Markdown files (like `example_queries.md`) contain one
+    question per "- " list item. Any other file contains one question per line.
+    """
+    with path.open() as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.suffix == ".jsonl":
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    logger.warning("Skipping line %d of %s: invalid JSON (%s)", line_number, path, e)
+                    continue
+                question = record.get("question") if isinstance(record, dict) else record
+                if not isinstance(question, str):
+                    logger.warning("Skipping line %d of %s: no question string", line_number, path)
+                    continue
+                yield question
+            elif path.suffix == ".md":
+                if line.startswith("- "):
+                    yield line.removeprefix("- ")
+            else:
+                yield line
+
+
+def run_batch(rag: BaseRAG, path: Path, max_workers: int, ordered: bool) -> None:
+    failed = 0
+    for result in rag.query_batch(load_questions(path), max_workers=max_workers, ordered=ordered):
+        failed += result["error"] is not None
+        print(json.dumps(result), flush=True)
+    if failed:
+        print(f"{failed} queries failed", file=sys.stderr)
+
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Query the RAG system interactively, or in batch from a file.")
+    parser.add_argument("--batch", type=Path, help="run every question in this file and print JSONL results")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS, help="questions to run concurrently")
+    parser.add_argument("--unordered", action="store_true", help="print batch results as they complete")
+    parser.add_argument(
+        "--local-index", type=Path, help="retrieve from this local index (see local_index.py) instead of Bedrock"
+    )
+    parser.add_argument("--store", type=Path, help="append a record of each query to this result store")
+    args = parser.parse_args()
+
     load_dotenv()
-    rag = RAG()
+    options: RAGOptions = {}
+    if args.local_index is not None:
+        options["retriever"] = HybridRetriever(LocalIndex.load(args.local_index))
+    if args.store is not None:
+        options["result_store"] = ResultStore(args.store)
+    if args.batch is not None:
+        run_batch(load_rag_class()(**options), args.batch, args.workers, not args.unordered)
+        return
+    # the RAG starts up while the first question is typed
+    startup = start_rag(**options)
     print()
     try:
         while True:
             message = input("Query: ")
             if not message:
                 break
-            response = rag.query(message)
             print()
+            response = None
+            for update in startup.result().query_stream(message):
+                print(update["delta"], end="", flush=True)
+                response = update["response"]
+            assert response is not None
+            print("\n")
             pprint.pp(response)
             print(f"\n{'-' * 40}", end="\n\n")
     except (KeyboardInterrupt, EOFError):
@@ -25,4 +25,136 @@ Please write a response to the following Question, using the above Context:
 SCORE_TO_ISSUE = {
     "trustworthiness": "Untrustworthy",
     "response_helpfulness": "Unhelpful",
+    # local checks of tiered validation (see tiered_validation.py)
+    "retrieved_context": "No context retrieved",
+    "answered": "Unanswered",
 }
+
+# maximum number of Bedrock / Codex calls in flight at once (sizes both the I/O thread pool and the boto3 connection
+# pool, so queries issued through `RAG.aquery` don't queue behind each other)
+MAX_CONCURRENCY: int = 256
+
+# settings of the shared boto3 clients (see aws_clients.py): generations can take a while, hence the long read timeout;
+# "adaptive" retries back off exponentially and also rate-limit the client while Bedrock is throttling it
+AWS_CONNECT_TIMEOUT: float = 5
+AWS_READ_TIMEOUT: float = 120
+AWS_TCP_KEEPALIVE: bool = True
+AWS_RETRY_MODE: str = "adaptive"
+AWS_MAX_ATTEMPTS: int = 5
+
+# default number of questions that `RAG.query_batch` runs concurrently
+BATCH_MAX_WORKERS: int = 16
+
+# retrieval results are cached in memory for repeated questions; cached results are also invalidated when the
+# knowledge base is re-synced, which is checked at most once per KB_VERSION_CHECK_INTERVAL
+RETRIEVAL_CACHE_SIZE: int = 1024
+RETRIEVAL_CACHE_TTL: float = 60 * 60
+KB_VERSION_CHECK_INTERVAL: float = 60
+
+# responses whose validation verdict is good are cached in memory, keyed on everything that determines them (model,
+# prompt template, question, retrieved context, and eval configuration)
+RESPONSE_CACHE_SIZE: int = 1024
+RESPONSE_CACHE_TTL: float = 60 * 60
+
+# dimension of the local (hashing) embedder's vectors
+EMBEDDING_DIMENSION: int = 1024
+
+# the semantic cache (disabled by default) returns the cached response to a previous question if the two questions'
+# embeddings have at least this cosine similarity; the default suits the lexical HashingEmbedder, whose similarities
+# run higher than those of neural embedders for unrelated questions that share words
+SEMANTIC_CACHE_THRESHOLD: float = 0.9
+SEMANTIC_CACHE_SIZE: int = 4096
+# like the response cache, entries expire, and are dropped once the response fingerprint or the corpus changes
+SEMANTIC_CACHE_TTL: float = 60 * 60
+
+# local retrieval (see local_index.py): documents are split into chunks of about CHUNK_SIZE characters
+LOCAL_DOCS_DIR: str = "example_data/cursor_docs"
+LOCAL_INDEX_DIR: str = ".local_index"
+CHUNK_SIZE: int = 1500
+
+# hybrid local retrieval (see HybridRetriever in retrieval.py): the top HYBRID_CANDIDATES chunks of keyword (BM25) and
+# embedding similarity search are fused with reciprocal rank fusion; 60 is the RRF constant from the original paper
+HYBRID_CANDIDATES: int = 50
+RRF_K: int = 60
+# BM25 scores are unbounded, so for SIMILARITY_SCORE_THRESHOLD a chunk's BM25 score s is scaled to s / (s + midpoint),
+# which is 0.5 at the midpoint; with the default, the threshold of 0.3 takes a BM25 score of about 3.4
+HYBRID_BM25_MIDPOINT: float = 8.0
+BM25_K1: float = 1.2
+BM25_B: float = 0.75
+
+# upper bounds (in seconds) of the latency histogram buckets used by tracing.HistogramExporter
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# retrieved chunks are deduplicated and trimmed to a budget before they go into the prompt (see context_assembly.py):
+# chunks whose word shingles have an estimated Jaccard similarity of at least DEDUP_THRESHOLD to a more relevant
+# chunk are dropped, and the rest are kept, most relevant first, up to CONTEXT_TOKEN_BUDGET tokens (estimated at
+# CHARS_PER_TOKEN characters per token)
+CONTEXT_TOKEN_BUDGET: int = 2000
+DEDUP_THRESHOLD: float = 0.8
+SHINGLE_SIZE: int = 5
+MINHASH_PERMUTATIONS: int = 128
+CHARS_PER_TOKEN: int = 4
+
+# client-side rate limits (see rate_limit.py), off by default: the requests per second and (LLM) tokens per minute (or
+# None for no token limit) that each backend is allowed; set these to (a little below) your account's service quotas
+RATE_LIMITS: dict[str, tuple[float, float | None]] = {
+    "bedrock-agent-runtime": (10, None),
+    f"bedrock-runtime:{MODEL_ID}": (5, 100_000),
+    "tlm": (10, None),
+}
+# calls beyond this many waiting for a backend, or waiting longer than this many seconds, fail with RateLimitExceeded
+RATE_LIMIT_MAX_QUEUE_DEPTH: int = 1024
+RATE_LIMIT_MAX_WAIT: float = 60
+
+# tiered validation (see tiered_validation.py) skips the informational response_groundedness eval when at least this
+# fraction of the response's content words appear in the retrieved context
+GROUNDED_OVERLAP_THRESHOLD: float = 0.9
+
+# deferred validation (see deferred_validation.py) validates responses in the background, at most
+# DEFERRED_VALIDATION_WORKERS at once; beyond DEFERRED_VALIDATION_MAX_PENDING queued or running, responses are
+# validated inline instead
+DEFERRED_VALIDATION_WORKERS: int = 16
+DEFERRED_VALIDATION_MAX_PENDING: int = 256
+
+# eval routing (see eval_routing.py) only runs the related_to_competitor eval for questions that contain one of these
+# keywords (competing editors and assistants, or words that ask for a comparison), and the mentions_context eval for
+# responses that contain one of these
+COMPETITOR_KEYWORDS: tuple[str, ...] = (
+    "VSCode", "VS Code", "Visual Studio", "JetBrains", "IntelliJ", "PyCharm", "WebStorm", "GoLand", "Rider",
+    "Windsurf", "Codeium", "Copilot", "Zed", "Sublime", "Vim", "Neovim", "Emacs", "Eclipse", "Xcode", "Cline",
+    "Roo Code", "Tabnine", "Replit", "Aider", "Devin",
+    "competitor", "competitors", "compare", "compared", "comparison", "versus", "vs", "alternative", "alternatives",
+    "better than", "switch from", "migrate from",
+)
+CONTEXT_KEYWORDS: tuple[str, ...] = ("context", "contexts", "provided", "documentation", "according to")
+
+# the result store (see result_store.py) writes records in Arrow record batches of RESULT_STORE_BATCH_SIZE, and starts
+# a new segment file every RESULT_STORE_SEGMENT_ROWS records; uncompressed batches are larger on disk, but can be read
+# zero-copy from memory-mapped segments
+RESULT_STORE_DIR: str = ".results"
+RESULT_STORE_BATCH_SIZE: int = 256
+RESULT_STORE_SEGMENT_ROWS: int = 1_000_000
+RESULT_STORE_COMPRESSION: str | None = None
+
+# the UI's Gradio queue generates at most UI_CONCURRENCY_LIMIT chat responses at once (per process), and turns requests
+# away once UI_QUEUE_MAX_SIZE more are waiting
+UI_PORT: int = 8080
+UI_CONCURRENCY_LIMIT: int = MAX_CONCURRENCY
+UI_QUEUE_MAX_SIZE: int = 1024
+
+# production serving (see serve.py) runs the UI in several worker processes behind one port, which share their
+# retrieval and response caches through this SQLite database
+SHARED_CACHE_PATH: str = ".cache/rag.sqlite3"
+# the proxy reads JSON request bodies of at most this many bytes (to route them by their session hash) and rejects
+# larger ones; other request bodies (e.g., file uploads) are streamed to the workers without being read
+PROXY_MAX_JSON_BODY_SIZE: int = 16 * 2**20
+
+# the precompute job (see precompute.py) answers the PRECOMPUTE_TOP_N most frequent questions of a query log ahead of
+# time (well within RESPONSE_CACHE_SIZE, so that live traffic keeps room in the cache), and writes the cache entries
+# to a snapshot that servers started with CACHE_SNAPSHOT load at startup
+PRECOMPUTE_TOP_N: int = 256
+CACHE_SNAPSHOT_PATH: str = ".cache/snapshot.json"
+
+# the HTTP API (see api.py) keeps idle connections open for API_KEEPALIVE_TIMEOUT seconds
+API_PORT: int = 8000
+API_KEEPALIVE_TIMEOUT: float = 75
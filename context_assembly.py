@@ -0,0 +1,174 @@
+"""
+Assembly of the retrieved chunks that go into the prompt.
+
+Retrieval returns a fixed number of chunks, which may overlap (e.g., the same passage in several documents) and add
+up to a prompt longer than needed. The `ContextAssembler` drops chunks that are near-duplicates of a more relevant
+chunk, estimating their similarity with MinHash, and then keeps the most relevant chunks that fit in a token budget.
+Shorter prompts make both generation and TrustworthyRAG scoring faster and cheaper.
+"""
+
+import math
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from constants import CHARS_PER_TOKEN, CONTEXT_TOKEN_BUDGET, DEDUP_THRESHOLD, MINHASH_PERMUTATIONS, SHINGLE_SIZE
+from retrieval import RetrievalResult, Retriever
+from tracing import stage
+
+# a Mersenne prime larger than any 32-bit shingle hash, for the universal hash functions that MinHash permutes with
+_PRIME = (1 << 61) - 1
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens in `text` (Bedrock models don't expose their tokenizers)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass
+class AssemblyStats:
+    """What a `ContextAssembler` removed from the retrieved chunks."""
+
+    chunks: int = 0  # retrieved
+    duplicates: int = 0  # dropped as near-duplicates of a more relevant chunk
+    trimmed: int = 0  # dropped or truncated to fit in the token budget
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def add(self, other: "AssemblyStats") -> None:
+        self.chunks += other.chunks
+        self.duplicates += other.duplicates
+        self.trimmed += other.trimmed
+        self.tokens_before += other.tokens_before
+        self.tokens_after += other.tokens_after
+
+    def __str__(self) -> str:
+        return (
+            f"{self.chunks} chunks: {self.duplicates} near-duplicates removed, {self.trimmed} trimmed;"
+            f" {self.tokens_saved} of {self.tokens_before} tokens saved"
+        )
+
+
+class ContextAssembler:
+    """
+    Deduplicates retrieved chunks and trims them to a token budget, most relevant first.
+
+    Two chunks are near-duplicates if the Jaccard similarity of their sets of `shingle_size`-word shingles is at least
+    `dedup_threshold`, as estimated from MinHash signatures of `num_permutations` hash functions. Chunks are then kept
+    in order of relevance until the budget is used up; the chunk that crosses the budget is truncated to fit.
+
+    The savings of all assembled contexts are accumulated in `totals`.
+    """
+
+    def __init__(
+        self,
+        token_budget: int | None = CONTEXT_TOKEN_BUDGET,
+        dedup_threshold: float | None = DEDUP_THRESHOLD,
+        num_permutations: int = MINHASH_PERMUTATIONS,
+        shingle_size: int = SHINGLE_SIZE,
+    ) -> None:
+        """
+        Args:
+            token_budget (int | None): Maximum (estimated) number of tokens of context; None for no limit.
+            dedup_threshold (float | None): Similarity above which chunks are near-duplicates; None to keep them all.
+            num_permutations (int): Number of MinHash hash functions; more make the similarity estimates more accurate.
+            shingle_size (int): Number of consecutive words in each shingle.
+        """
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(0)  # fixed, so signatures are comparable across instances and runs
+        self._a = rng.integers(1, 1 << 31, num_permutations, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, num_permutations, dtype=np.uint64)
+        self.totals = AssemblyStats()
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.token_budget}:{self.dedup_threshold}:{len(self._a)}:{self.shingle_size}"
+
+    def assemble(self, results: list[RetrievalResult]) -> tuple[list[RetrievalResult], AssemblyStats]:
+        """
+        Args:
+            results (list[RetrievalResult]): Retrieved chunks, most relevant first.
+
+        Returns:
+            tuple: The chunks to include in the prompt, most relevant first, and what was removed.
+        """
+        stats = AssemblyStats(chunks=len(results), tokens_before=sum(estimate_tokens(r["text"]) for r in results))
+        if self.dedup_threshold is not None:
+            unique = self._deduplicate(results, self.dedup_threshold)
+            stats.duplicates = len(results) - len(unique)
+            results = unique
+        if self.token_budget is not None:
+            results, stats.trimmed = self._trim(results, self.token_budget)
+        stats.tokens_after = sum(estimate_tokens(result["text"]) for result in results)
+        with self._lock:
+            self.totals.add(stats)
+        return results, stats
+
+    def minhash(self, text: str) -> npt.NDArray[np.uint64]:
+        """Computes the MinHash signature of the word shingles of `text`."""
+        words = re.findall(r"\w+", text.lower())
+        shingles = {
+            " ".join(words[start : start + self.shingle_size])
+            for start in range(max(1, len(words) - self.shingle_size + 1))
+        }
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), np.uint64, len(shingles))
+        # (a * x + b) mod p for every hash function (rows) and shingle (columns); the products fit in 64 bits
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % np.uint64(_PRIME)
+        return permuted.min(axis=1)
+
+    def _deduplicate(self, results: list[RetrievalResult], threshold: float) -> list[RetrievalResult]:
+        kept: list[RetrievalResult] = []
+        signatures: list[npt.NDArray[np.uint64]] = []
+        for result in results:
+            signature = self.minhash(result["text"])
+            # the fraction of hash functions whose minimum agrees estimates the Jaccard similarity
+            if signatures and (np.stack(signatures) == signature).mean(axis=1).max() >= threshold:
+                continue
+            kept.append(result)
+            signatures.append(signature)
+        return kept
+
+    def _trim(self, results: list[RetrievalResult], budget: int) -> tuple[list[RetrievalResult], int]:
+        kept: list[RetrievalResult] = []
+        for index, result in enumerate(results):
+            tokens = estimate_tokens(result["text"])
+            if tokens <= budget:
+                kept.append(result)
+                budget -= tokens
+                continue
+            # truncate the first chunk that doesn't fit at a word boundary, and drop the rest
+            words = result["text"][: budget * CHARS_PER_TOKEN].rsplit(maxsplit=1)
+            if budget and words:
+                kept.append({"text": words[0], "score": result["score"]})
+            return kept, len(results) - index
+        return kept, 0
+
+
+class AssemblingRetriever(Retriever):
+    """Passes the results of another retriever through a `ContextAssembler`."""
+
+    def __init__(self, retriever: Retriever, assembler: ContextAssembler) -> None:
+        self._retriever = retriever
+        self.assembler = assembler
+
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        results = self._retriever.retrieve(question)
+        with stage("assemble_context") as attributes:
+            results, stats = self.assembler.assemble(results)
+            attributes.update(duplicates=stats.duplicates, trimmed=stats.trimmed, tokens_saved=stats.tokens_saved)
+        return results
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self._retriever.fingerprint}:assembled:{self.assembler.fingerprint}"
@@ -0,0 +1,181 @@
+"""
+Deferred validation: responses are returned as soon as they are generated, and validated in the background.
+
+Validation (TrustworthyRAG scoring, plus an expert answer lookup for bad responses) takes about as long as generation.
+For latency-sensitive channels, `RAG(validation_mode="deferred")` returns each generated response right away,
+provisionally presented as good, and validates it on a `DeferredValidation` pool. The verdict (the `Response` that
+inline validation would have returned) is delivered later, through the `verdict` future of the provisional response
+and through the pool's `on_verdict` callback. If the verdict differs from the provisional response (it is bad, or was
+replaced by an expert answer), the response is retracted: `on_retract` is called, e.g., to edit or withdraw a message
+that was already shown.
+
+The pool is bounded: at most `max_workers` validations run at once, on an event loop of their own, and at most
+`max_pending` are queued or running. When the pool is full, `submit` returns None and the response is validated
+inline instead, so that under overload responses get slower rather than piling up unvalidated.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+from constants import DEFERRED_VALIDATION_MAX_PENDING, DEFERRED_VALIDATION_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Verdict[R]:
+    question: str
+    response: R  # the validated response
+    retracted: bool  # whether the provisional response must be withdrawn in favor of `response`
+    seconds: float  # from submission to verdict
+
+
+@dataclass
+class DeferredStats:
+    submitted: int = 0
+    rejected: int = 0  # validated inline because the pool was full
+    completed: int = 0
+    retracted: int = 0
+    failed: int = 0  # validations that raised; their futures carry the exception
+    cancelled: int = 0  # validations whose future was cancelled before their verdict
+    verdict_seconds: float = 0.0  # total time from submission to verdict of the completed validations
+
+    @property
+    def pending(self) -> int:
+        return self.submitted - self.completed - self.failed - self.cancelled
+
+    @property
+    def mean_verdict_seconds(self) -> float:
+        return self.verdict_seconds / self.completed if self.completed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.completed} of {self.submitted} deferred validations completed ({self.retracted} retracted,"
+            f" {self.failed} failed, {self.cancelled} cancelled, {self.pending} pending), {self.rejected} validated"
+            f" inline; verdicts took {self.mean_verdict_seconds * 1000:.0f} ms on average"
+        )
+
+
+class DeferredValidation[R]:
+    """
+    A bounded pool that validates responses in the background and delivers their verdicts.
+
+    Like `run_blocking`, validations run in a copy of the submitter's context (e.g., keeping its rate limiting
+    priority). Callbacks run on the pool's event loop thread, so they must not block; exceptions they raise are logged.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFERRED_VALIDATION_WORKERS,
+        max_pending: int = DEFERRED_VALIDATION_MAX_PENDING,
+        on_verdict: Callable[[Verdict[R]], None] | None = None,
+        on_retract: Callable[[Verdict[R]], None] | None = None,
+    ) -> None:
+        """
+        Args:
+            max_workers (int): Maximum number of validations running at once.
+            max_pending (int): Maximum number of validations queued or running; beyond this, `submit` returns None.
+            on_verdict (Callable | None): Called with every verdict.
+            on_retract (Callable | None): Called (after `on_verdict`) with the verdicts that retract their response.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.on_verdict = on_verdict
+        self.on_retract = on_retract
+        self.stats = DeferredStats()
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def submit(
+        self,
+        question: str,
+        validate: Callable[[], Coroutine[Any, Any, R]],
+        retracts: Callable[[R], bool],
+    ) -> Future[Verdict[R]] | None:
+        """
+        Schedules a validation in the background.
+
+        Args:
+            question (str): The question whose response is validated.
+            validate (Callable): Starts the validation, returning a coroutine that resolves to the validated response.
+            retracts (Callable): Returns whether a validated response retracts the provisional response.
+
+        Returns:
+            Future | None: The future verdict, or None if the pool is full (and `validate` was not called).
+        """
+        with self._lock:
+            if self.stats.pending >= self.max_pending:
+                self.stats.rejected += 1
+                return None
+            self.stats.submitted += 1
+            loop = self._start()
+        run = self._run(question, validate, retracts, contextvars.copy_context(), time.perf_counter())
+        verdict = asyncio.run_coroutine_threadsafe(run, loop)
+        # settles validations that fail or are cancelled (even before they start), so they stop counting as pending
+        verdict.add_done_callback(self._settle)
+        return verdict
+
+    def close(self) -> None:
+        """Waits for the pending validations, then stops the pool's event loop (it restarts on the next `submit`)."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._drain(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            loop = asyncio.new_event_loop()
+            self._semaphore = asyncio.Semaphore(self.max_workers)  # binds to the loop on first use
+            threading.Thread(target=loop.run_forever, name="rag-deferred-validation", daemon=True).start()
+            self._loop = loop
+        return self._loop
+
+    def _settle(self, verdict: Future[Verdict[R]]) -> None:
+        with self._lock:
+            if verdict.cancelled():
+                self.stats.cancelled += 1
+            elif verdict.exception() is not None:
+                self.stats.failed += 1
+
+    async def _drain(self) -> None:
+        current = asyncio.current_task()
+        await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not current), return_exceptions=True)
+
+    async def _run(
+        self,
+        question: str,
+        validate: Callable[[], Coroutine[Any, Any, R]],
+        retracts: Callable[[R], bool],
+        context: contextvars.Context,
+        submitted: float,
+    ) -> Verdict[R]:
+        assert self._semaphore is not None
+        try:
+            async with self._semaphore:
+                response = await asyncio.create_task(validate(), context=context)
+        except Exception:
+            logger.warning("Deferred validation failed", exc_info=True)
+            raise
+        verdict = Verdict(question, response, retracts(response), time.perf_counter() - submitted)
+        with self._lock:
+            self.stats.completed += 1
+            self.stats.retracted += verdict.retracted
+            self.stats.verdict_seconds += verdict.seconds
+        for callback in (self.on_verdict, self.on_retract if verdict.retracted else None):
+            if callback is None:
+                continue
+            try:
+                callback(verdict)
+            except Exception:
+                logger.warning("Deferred validation callback failed", exc_info=True)
+        return verdict
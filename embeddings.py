@@ -0,0 +1,92 @@
+import re
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from constants import EMBEDDING_DIMENSION
+
+
+class Embedder(ABC):
+    """Maps text to fixed-size embedding vectors, whose dot product measures similarity."""
+
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> npt.NDArray[np.float32]:
+        """Returns a (len(texts), dimension) matrix of unit-norm embeddings, one row per text."""
+
+    @property
+    @abstractmethod
+    def fingerprint(self) -> str:
+        """Identifies the embedding model, so stored embeddings are never compared with incompatible ones."""
+
+
+class HashingEmbedder(Embedder):
+    """
+    A fast, dependency-free local embedder based on the hashing trick.
+
+    Each text is represented by its words and the character trigrams within them, hashed into `dimension` buckets
+    with sublinear term frequency weighting. This captures lexical similarity (shared words and word fragments, so
+    "logged out" and "logging out" are similar), not semantics, but it needs no model download and embeds thousands
+    of texts per second on a single core.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION) -> None:
+        self.dimension = dimension
+
+    def _features(self, text: str) -> list[str]:
+        features = []
+        for word in re.findall(r"\w+", text.casefold()):
+            features.append(word)
+            padded = f"<{word}>"
+            features.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> npt.NDArray[np.float32]:
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode())
+                # the sign bit keeps hash collisions from systematically inflating similarity
+                embeddings[row, digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+        np.copysign(np.log1p(np.abs(embeddings)), embeddings, out=embeddings)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.maximum(norms, np.finfo(np.float32).tiny)
+        return embeddings
+
+    @property
+    def fingerprint(self) -> str:
+        return f"hashing-v1:{self.dimension}"
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """
+    A local neural embedder, which captures meaning rather than just wording (e.g., it can tell "enable" from
+    "disable"). The model is downloaded from Hugging Face on first use and then runs on the local CPU/GPU.
+
+    Requires the optional `sentence-transformers` package (`uv sync --extra embeddings`).
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> None:
+        try:
+            from sentence_transformers import SentenceTransformer  # type: ignore
+        except ImportError as e:
+            msg = (
+                "SentenceTransformerEmbedder requires the optional sentence-transformers package; install it with"
+                " `uv sync --extra embeddings`"
+            )
+            raise ImportError(msg) from e
+        self._model_name = model_name
+        self._model = SentenceTransformer(model_name)
+        self.dimension = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]) -> npt.NDArray[np.float32]:
+        embeddings = self._model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    @property
+    def fingerprint(self) -> str:
+        return f"sentence-transformers:{self._model_name}"
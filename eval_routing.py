@@ -0,0 +1,111 @@
+"""
+Per-query routing of TrustworthyRAG evals.
+
+`ENABLE_CUSTOM_EVALS` turns custom evals on or off for all queries, so with them on, every query pays for every eval.
+An `EvalRouter` instead picks the evals worth running for each query. Each `EvalRoute` guards an eval with a fast,
+high-recall keyword check of the question (for query-only evals like `related_to_competitor`) or of the response (for
+response-only evals like `mentions_context`). If no keyword matches, the eval would score low anyway, so it is skipped
+and recorded in the response's evals as skipped, with no score: `{"name": ..., "score": None, "is_bad": False,
+"skipped": True}`. The result store stores it with a null score, which threshold sweeps treat as not having run.
+
+Only informational evals (those without a bad response threshold) are routed, so routing never changes whether a
+response is bad.
+"""
+
+import re
+import threading
+from collections.abc import Callable, Iterable, Sequence
+from dataclasses import dataclass, field
+from typing import Any, Literal
+
+from constants import COMPETITOR_KEYWORDS, CONTEXT_KEYWORDS
+from tiered_validation import ValidationPlan
+
+
+def keyword_pattern(keywords: Iterable[str]) -> re.Pattern[str]:
+    """Compiles a case-insensitive pattern that matches any of the keywords (or keyphrases) as whole words."""
+    alternatives = sorted(keywords, key=len, reverse=True)  # so that the longest of overlapping keywords wins
+    return re.compile(rf"\b(?:{'|'.join(re.escape(keyword) for keyword in alternatives)})\b", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class EvalRoute:
+    """Runs the eval `eval_name` only if `pattern` matches the question or the response (depending on `target`)."""
+
+    eval_name: str
+    target: Literal["query", "response"]
+    pattern: re.Pattern[str]
+
+    def is_relevant(self, query: str, response: str) -> bool:
+        return self.pattern.search(query if self.target == "query" else response) is not None
+
+
+DEFAULT_ROUTES: tuple[EvalRoute, ...] = (
+    EvalRoute("related_to_competitor", "query", keyword_pattern(COMPETITOR_KEYWORDS)),
+    EvalRoute("mentions_context", "response", keyword_pattern(CONTEXT_KEYWORDS)),
+)
+
+
+@dataclass
+class RoutingStats:
+    """How many routed evals ran, and how many were skipped."""
+
+    validations: int = 0
+    run: dict[str, int] = field(default_factory=dict)  # by eval name
+    skipped: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def skip_rate(self) -> float:
+        total = sum(self.run.values()) + sum(self.skipped.values())
+        return sum(self.skipped.values()) / total if total else 0.0
+
+    def __str__(self) -> str:
+        names = sorted(self.run.keys() | self.skipped.keys())
+        counts = ", ".join(
+            f"{name}: {self.skipped.get(name, 0)} of {self.skipped.get(name, 0) + self.run.get(name, 0)}"
+            for name in names
+        )
+        return f"{self.skip_rate:.0%} of routed evals skipped over {self.validations} validations ({counts})"
+
+
+class EvalRouter:
+    """Skips the evals whose routes rule them out for a query."""
+
+    def __init__(self, routes: Sequence[EvalRoute] = DEFAULT_ROUTES) -> None:
+        self.routes = list(routes)
+        self.stats = RoutingStats()
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self) -> str:
+        return ";".join(f"{route.eval_name}:{route.target}:{route.pattern.pattern}" for route in self.routes)
+
+    def route(self, query: str, response: str, evals: list[str], threshold: Callable[[str], float]) -> ValidationPlan:
+        """
+        Args:
+            query (str): The user question.
+            response (str): The response to validate.
+            evals (list[str]): The configured TrustworthyRAG evals (not counting trustworthiness).
+            threshold (Callable[[str], float]): Returns the bad response threshold of an eval (0 if it has none).
+
+        Returns:
+            ValidationPlan: The (unscored) results of the skipped evals and the evals to run.
+        """
+        local_scores: dict[str, dict[str, Any]] = {}
+        run, skipped = [], []
+        for route in self.routes:
+            if route.eval_name not in evals or threshold(route.eval_name):
+                continue
+            if route.is_relevant(query, response):
+                run.append(route.eval_name)
+            else:
+                skipped.append(route.eval_name)
+                local_scores[route.eval_name] = {"score": None, "is_bad": False, "skipped": True}
+        with self._lock:
+            self.stats.validations += 1
+            for name in run:
+                self.stats.run[name] = self.stats.run.get(name, 0) + 1
+            for name in skipped:
+                self.stats.skipped[name] = self.stats.skipped.get(name, 0) + 1
+        tlm_evals = [name for name in evals if name not in local_scores]
+        return ValidationPlan(local_scores=local_scores, is_bad_response=False, tlm_evals=tlm_evals)
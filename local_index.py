@@ -0,0 +1,338 @@
+"""
+A local, in-process vector index over a directory of Markdown documents (by default, the knowledge base source
+material in `example_data/cursor_docs`), for retrieval without a network hop to Bedrock.
+
+Build the index with `uv run local_index.py`, then pass `retriever=HybridRetriever(LocalIndex.load())` to `RAG()`.
+Running it again updates the index incrementally: only the documents that were added, changed, or deleted since the
+last run are re-chunked, and only chunks whose text is new are re-embedded.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+from bm25 import BM25Index
+from constants import CHUNK_SIZE, LOCAL_DOCS_DIR, LOCAL_INDEX_DIR
+from embeddings import Embedder, HashingEmbedder
+from vector_index import top_k
+
+
+class Chunk(TypedDict):
+    source: str  # path of the document, relative to the docs directory
+    text: str
+    hash: str  # SHA-256 of the text, which identifies the chunk's embedding
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _read_manifest(index_dir: Path) -> dict[str, Any]:
+    manifest: dict[str, Any] = json.loads((index_dir / "manifest.json").read_text())
+    return manifest
+
+
+@dataclass
+class IngestionStats:
+    """What an incremental update of a `LocalIndex` did, and how much work it skipped."""
+
+    files_added: int = 0
+    files_changed: int = 0
+    files_deleted: int = 0
+    files_unchanged: int = 0  # not re-chunked
+    chunks_embedded: int = 0
+    chunks_reused: int = 0  # not re-embedded, since a chunk with the same text was already indexed
+
+    @property
+    def modified(self) -> bool:
+        return bool(self.files_added or self.files_changed or self.files_deleted)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.files_added} documents added, {self.files_changed} changed, {self.files_deleted} deleted,"
+            f" {self.files_unchanged} unchanged; {self.chunks_embedded} chunks embedded, {self.chunks_reused} reused"
+        )
+
+
+def clean_markdown(text: str) -> str:
+    """Strips images, link targets, and zero-width spaces, which add noise to embeddings and prompts alike."""
+    text = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", text)
+    text = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    return text.replace("\u200b", "")
+
+
+def chunk_markdown(text: str, chunk_size: int = CHUNK_SIZE) -> list[str]:
+    """
+    Splits a Markdown document into chunks of roughly `chunk_size` characters.
+
+    Chunks are made of whole paragraphs, and a new chunk is started at every heading, so a chunk never spans two
+    sections. A single paragraph longer than `chunk_size` becomes a chunk of its own.
+
+    Args:
+        text (str): The Markdown document.
+        chunk_size (int): The target maximum chunk size, in characters.
+
+    Returns:
+        list[str]: The chunks, in document order.
+    """
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and (paragraph.startswith("#") or size + len(paragraph) > chunk_size):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class LocalIndex:
+    """
+    Chunks of a document collection and their embeddings.
+
+    Chunks can be searched by embedding similarity (`dense_search`) or by keywords (`keyword_search`, with BM25).
+
+    On disk, an index is a directory with `manifest.json` (the current version, embedder, chunk size, and content hash
+    of each document) and a directory per version, with `chunks.jsonl` (one chunk per line), `vectors.npy` (a float32
+    matrix with one unit-norm embedding per chunk, memory-mapped when loaded), and `bm25.npz` (the inverted index).
+
+    The embedding matrix is stored in column-major order, so that each embedding dimension is contiguous. Questions
+    embedded with the `HashingEmbedder` only have a few dozen non-zero dimensions, so an exact similarity search only
+    needs to read those columns, which is an order of magnitude faster than scanning the whole matrix.
+    """
+
+    def __init__(
+        self,
+        chunks: list[Chunk],
+        vectors: npt.NDArray[np.float32],
+        bm25: BM25Index,
+        embedder: Embedder,
+        file_hashes: dict[str, str],
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.chunks = chunks
+        self.vectors = np.asfortranarray(vectors)
+        self.bm25 = bm25
+        self.embedder = embedder
+        self.file_hashes = file_hashes  # document path -> SHA-256 of its contents
+        self.chunk_size = chunk_size
+
+    @property
+    def version(self) -> str:
+        """A hash of the indexed content and embedder, which changes whenever search results could change."""
+        manifest = json.dumps([self.embedder.fingerprint, self.chunk_size, sorted(self.file_hashes.items())])
+        return hashlib.sha256(manifest.encode()).hexdigest()[:16]
+
+    @classmethod
+    def empty(cls, embedder: Embedder | None = None, chunk_size: int = CHUNK_SIZE) -> "LocalIndex":
+        embedder = embedder or HashingEmbedder()
+        vectors = np.zeros((0, embedder.dimension), dtype=np.float32)
+        return cls([], vectors, BM25Index.build([]), embedder, {}, chunk_size)
+
+    @classmethod
+    def build(cls, docs_dir: str | Path = LOCAL_DOCS_DIR, embedder: Embedder | None = None) -> "LocalIndex":
+        """Chunks and embeds every Markdown document under `docs_dir`."""
+        index = cls.empty(embedder)
+        index.update(docs_dir)
+        return index
+
+    def update(self, docs_dir: str | Path = LOCAL_DOCS_DIR) -> IngestionStats:
+        """
+        Brings the index up to date with the Markdown documents under `docs_dir`.
+
+        Documents whose content hash is unchanged keep their chunks. Added and changed documents are re-chunked, but
+        only chunks whose text is not already in the index are embedded, so editing one paragraph of a document
+        re-embeds about one chunk. The BM25 index is rebuilt if anything changed, since document frequencies are
+        corpus-wide, but that takes a small fraction of the time embedding does.
+
+        Args:
+            docs_dir (str | Path): The directory of documents to index.
+
+        Returns:
+            IngestionStats: How many documents and chunks were processed and skipped.
+        """
+        docs_dir = Path(docs_dir)
+        stats = IngestionStats()
+        old_chunks: dict[str, list[int]] = {}  # source -> positions of its chunks
+        old_rows: dict[str, int] = {}  # chunk hash -> position of a chunk with that text
+        for position, chunk in enumerate(self.chunks):
+            old_chunks.setdefault(chunk["source"], []).append(position)
+            old_rows.setdefault(chunk["hash"], position)
+
+        chunks: list[Chunk] = []
+        rows: list[int | None] = []  # position of each chunk's embedding in `self.vectors`, or None if it is new
+        file_hashes: dict[str, str] = {}
+        for path in sorted(docs_dir.rglob("*.md")):
+            source = path.relative_to(docs_dir).as_posix()
+            text = path.read_text()
+            file_hashes[source] = content_hash(text)
+            if self.file_hashes.get(source) == file_hashes[source]:
+                stats.files_unchanged += 1
+                chunks.extend(self.chunks[position] for position in old_chunks.get(source, []))
+                rows.extend(old_chunks.get(source, []))
+                continue
+            if source in self.file_hashes:
+                stats.files_changed += 1
+            else:
+                stats.files_added += 1
+            for chunk_text in chunk_markdown(clean_markdown(text), self.chunk_size):
+                chunk = Chunk(source=source, text=chunk_text, hash=content_hash(chunk_text))
+                chunks.append(chunk)
+                rows.append(old_rows.get(chunk["hash"]))
+        stats.files_deleted = len(self.file_hashes.keys() - file_hashes.keys())
+        if not stats.modified:
+            stats.chunks_reused = len(self.chunks)
+            return stats
+
+        new = [position for position, row in enumerate(rows) if row is None]
+        kept = [(position, row) for position, row in enumerate(rows) if row is not None]
+        vectors = np.empty((len(chunks), self.embedder.dimension), dtype=np.float32, order="F")
+        if new:
+            vectors[new] = self.embedder.embed([chunks[position]["text"] for position in new])
+        if kept:
+            positions, old_positions = zip(*kept, strict=True)
+            vectors[list(positions)] = self.vectors[list(old_positions)]
+        stats.chunks_embedded, stats.chunks_reused = len(new), len(kept)
+
+        self.chunks = chunks
+        self.vectors = vectors
+        self.bm25 = BM25Index.build([chunk["text"] for chunk in chunks])
+        self.file_hashes = file_hashes
+        return stats
+
+    def save(self, index_dir: str | Path = LOCAL_INDEX_DIR) -> None:
+        """
+        Writes the index to `index_dir`, replacing any index there.
+
+        The data files are written to a new version directory within `index_dir`, and then the manifest, which names
+        that version, is replaced in a single rename. So a concurrent `load` sees either the previous index or the new
+        one, never a mix of their files, and processes that have the previous version loaded (and memory-mapped) are
+        unaffected.
+        """
+        index_dir = Path(index_dir)
+        version = f"v{time.time_ns()}"
+        data_dir = index_dir / version
+        data_dir.mkdir(parents=True)
+        with (data_dir / "chunks.jsonl").open("w") as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk) + "\n")
+        with (data_dir / "vectors.npy").open("wb") as f:
+            np.save(f, self.vectors)
+        with (data_dir / "bm25.npz").open("wb") as f:
+            self.bm25.save(f)
+        manifest = {
+            "version": version,
+            "embedder": self.embedder.fingerprint,
+            "chunk_size": self.chunk_size,
+            "files": self.file_hashes,
+        }
+        previous = _read_manifest(index_dir).get("version") if (index_dir / "manifest.json").exists() else None
+        (index_dir / "manifest.json.tmp").write_text(json.dumps(manifest, indent=2))
+        os.replace(index_dir / "manifest.json.tmp", index_dir / "manifest.json")
+
+        # every incremental update saves a new version, so the older ones are pruned; the previous version is kept,
+        # since a concurrent `load` may have read its manifest but not yet opened its files
+        for path in index_dir.glob("v*"):
+            if path.is_dir() and path.name not in (version, previous):
+                shutil.rmtree(path, ignore_errors=True)  # readers that memory-mapped it keep their mapping
+        if previous is not None:
+            # the files of an index saved before versions were introduced
+            for name in ["chunks.jsonl", "vectors.npy", "bm25.npz"]:
+                (index_dir / name).unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, index_dir: str | Path = LOCAL_INDEX_DIR, embedder: Embedder | None = None) -> "LocalIndex":
+        """
+        Loads an index saved with `save`, memory-mapping the embeddings.
+
+        Args:
+            index_dir (str | Path): The index directory.
+            embedder (Embedder, optional): The embedder the index was built with (by default, `HashingEmbedder`).
+
+        Raises:
+            ValueError: If the index was built with a different embedder.
+        """
+        embedder = embedder or HashingEmbedder()
+        index_dir = Path(index_dir)
+        while True:
+            manifest = _read_manifest(index_dir)
+            if manifest["embedder"] != embedder.fingerprint:
+                msg = f"Index in {index_dir} was built with {manifest['embedder']}, not {embedder.fingerprint}"
+                raise ValueError(msg)
+            # only read the files of the version the manifest names, even if a newer version is saved meanwhile
+            # (indexes saved before versions were introduced have their files in `index_dir` itself)
+            data_dir = index_dir / manifest.get("version", "")
+            try:
+                with (data_dir / "chunks.jsonl").open() as f:
+                    chunks = [json.loads(line) for line in f]
+                vectors = np.load(data_dir / "vectors.npy", mmap_mode="r")
+                bm25 = BM25Index.load(data_dir / "bm25.npz")
+            except FileNotFoundError:
+                # two more versions were saved meanwhile, and this one was pruned: load the current one instead
+                if _read_manifest(index_dir).get("version") == manifest.get("version"):
+                    raise
+                continue
+            return cls(chunks, vectors, bm25, embedder, manifest["files"], manifest["chunk_size"])
+
+    def similarities(self, question: str) -> npt.NDArray[np.float32]:
+        """Returns the cosine similarity between `question` and every chunk."""
+        vector = self.embedder.embed([question])[0]
+        dimensions = np.flatnonzero(vector)
+        if len(dimensions) > len(vector) // 4:
+            scores: npt.NDArray[np.float32] = self.vectors @ vector
+        else:
+            scores = self.vectors[:, dimensions] @ vector[dimensions]
+        return scores
+
+    def dense_search(self, question: str, k: int) -> list[tuple[int, float]]:
+        """Returns the (position, cosine similarity) pairs of the `k` chunks most similar to `question`, best first."""
+        return top_k(self.similarities(question), k)
+
+    def keyword_search(self, question: str, k: int) -> list[tuple[int, float]]:
+        """Returns the (position, BM25 score) pairs of the `k` chunks best matching `question`'s words, best first."""
+        return self.bm25.search(question, k)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default=LOCAL_DOCS_DIR, help="directory of Markdown documents to index")
+    parser.add_argument("--index", default=LOCAL_INDEX_DIR, help="directory to write the index to")
+    parser.add_argument("--rebuild", action="store_true", help="re-embed every document instead of updating")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index_dir = Path(args.index)
+    if args.rebuild or not (index_dir / "manifest.json").exists():
+        index = LocalIndex.empty()
+    else:
+        index = LocalIndex.load(index_dir)
+        if index.chunk_size != CHUNK_SIZE:
+            # documents must be re-chunked, but chunks that come out the same are not re-embedded
+            index.chunk_size = CHUNK_SIZE
+            index.file_hashes = {}
+    stats = index.update(args.docs)
+    if stats.modified:
+        index.save(index_dir)
+    print(stats)
+    print(f"Indexed {len(index.chunks)} chunks from {len(index.file_hashes)} documents into {index_dir}", end=" ")
+    print(f"in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
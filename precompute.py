@@ -0,0 +1,156 @@
+"""
+Precomputes the responses to the most frequent questions of a query log, so that servers start with a warm cache.
+
+`uv run precompute.py --log .results --top 256 --snapshot .cache/snapshot.json` counts the questions of the log (a
+result store, see `result_store.py`, or a file of questions in any format that `cli.py --batch` reads, such as JSONL
+with a "question" field), runs the most frequent ones (after `normalize_question`) through retrieval, generation, and
+validation, and writes the retrieval and response cache entries they produce to a snapshot. Servers (`ui.py`,
+`serve.py`, `api.py`) started with `CACHE_SNAPSHOT=.cache/snapshot.json` load it into their caches at startup, so the
+head of the question distribution is answered from the cache from the first request.
+
+Every run computes its entries afresh, ignoring those already cached, so each entry expires a full TTL after the run.
+With `--every SECONDS` (less than `RESPONSE_CACHE_TTL`), the job runs on that schedule, re-reading the log and
+refreshing the snapshot each time. With `--cache`, the entries are also written to a shared SQLite cache (see
+`serve.py`), which keeps the caches of running servers warm too.
+
+As for `cli.py`, the `RAG` in use is selected with `USE_SOLUTION`. Only responses that pass validation are cached.
+Reading a result store requires the optional `pyarrow` package (`uv sync --extra store`).
+"""
+
+import argparse
+import collections
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+
+from cache import Cache, CacheSnapshot, SQLiteCache, normalize_question, save_snapshot
+from cli import load_questions, load_rag_class
+from constants import (
+    BATCH_MAX_WORKERS,
+    CACHE_SNAPSHOT_PATH,
+    PRECOMPUTE_TOP_N,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL,
+)
+from rag_base import BaseRAG
+from result_store import ResultStore
+
+
+class SnapshotCache[V](Cache[V]):
+    """
+    Keeps the entries set through it for a snapshot, and passes them on to `cache`, if any.
+
+    Lookups always miss, so that every entry is computed afresh.
+    """
+
+    def __init__(self, cache: Cache[V] | None, maxsize: int, ttl: float | None) -> None:
+        super().__init__(cache.maxsize if cache is not None else maxsize, cache.ttl if cache is not None else ttl)
+        self.cache = cache
+        self.entries: dict[str, V] = {}
+
+    def get(self, key: str) -> V | None:
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value: V, expires_at: float | None = None) -> None:
+        self.entries[key] = value
+        if self.cache is not None:
+            self.cache.set(key, value, expires_at)
+
+    def invalidate(self, prefix: str = "") -> int:
+        keys = [key for key in self.entries if key.startswith(prefix)]
+        for key in keys:
+            del self.entries[key]
+        return self.cache.invalidate(prefix) if self.cache is not None else len(keys)
+
+
+def logged_questions(path: Path) -> Iterator[str]:
+    """Reads the questions of a query log: a result store directory, or a file of questions (see `load_questions`)."""
+    if path.is_dir():
+        return (question for batch in ResultStore(path).batches() for question in batch.column("question").to_pylist())
+    return load_questions(path)
+
+
+def top_questions(questions: Iterable[str], n: int) -> tuple[list[tuple[str, int]], int]:
+    """
+    Counts the questions, as normalized by `normalize_question`.
+
+    Returns:
+        tuple[list[tuple[str, int]], int]: The `n` most frequent questions (in their first spelling), most frequent
+            first, with their counts; and the total number of questions.
+    """
+    counts: collections.Counter[str] = collections.Counter()
+    spellings: dict[str, str] = {}
+    for question in questions:
+        key = normalize_question(question)
+        counts[key] += 1
+        spellings.setdefault(key, question)
+    return [(spellings[key], count) for key, count in counts.most_common(n)], counts.total()
+
+
+def precompute(
+    rag: BaseRAG,
+    caches: dict[str, SnapshotCache[Any]],
+    questions: list[tuple[str, int]],
+    total: int,
+    max_workers: int,
+) -> CacheSnapshot:
+    """Runs the questions through `rag`, whose caches are `caches`, and returns a snapshot of the entries they set."""
+    created_at = time.time()
+    for cache in caches.values():
+        cache.entries.clear()
+    failed = 0
+    for result in rag.query_batch((question for question, _ in questions), max_workers=max_workers, ordered=False):
+        if result["error"] is not None:
+            failed += 1
+            print(f"Query failed: {result['question']!r}: {result['error']}", file=sys.stderr)
+    covered = sum(count for _, count in questions)
+    print(
+        f"Precomputed {len(questions)} questions ({covered / total if total else 0.0:.1%} of {total} logged queries) in"
+        f" {time.time() - created_at:.1f} s: {len(caches['responses'].entries)} responses cached, {failed} failed"
+    )
+    return CacheSnapshot(created_at=created_at, caches={name: dict(cache.entries) for name, cache in caches.items()})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", type=Path, required=True, help="the query log: a result store, or a file of questions")
+    parser.add_argument("--top", type=int, default=PRECOMPUTE_TOP_N, help="precompute this many questions")
+    parser.add_argument("--snapshot", type=Path, default=Path(CACHE_SNAPSHOT_PATH), help="the snapshot to write")
+    parser.add_argument("--cache", type=Path, help="also write the entries to this shared cache database")
+    parser.add_argument("--every", type=float, help="run again every this many seconds (by default, run once)")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS, help="questions to run concurrently")
+    args = parser.parse_args()
+    if args.every is not None and args.every >= RESPONSE_CACHE_TTL:
+        parser.error(f"--every must be less than RESPONSE_CACHE_TTL ({RESPONSE_CACHE_TTL:.0f} s) to keep entries fresh")
+
+    load_dotenv()
+    retrieval_cache: Cache[Any] | None = None
+    response_cache: Cache[Any] | None = None
+    if args.cache is not None:
+        args.cache.parent.mkdir(parents=True, exist_ok=True)
+        retrieval_cache = SQLiteCache(args.cache, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL, table="retrieval")
+        response_cache = SQLiteCache(args.cache, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, table="responses")
+    caches: dict[str, SnapshotCache[Any]] = {
+        "retrieval": SnapshotCache(retrieval_cache, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL),
+        "responses": SnapshotCache(response_cache, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL),
+    }
+    rag = load_rag_class()(retrieval_cache=caches["retrieval"], response_cache=caches["responses"])
+
+    while True:
+        started = time.monotonic()
+        questions, total = top_questions(logged_questions(args.log), args.top)
+        save_snapshot(args.snapshot, precompute(rag, caches, questions, total, args.workers))
+        if args.every is None:
+            break
+        time.sleep(max(0.0, args.every - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,925 @@
+import asyncio
+import contextlib
+import copy
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncGenerator, Callable, Iterable, Iterator
+from concurrent.futures import Future
+from contextlib import AbstractContextManager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, ClassVar, Literal, NotRequired, TypedDict, Unpack, cast
+
+import tracing
+from aws_clients import LazyClient
+from blocking_io import iterate_blocking, run_blocking
+from cache import Cache, LRUCache, normalize_question
+from constants import (
+    BATCH_MAX_WORKERS,
+    MODEL_ID,
+    PROMPT_TEMPLATE,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL,
+)
+from context_assembly import AssemblingRetriever, ContextAssembler, estimate_tokens
+from deferred_validation import DeferredValidation, Verdict
+from eval_routing import EvalRouter
+from rate_limit import Priority, Scheduler, priority
+from result_store import QueryRecord, RecordEval, RecordTiming, ResultStore
+from retrieval import BedrockRetriever, CachedRetriever, RetrievalResult, Retriever
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from tiered_validation import TieredValidation
+from tracing import HistogramExporter, StageTiming, Trace, Tracer, stage, traced, use_trace
+
+if TYPE_CHECKING:
+    # the Codex and TLM SDKs take a while to import, so they are imported when the validator is created
+    from cleanlab_tlm.utils.rag import Eval as TrustworthyRAGEval
+
+    from async_clients import AsyncValidator
+
+logger = logging.getLogger(__name__)
+
+
+class Eval(TypedDict):
+    name: str
+    score: float | None  # None for evals that were skipped
+    is_bad: bool
+    skipped: NotRequired[bool]  # set (to True) for evals that eval routing skipped for the query
+
+
+class Response(TypedDict):
+    response: str
+    is_bad_response: bool
+    is_expert_answer: bool
+    evals: list[Eval]
+
+
+class TimedResponse(Response, total=False):
+    """A `Response` from a RAG created with `include_timings`."""
+
+    timings: list[StageTiming]  # time spent in each pipeline stage
+
+
+class DeferredResponse(Response, total=False):
+    """A `Response` from a RAG in deferred validation mode, returned before it was validated."""
+
+    verdict: Future[Verdict[Response]]  # resolves once the response has been validated
+
+
+class StreamUpdate(TypedDict):
+    delta: str  # text generated since the previous update
+    response: Response | None  # the validated response, in the last update only
+
+
+class BatchResult(TypedDict):
+    index: int  # position of the question in the input
+    question: str
+    response: Response | None  # None if the query failed
+    error: str | None  # the exception raised by the query, if any
+
+
+class RAGOptions(TypedDict, total=False):
+    """
+    Optional keyword arguments accepted by `RAG.__init__`.
+
+    Any client that is not provided is created from the environment (see `.env.sample`) when it is first used, or by
+    `BaseRAG.warm`.
+    """
+
+    bedrock_runtime: Any  # data plane API for models
+    bedrock_agent_runtime: Any  # data plane API for agents
+    bedrock_agent: Any | None  # control plane API for agents, used to detect knowledge base re-syncs
+    retriever: Retriever  # replaces the Bedrock Knowledge Base, e.g., with a `LocalRetriever`
+    validator: "AsyncValidator"
+    retrieval_cache: Cache[list[RetrievalResult]] | None  # None disables caching of retrieval results
+    response_cache: Cache[Response] | None  # None disables caching of responses
+    context_assembler: ContextAssembler | None  # deduplicates and trims retrieved chunks; None passes them all through
+    semantic_cache: SemanticCache[Response] | None  # serves cached responses to paraphrased questions (off by default)
+    single_flight: SingleFlight[Response] | None  # runs concurrent identical questions once; None disables it
+    speculative_expert_answers: bool  # look up expert answers while generating (see `BaseRAG.aquery`; off by default)
+    tracer: Tracer | None  # traces each query (by default, into an in-memory `HistogramExporter`); None disables it
+    include_timings: bool  # returns `TimedResponse`s with the per-stage timings of each query (off by default)
+    scheduler: Scheduler | None  # rate-limits calls to Bedrock and TLM (off by default; see `rate_limit.py`)
+    eval_router: EvalRouter | None  # skips evals that are irrelevant to the query (off by default; see eval_routing.py)
+    tiered_validation: TieredValidation | None  # runs local checks before TrustworthyRAG (off by default)
+    result_store: ResultStore | None  # appends a record of each query (off by default; see result_store.py)
+    validation_mode: Literal["inline", "deferred"]  # "deferred" validates in the background (see `BaseRAG.aquery`)
+    deferred_validation: DeferredValidation[Response]  # the background pool of deferred mode (by default, a new one)
+
+
+def _iterate_sync[T](results: AsyncGenerator[T]) -> Iterator[T]:
+    """Iterates over an async generator from synchronous code, by driving it on an event loop of its own."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(results))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+
+def _copy_response(response: Response) -> Response:
+    # the `verdict` future of a `DeferredResponse` can't be copied, so the copies share it
+    verdict = cast(DeferredResponse, response).get("verdict")
+    return copy.deepcopy(response, {id(verdict): verdict} if verdict is not None else None)
+
+
+def _expert_answer_response(expert_answer: str) -> Response:
+    return {
+        "response": expert_answer,
+        "is_bad_response": False,
+        "is_expert_answer": True,
+        "evals": [],
+    }
+
+
+def _is_cacheable(response: Response) -> bool:
+    # only good responses are cached: the Validator never consults Codex for them, so they can't be affected by expert
+    # answers being added or changed later (whereas bad responses and expert answers can)
+    return not response["is_bad_response"] and not response["is_expert_answer"]
+
+
+def _provisional_response(response: str, verdict: Future[Verdict[Response]]) -> Response:
+    provisional: DeferredResponse = {
+        "response": response,
+        "is_bad_response": False,
+        "is_expert_answer": False,
+        "evals": [],
+        "verdict": verdict,
+    }
+    return provisional
+
+
+def _retracts(verdict: Response) -> bool:
+    # provisional responses are presented as good, generated responses, which is exactly what is cacheable
+    return not _is_cacheable(verdict)
+
+
+# set while `query` runs within another entry point (`aquery`, for subclasses without a `native_pipeline`), which
+# stores the query's result itself
+_nested_query: ContextVar[bool] = ContextVar("nested_query", default=False)
+
+
+def _traced_query(query: Callable[["BaseRAG", str], Response]) -> Callable[["BaseRAG", str], Response]:
+    @functools.wraps(query)
+    def wrapper(self: "BaseRAG", question: str) -> Response:
+        start = time.time()
+        with self._trace(question) as trace:
+            if _nested_query.get():
+                # the calling entry point looks up and fills the caches itself
+                response = query(self, question)
+            elif self.single_flight is None:
+                response = self._cached_query(query, question)
+            else:
+                response = self.single_flight.run(
+                    normalize_question(question), lambda: self._cached_query(query, question)
+                )
+            response = self._with_timings(response, trace)
+            if not _nested_query.get():
+                self._store_result(question, response, trace, start)
+            return response
+
+    return wrapper
+
+
+def _hashed_format_contexts(
+    format_contexts: Callable[["BaseRAG", list[str]], str],
+) -> Callable[["BaseRAG", list[str]], str]:
+    @functools.wraps(format_contexts)
+    def wrapper(self: "BaseRAG", contexts: list[str]) -> str:
+        context = format_contexts(self, contexts)
+        if self.result_store is not None:
+            tracing.record("context_hash", hashlib.sha256(context.encode()).hexdigest()[:16])
+        return context
+
+    return wrapper
+
+
+def _marked_skipped_evals(
+    parse_validation_results: Callable[["BaseRAG", dict[str, Any]], tuple[bool, str | None, list[Eval]]],
+) -> Callable[["BaseRAG", dict[str, Any]], tuple[bool, str | None, list[Eval]]]:
+    @functools.wraps(parse_validation_results)
+    def wrapper(self: "BaseRAG", validation_results: dict[str, Any]) -> tuple[bool, str | None, list[Eval]]:
+        is_bad_response, expert_answer, evals = parse_validation_results(self, validation_results)
+        # subclasses parse only the name, score, and is_bad flag of each eval
+        for eval in evals:
+            if validation_results.get(eval["name"], {}).get("skipped"):
+                eval["skipped"] = True
+        return is_bad_response, expert_answer, evals
+
+    return wrapper
+
+
+def _rate_limited_generate(generate: Callable[["BaseRAG", str, str], str]) -> Callable[["BaseRAG", str, str], str]:
+    @functools.wraps(generate)
+    def wrapper(self: "BaseRAG", question: str, context: str) -> str:
+        self._wait_for_generation(question, context)
+        response = generate(self, question, context)
+        self._charge_generation(response)
+        return response
+
+    return wrapper
+
+
+class BaseRAG(ABC):
+    """
+    Shared plumbing for the `RAG` classes in `rag.py` and `solutions/`.
+
+    Subclasses implement the individual pipeline stages (`_retrieve`, `_generate`, ...) and the synchronous `query`
+    method. This class sets up the clients and provides the additional entry points built on top of those stages.
+
+    Clients are created on first use, so constructing a `RAG` is fast; call `warm` (e.g., on a background thread) to
+    create them ahead of the first query.
+    """
+
+    # Set to True by subclasses whose `query` implements the complete retrieve -> generate -> validate -> remediate
+    # pipeline. Other subclasses (e.g., the in-progress workshop `rag.py`) have their `query` run as-is instead.
+    native_pipeline: ClassVar[bool] = False
+
+    # the pipeline stages implemented by subclasses, and the names they are traced under
+    _traced_stages: ClassVar[dict[str, str]] = {
+        "_retrieve": "retrieve",
+        "_format_contexts": "format_contexts",
+        "_generate": "generate",
+        "_parse_validation_results": "parse_validation_results",
+    }
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # wrapping the stages here traces them wherever they are called from, including the subclass's own `query`
+        for method, name in cls._traced_stages.items():
+            if method in cls.__dict__:
+                setattr(cls, method, traced(name, cls.__dict__[method]))
+        if "_generate" in cls.__dict__:
+            setattr(cls, "_generate", _rate_limited_generate(cls.__dict__["_generate"]))  # noqa: B010
+        if "_format_contexts" in cls.__dict__:
+            setattr(cls, "_format_contexts", _hashed_format_contexts(cls.__dict__["_format_contexts"]))  # noqa: B010
+        if "_parse_validation_results" in cls.__dict__:
+            parse_validation_results = _marked_skipped_evals(cls.__dict__["_parse_validation_results"])
+            setattr(cls, "_parse_validation_results", parse_validation_results)  # noqa: B010
+        if "query" in cls.__dict__:
+            setattr(cls, "query", _traced_query(cls.__dict__["query"]))  # noqa: B010
+
+    def __init__(
+        self,
+        evals: list["TrustworthyRAGEval"],
+        eval_thresholds: dict[str, float],
+        **options: Unpack[RAGOptions],
+    ) -> None:
+        self.scheduler = options.get("scheduler")
+        self.result_store = options.get("result_store")
+        if "bedrock_runtime" in options:
+            self._bedrock_runtime = options["bedrock_runtime"]
+        else:
+            self._bedrock_runtime = LazyClient("bedrock-runtime")
+        bedrock_agent_runtime: Any = None
+        bedrock_agent: Any = None
+        retriever: Retriever
+        if "retriever" in options:
+            retriever = options["retriever"]
+        else:
+            if "bedrock_agent_runtime" in options:
+                bedrock_agent_runtime = options["bedrock_agent_runtime"]
+                bedrock_agent = options.get("bedrock_agent")
+            else:
+                bedrock_agent_runtime = LazyClient("bedrock-agent-runtime")
+                bedrock_agent = options["bedrock_agent"] if "bedrock_agent" in options else LazyClient("bedrock-agent")
+            retriever = BedrockRetriever(
+                bedrock_agent_runtime,
+                os.environ["RAG_KNOWLEDGE_BASE_ID"],
+                bedrock_agent=bedrock_agent,
+                scheduler=self.scheduler,
+            )
+        retrieval_cache = options.get("retrieval_cache", LRUCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL))
+        if retrieval_cache is not None:
+            retriever = CachedRetriever(retriever, retrieval_cache)
+        self._retrieval_cache = retrieval_cache
+        # applied after the cache, so cached results stay valid when the assembler's settings change
+        self.context_assembler = options.get("context_assembler", ContextAssembler())
+        if self.context_assembler is not None:
+            retriever = AssemblingRetriever(retriever, self.context_assembler)
+        self._retriever = retriever
+        self.eval_router = options.get("eval_router")
+        self.tiered_validation = options.get("tiered_validation")
+        self._evals = evals
+        self._eval_thresholds = eval_thresholds
+        self._validator_instance = options.get("validator")
+        if self._validator_instance is not None:
+            self._configure_validator(self._validator_instance)
+        self._validator_lock = threading.Lock()
+        # the clients created on first use, in the order `warm` creates them
+        self._lazy_clients = [
+            client
+            for client in (self._bedrock_runtime, bedrock_agent_runtime, bedrock_agent)
+            if isinstance(client, LazyClient)
+        ]
+        self.validation_mode = options.get("validation_mode", "inline")
+        if self.validation_mode not in ("inline", "deferred"):
+            msg = f"Invalid validation_mode: {self.validation_mode}. Expected 'inline' or 'deferred'."
+            raise ValueError(msg)
+        self.deferred_validation: DeferredValidation[Response] | None = None
+        if self.validation_mode == "deferred":
+            self.deferred_validation = options.get("deferred_validation") or DeferredValidation()
+        self._semantic_cache = options.get("semantic_cache")
+        self._response_cache = options.get("response_cache", LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL))
+        self.single_flight = options.get("single_flight", SingleFlight(copy=_copy_response))
+        self._speculative_expert_answers = options.get("speculative_expert_answers", False)
+        self.tracer = options.get("tracer", Tracer([HistogramExporter()]))
+        self._include_timings = options.get("include_timings", False)
+        # identifies everything other than the question and context that determines a response
+        self._response_fingerprint = hashlib.sha256(
+            json.dumps(
+                {
+                    "model_id": MODEL_ID,
+                    "prompt_template": PROMPT_TEMPLATE,
+                    "evals": [vars(eval) for eval in evals],
+                    "eval_thresholds": eval_thresholds,
+                    "validation": self.tiered_validation.fingerprint if self.tiered_validation is not None else "full",
+                    "eval_routing": self.eval_router.fingerprint if self.eval_router is not None else "none",
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+        # the synchronous Validator drives TrustworthyRAG on a single event loop of its own, so `query` must not run
+        # on more than one thread at a time
+        self._query_lock = threading.Lock()
+
+    @property
+    def _validator(self) -> "AsyncValidator":
+        if self._validator_instance is None:
+            with self._validator_lock:
+                if self._validator_instance is None:
+                    self._validator_instance = self._create_validator()
+        return self._validator_instance
+
+    def _create_validator(self) -> "AsyncValidator":
+        from cleanlab_codex.validator import BadResponseThresholds
+
+        import patch_aiohttp  # noqa: F401
+        from async_clients import AsyncValidator
+
+        validator = AsyncValidator(
+            codex_access_key=os.environ["CLEANLAB_CODEX_ACCESS_KEY"],
+            tlm_api_key=os.environ["CLEANLAB_TLM_API_KEY"],
+            trustworthy_rag_config={"evals": self._evals},
+            bad_response_thresholds=BadResponseThresholds.model_validate(self._eval_thresholds).model_dump(),
+        )
+        self._configure_validator(validator)
+        return validator
+
+    def _configure_validator(self, validator: "AsyncValidator") -> None:
+        validator.scheduler = self.scheduler
+        validator.eval_router = self.eval_router
+        validator.tiered_validation = self.tiered_validation
+
+    def warm(self) -> None:
+        """
+        Creates the clients that haven't been created yet (importing their SDKs), so that the first query doesn't wait
+        for them. Safe to call from a background thread while the RAG system is in use.
+        """
+        for client in self._lazy_clients:
+            client.resolve()
+        self._validator  # noqa: B018
+
+    @abstractmethod
+    def _retrieve(self, question: str) -> list[str]: ...
+
+    @abstractmethod
+    def _format_contexts(self, contexts: list[str]) -> str: ...
+
+    @abstractmethod
+    def _format_prompt(self, question: str, context: str) -> str: ...
+
+    @abstractmethod
+    def _generate(self, question: str, context: str) -> str: ...
+
+    def _wait_for_generation(self, question: str, context: str) -> None:
+        if self.scheduler is not None:
+            prompt_tokens = estimate_tokens(self._format_prompt(question, context))
+            self.scheduler.acquire(f"bedrock-runtime:{MODEL_ID}", prompt_tokens)
+
+    def _charge_generation(self, response: str) -> None:
+        # the response's (output) tokens count towards the quota too, but are only known once it is generated
+        if self.scheduler is not None:
+            self.scheduler.charge(f"bedrock-runtime:{MODEL_ID}", estimate_tokens(response))
+
+    def _generate_stream(self, question: str, context: str) -> Iterator[str]:
+        """
+        Generates an LLM response like `_generate`, but yields the text in pieces as the model produces it.
+
+        Args:
+            question (str): The user question to generate a response for.
+            context (str): The formatted context string to use in the prompt.
+
+        Yields:
+            str: The next piece of the LLM response.
+        """
+        self._wait_for_generation(question, context)
+        prompt = self._format_prompt(question, context)
+        response = self._bedrock_runtime.converse_stream(
+            modelId=MODEL_ID,
+            messages=[{"role": "user", "content": [{"text": prompt}]}],
+        )
+        generated: list[str] = []
+        try:
+            for event in response["stream"]:
+                if "contentBlockDelta" in event and (text := event["contentBlockDelta"]["delta"].get("text")):
+                    generated.append(text)
+                    yield text
+        finally:
+            # also when the stream is abandoned or fails part-way: the tokens generated so far were still used
+            self._charge_generation("".join(generated))
+
+    @abstractmethod
+    def _parse_validation_results(self, validation_results: dict[str, Any]) -> tuple[bool, str | None, list[Eval]]:
+        ...
+
+    @abstractmethod
+    def query(self, question: str) -> Response: ...
+
+    def _locked_query(self, question: str) -> Response:
+        token = _nested_query.set(True)
+        try:
+            with self._query_lock:
+                return self.query(question)
+        finally:
+            _nested_query.reset(token)
+
+    def _cached_query(self, query: Callable[["BaseRAG", str], Response], question: str) -> Response:
+        """
+        Runs a subclass's `query`, unless the semantic or response cache has the response, and caches its response.
+
+        For a `native_pipeline`, the context is retrieved and formatted once, both for the response cache key and for
+        the rest of the pipeline (as in `aquery`), rather than running `query`, which would retrieve it again.
+        """
+        if (cached := self._semantic_cache_get(question)) is not None:
+            return cached
+        if not self.native_pipeline:
+            response = query(self, question)
+            self._cache(question, None, response)
+            return response
+
+        context = self._format_contexts(self._retrieve(question))
+        cache_key = self._response_cache_key(question, context)
+        if (cached := self._response_cache_get(cache_key)) is not None:
+            return cached
+        response = self._generate_and_validate(question, context)
+        self._cache(question, cache_key, response)
+        return response
+
+    def _generate_and_validate(self, question: str, context: str) -> Response:
+        initial_response = self._generate(question, context)
+        validation_results = self._validator.validate(
+            query=question, context=context, response=initial_response, form_prompt=self._format_prompt
+        )
+        return self._validated_response(initial_response, validation_results)
+
+    def _trace(self, question: str) -> AbstractContextManager[Trace | None]:
+        return self.tracer.trace(question) if self.tracer is not None else contextlib.nullcontext()
+
+    def _with_timings(self, response: Response, trace: Trace | None) -> Response:
+        if self._include_timings and trace is not None:
+            cast(TimedResponse, response)["timings"] = list(trace.stages)
+        return response
+
+    def _store_result(self, question: str, response: Response, trace: Trace | None, start: float) -> None:
+        if self.result_store is None:
+            return
+        store = self.result_store
+        latency = time.time() - start
+        timings = [RecordTiming(name=t["name"], duration=t["duration"]) for t in trace.stages] if trace else []
+        context_hash = trace.attributes.get("context_hash", "") if trace else ""
+        # for expert answers, the evals of the generated response that they replaced (see `AsyncValidator`)
+        flagged_evals = trace.attributes.get("eval_scores", []) if trace else []
+
+        def record(response: Response) -> QueryRecord:
+            return {
+                "timestamp": start,
+                "question": question,
+                "context_hash": context_hash,
+                "response": response["response"],
+                "is_bad_response": response["is_bad_response"],
+                "is_expert_answer": response["is_expert_answer"],
+                "evals": [
+                    # evals skipped by eval routing are stored with a null score, i.e., as not having run
+                    RecordEval(name=e["name"], score=None if e.get("skipped") else e["score"], is_bad=e["is_bad"])
+                    for e in (flagged_evals if response["is_expert_answer"] else response["evals"])
+                ],
+                "timings": timings,
+                "latency": latency,
+                "model_id": MODEL_ID,
+                "fingerprint": self._response_fingerprint,
+            }
+
+        def store_verdict(verdict: Future[Verdict[Response]]) -> None:
+            if not verdict.cancelled() and verdict.exception() is None:
+                store.append(record(verdict.result().response))
+
+        # deferred responses are stored with their verdict, once it arrives (failed validations aren't stored)
+        if (verdict := cast(DeferredResponse, response).get("verdict")) is not None:
+            verdict.add_done_callback(store_verdict)
+            return
+        store.append(record(response))
+
+    def _semantic_cache_get(self, question: str, namespace: str | None = None) -> Response | None:
+        if self._semantic_cache is None:
+            return None
+        cached = self._semantic_cache.get(question, namespace or self._semantic_cache_namespace())
+        tracing.record("semantic_cache", "miss" if cached is None else "hit")
+        return copy.deepcopy(cached)
+
+    async def _asemantic_cache_get(self, question: str) -> Response | None:
+        if self._semantic_cache is None:
+            return None
+        # the retriever's fingerprint may check the knowledge base for re-syncs, which blocks
+        return self._semantic_cache_get(question, await run_blocking(self._semantic_cache_namespace))
+
+    def _response_cache_get(self, cache_key: str) -> Response | None:
+        if self._response_cache is None:
+            return None
+        cached = self._response_cache.get(cache_key)
+        tracing.record("response_cache", "miss" if cached is None else "hit")
+        return copy.deepcopy(cached)
+
+    def _semantic_cache_namespace(self) -> str:
+        return f"{self._response_fingerprint}:{self._retriever.fingerprint}"
+
+    def _cache(self, question: str, cache_key: str | None, response: Response, namespace: str | None = None) -> None:
+        if not _is_cacheable(response):
+            return
+        if self._response_cache is not None and cache_key is not None:
+            self._response_cache.set(cache_key, copy.deepcopy(response))
+        if self._semantic_cache is not None:
+            self._semantic_cache.set(question, copy.deepcopy(response), namespace or self._semantic_cache_namespace())
+
+    async def _acache(self, question: str, cache_key: str | None, response: Response) -> None:
+        namespace = await run_blocking(self._semantic_cache_namespace) if self._semantic_cache is not None else None
+        self._cache(question, cache_key, response, namespace)
+
+    async def aquery(self, question: str) -> Response:
+        """
+        Asynchronously queries the RAG system with the given question.
+
+        Retrieval and generation run on a shared I/O thread pool (boto3 has no asyncio support) and validation uses
+        TrustworthyRAG's async scoring, so a single event loop can keep many queries in flight at once. Responses that
+        pass validation are cached, so a repeated question that retrieves the same context skips generation and
+        validation. If a `semantic_cache` is configured, it is checked before anything else. For subclasses without a
+        `native_pipeline`, this runs `query` on the I/O thread pool, one question at a time.
+
+        With `speculative_expert_answers`, Codex is also asked for an expert answer as soon as the question arrives,
+        concurrently with the rest of the pipeline. If there is one, it is returned and the pipeline is cancelled, so
+        questions with curated answers skip generation and evaluation. Note that expert answers then take precedence
+        even over responses that would have passed validation, and every question (not only those with bad responses)
+        is added to the Codex project.
+
+        With `validation_mode="deferred"`, the response is returned as soon as it is generated, provisionally marked as
+        good, as a `DeferredResponse` whose `verdict` future resolves to the validated response (see
+        `deferred_validation.py`); the response is cached only if the verdict is good. Cached responses, and all
+        responses of subclasses without a `native_pipeline`, are returned validated as usual.
+
+        A question asked while an identical one (after `normalize_question`) is in flight, from any entry point, waits
+        for it and returns a copy of its response rather than running the pipeline again (see `single_flight.py`).
+
+        Each query is traced by the `tracer` (see `tracing.py`).
+
+        Args:
+            question (str): The user question to generate a response for.
+
+        Returns:
+            Response: The same response that `query` would return for this question.
+        """
+        start = time.time()
+        with self._trace(question) as trace:
+            if self.single_flight is not None:
+                response = await self.single_flight.arun(normalize_question(question), lambda: self._arun(question))
+            else:
+                response = await self._arun(question)
+            self._store_result(question, response, trace, start)
+            return self._with_timings(response, trace)
+
+    async def _arun(self, question: str) -> Response:
+        if self._speculative_expert_answers:
+            return await self._aquery_speculatively(question)
+        return await self._aquery(question)
+
+    async def _aquery_speculatively(self, question: str) -> Response:
+        lookup = asyncio.ensure_future(self._lookup_expert_answer(question))
+        pipeline = asyncio.ensure_future(self._aquery(question))
+        try:
+            if (expert_answer := await lookup) is not None:
+                return _expert_answer_response(expert_answer)
+            return await pipeline
+        finally:
+            pipeline.cancel()
+            lookup.cancel()
+
+    async def _lookup_expert_answer(self, question: str) -> str | None:
+        try:
+            return await self._validator.lookup_expert_answer(question)
+        except Exception:
+            # the pipeline still validates the response and looks up an expert answer if it is bad
+            logger.warning("Speculative expert answer lookup failed", exc_info=True)
+            return None
+
+    async def _aquery(self, question: str) -> Response:
+        if (cached := await self._asemantic_cache_get(question)) is not None:
+            return cached
+
+        if not self.native_pipeline:
+            response = await run_blocking(self._locked_query, question)
+            await self._acache(question, None, response)
+            return response
+
+        contexts = await run_blocking(self._retrieve, question)
+        context = self._format_contexts(contexts)
+        cache_key = self._response_cache_key(question, context)
+        if (cached := self._response_cache_get(cache_key)) is not None:
+            return cached
+
+        return await self._agenerate_and_validate(question, context, cache_key)
+
+    def _response_cache_key(self, question: str, context: str) -> str:
+        digest = hashlib.sha256(json.dumps([normalize_question(question), context]).encode()).hexdigest()
+        return f"{self._response_fingerprint}:{digest}"
+
+    async def _agenerate_and_validate(self, question: str, context: str, cache_key: str) -> Response:
+        initial_response = await run_blocking(self._generate, question, context)
+        return await self._avalidate_or_defer(question, context, cache_key, initial_response)
+
+    async def _avalidate_or_defer(self, question: str, context: str, cache_key: str, initial_response: str) -> Response:
+        if self.deferred_validation is not None:
+            validate = functools.partial(self._avalidate_detached, question, context, cache_key, initial_response)
+            verdict = self.deferred_validation.submit(question, validate, _retracts)
+            tracing.record("validation", "inline" if verdict is None else "deferred")
+            if verdict is not None:
+                return _provisional_response(initial_response, verdict)
+        return await self._avalidate_and_cache(question, context, cache_key, initial_response)
+
+    async def _avalidate_detached(
+        self, question: str, context: str, cache_key: str, initial_response: str
+    ) -> Response:
+        # the query's trace is finished by the time a deferred validation runs
+        with use_trace(None):
+            return await self._avalidate_and_cache(question, context, cache_key, initial_response)
+
+    async def _avalidate_and_cache(
+        self, question: str, context: str, cache_key: str, initial_response: str
+    ) -> Response:
+        response = await self._avalidate(question, context, initial_response)
+        await self._acache(question, cache_key, response)
+        return response
+
+    async def _avalidate(self, question: str, context: str, initial_response: str) -> Response:
+        validation_results = await self._validator.validate_async(
+            query=question, context=context, response=initial_response, form_prompt=self._format_prompt
+        )
+        return self._validated_response(initial_response, validation_results)
+
+    def _validated_response(self, initial_response: str, validation_results: dict[str, Any]) -> Response:
+        is_bad_response, expert_answer, eval_results = self._parse_validation_results(validation_results)
+
+        if expert_answer is not None:
+            return _expert_answer_response(expert_answer)
+
+        return {
+            "response": initial_response,
+            "is_bad_response": is_bad_response,
+            "is_expert_answer": False,
+            "evals": eval_results,
+        }
+
+    async def aquery_stream(self, question: str) -> AsyncGenerator[StreamUpdate]:
+        """
+        Asynchronously queries the RAG system with the given question, streaming the LLM response as it is generated.
+
+        The response is validated once generation completes, and the last update carries the validated `Response` (or,
+        with `validation_mode="deferred"`, a provisional `DeferredResponse`, as in `aquery`).
+        If validation replaces the streamed text with an expert answer, the `response` of the last update differs from
+        the streamed text, which should then be replaced. Cached responses (and, for subclasses without a
+        `native_pipeline`, all responses) arrive in a single update, as do those of questions that were coalesced with
+        an identical question in flight (see `aquery`).
+
+        With `speculative_expert_answers`, an expert answer is looked up concurrently as in `aquery`. If one arrives
+        during generation, generation stops and the last update carries the expert answer.
+
+        Args:
+            question (str): The user question to generate a response for.
+
+        Yields:
+            StreamUpdate: Pieces of the LLM response, then the validated response.
+        """
+        # an async generator's steps may run in different contexts, so rather than making its trace current for the
+        # whole generator (as `aquery` does), the trace is passed along and made current around each stage
+        start = time.time()
+        trace = tracing.current_trace()
+        owns_trace = trace is None and self.tracer is not None
+        if owns_trace:
+            trace = Trace(question)
+        if self.single_flight is not None:
+            updates = self.single_flight.astream(
+                normalize_question(question),
+                lambda: self._astream_run(question, trace),
+                result_of=lambda update: update["response"],
+                update_of=lambda response: StreamUpdate(delta=response["response"], response=response),
+                trace=trace,
+            )
+        else:
+            updates = self._astream_run(question, trace)
+        try:
+            async for update in updates:
+                if update["response"] is not None:
+                    self._store_result(question, update["response"], trace, start)
+                    self._with_timings(update["response"], trace)
+                yield update
+        except Exception as e:
+            if trace is not None:
+                trace.error = repr(e)
+            raise
+        finally:
+            await updates.aclose()
+            if owns_trace and trace is not None and self.tracer is not None:
+                self.tracer.finish(trace)
+
+    def _astream_run(self, question: str, trace: Trace | None) -> AsyncGenerator[StreamUpdate]:
+        if self._speculative_expert_answers:
+            return self._astream_speculatively(question, trace)
+        return self._astream(question, trace)
+
+    async def _astream_speculatively(self, question: str, trace: Trace | None) -> AsyncGenerator[StreamUpdate]:
+        with use_trace(trace):
+            lookup = asyncio.ensure_future(self._lookup_expert_answer(question))
+        updates = self._astream(question, trace)
+        final = None
+        try:
+            async for update in updates:
+                if lookup.done() and lookup.result() is not None:
+                    break  # stop generating
+                if update["response"] is not None:
+                    final = update  # held back until the lookup completes
+                    break
+                yield update
+            if (expert_answer := await lookup) is not None:
+                yield StreamUpdate(delta="", response=_expert_answer_response(expert_answer))
+            elif final is not None:
+                yield final
+        finally:
+            await updates.aclose()
+            lookup.cancel()
+
+    async def _astream(self, question: str, trace: Trace | None) -> AsyncGenerator[StreamUpdate]:
+        if not self.native_pipeline:
+            with use_trace(trace):
+                response = await self._aquery(question)
+            yield StreamUpdate(delta=response["response"], response=response)
+            return
+
+        with use_trace(trace):
+            if (cached := await self._asemantic_cache_get(question)) is None:
+                contexts = await run_blocking(self._retrieve, question)
+                context = self._format_contexts(contexts)
+                cache_key = self._response_cache_key(question, context)
+                cached = self._response_cache_get(cache_key)
+            pieces = iterate_blocking(self._generate_stream, question, context) if cached is None else None
+        if cached is not None:
+            yield StreamUpdate(delta=cached["response"], response=cached)
+            return
+        assert pieces is not None
+
+        generated: list[str] = []
+        start = time.perf_counter()
+        with stage("generate", trace) as attributes:
+            async for piece in pieces:
+                if not generated:
+                    attributes["time_to_first_token"] = time.perf_counter() - start
+                generated.append(piece)
+                yield StreamUpdate(delta=piece, response=None)
+            attributes["size"] = sum(len(piece) for piece in generated)
+
+        with use_trace(trace):
+            response = await self._avalidate_or_defer(question, context, cache_key, "".join(generated))
+        yield StreamUpdate(delta="", response=response)
+
+    def query_stream(self, question: str) -> Iterator[StreamUpdate]:
+        """
+        Queries the RAG system with the given question, streaming the LLM response as it is generated.
+
+        This is a synchronous wrapper around `aquery_stream` that drives its own event loop; see `aquery_stream` for
+        details.
+
+        Args:
+            question (str): The user question to generate a response for.
+
+        Yields:
+            StreamUpdate: Pieces of the LLM response, then the validated response.
+        """
+        yield from _iterate_sync(self.aquery_stream(question))
+
+    async def aquery_batch(
+        self,
+        questions: Iterable[str],
+        *,
+        max_workers: int = BATCH_MAX_WORKERS,
+        ordered: bool = True,
+    ) -> AsyncGenerator[BatchResult]:
+        """
+        Asynchronously queries the RAG system with many questions, running up to `max_workers` of them at a time.
+
+        A failure in one question is reported in its result and does not affect the rest of the batch. Questions are
+        consumed lazily, so `questions` can be a generator over a large file; an error raised by `questions` itself is
+        reported as the result of the item being read (with an empty question), like a failed query. If the RAG system
+        has a `scheduler`, batch queries wait for the backends' quotas behind interactive ones.
+
+        Args:
+            questions (Iterable[str]): The user questions to generate responses for.
+            max_workers (int): The maximum number of questions in flight at once.
+            ordered (bool): If True, results are yielded in input order; otherwise, they are yielded as they complete.
+
+        Yields:
+            BatchResult: The response (or error) for each question.
+        """
+        pending = iter(questions)
+        taken = 0
+        results: asyncio.Queue[BatchResult | None] = asyncio.Queue()
+
+        def take() -> tuple[int, str | Exception] | None:
+            # workers share the `pending` iterator, so each question is taken by exactly one of them
+            nonlocal taken
+            try:
+                question: str | Exception = next(pending)
+            except StopIteration:
+                return None
+            except Exception as e:
+                question = e
+            taken += 1
+            return taken - 1, question
+
+        async def worker() -> None:
+            while (item := take()) is not None:
+                index, question = item
+                if isinstance(question, Exception):
+                    results.put_nowait(BatchResult(index=index, question="", response=None, error=repr(question)))
+                    continue
+                try:
+                    response = await self.aquery(question)
+                except Exception as e:
+                    results.put_nowait(BatchResult(index=index, question=question, response=None, error=repr(e)))
+                else:
+                    results.put_nowait(BatchResult(index=index, question=question, response=response, error=None))
+
+        async def run_workers() -> None:
+            try:
+                await asyncio.gather(*(worker() for _ in range(max_workers)))
+            finally:
+                results.put_nowait(None)
+
+        # batch jobs yield the backends' quotas to interactive queries (see `rate_limit.py`)
+        with priority(Priority.BATCH):
+            runner = asyncio.create_task(run_workers())
+        buffered: dict[int, BatchResult] = {}
+        next_index = 0
+        try:
+            while (result := await results.get()) is not None:
+                if not ordered:
+                    yield result
+                    continue
+                buffered[result["index"]] = result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+            await runner
+        finally:
+            runner.cancel()
+
+    def query_batch(
+        self,
+        questions: Iterable[str],
+        *,
+        max_workers: int = BATCH_MAX_WORKERS,
+        ordered: bool = True,
+    ) -> Iterator[BatchResult]:
+        """
+        Queries the RAG system with many questions, running up to `max_workers` of them at a time.
+
+        This is a synchronous wrapper around `aquery_batch` that drives its own event loop; see `aquery_batch` for
+        details. Queries in flight are paused while the caller processes each yielded result.
+
+        Args:
+            questions (Iterable[str]): The user questions to generate responses for.
+            max_workers (int): The maximum number of questions in flight at once.
+            ordered (bool): If True, results are yielded in input order; otherwise, they are yielded as they complete.
+
+        Yields:
+            BatchResult: The response (or error) for each question.
+        """
+        yield from _iterate_sync(self.aquery_batch(questions, max_workers=max_workers, ordered=ordered))
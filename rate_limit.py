@@ -0,0 +1,238 @@
+"""
+Client-side rate limiting of the backends' quotas.
+
+Bedrock and TLM limit each account's requests per second and tokens per minute. When bursts of traffic exceed those
+quotas, requests fail with throttling errors (after retries that make the burst worse). A `Scheduler` instead makes
+callers wait for their turn: each backend has a `RateLimiter` of token buckets sized to its quotas, and callers queue
+for it in order of priority, so interactive queries go ahead of batch jobs. Queues are bounded, so that under
+sustained overload new calls fail fast with `RateLimitExceeded` rather than waiting indefinitely.
+
+The priority of the calls made on behalf of a query is set with `priority(...)` and carried in a context variable,
+like the current trace (see `tracing.py`).
+"""
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from collections.abc import Iterator, Mapping
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+
+from constants import RATE_LIMIT_MAX_QUEUE_DEPTH, RATE_LIMIT_MAX_WAIT, RATE_LIMITS
+from tracing import stage
+
+
+class Priority(IntEnum):
+    # lower values go first
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised when a call can't be scheduled, because too many calls are queued or it waited too long."""
+
+
+_current_priority: ContextVar[Priority] = ContextVar("current_priority", default=Priority.INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(value: Priority) -> Iterator[None]:
+    """Sets the priority of the calls made within the block (by default, calls are `INTERACTIVE`)."""
+    token = _current_priority.set(value)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """Allows `rate` units per second on average, and bursts of up to `capacity` units. Not thread-safe."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        """Returns how long until `amount` units are available (0 if they are available now)."""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self._tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Takes `amount` units, whether or not they are available (the bucket then owes the difference)."""
+        self._refill()
+        # amounts larger than the capacity (e.g., a huge prompt) would never fit, so they empty the bucket instead
+        self._tokens -= min(amount, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+@dataclass
+class LimiterMetrics:
+    queue_depth: int = 0  # callers waiting right now
+    peak_queue_depth: int = 0
+    granted: int = 0
+    delayed: int = 0  # granted after waiting for quota or for callers ahead in the queue
+    rejected: int = 0  # raised `RateLimitExceeded`
+    total_wait: float = 0.0  # seconds
+
+
+class RateLimiter:
+    """
+    Schedules calls to a backend within its quotas, in order of priority (and first come, first served within each).
+
+    Only the caller at the head of the queue takes from the buckets, so lower-priority callers never starve
+    higher-priority ones of quota; they can wait indefinitely, though, unless `max_wait` is set.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        tokens_per_minute: float | None = None,
+        max_queue_depth: int = RATE_LIMIT_MAX_QUEUE_DEPTH,
+        max_wait: float | None = RATE_LIMIT_MAX_WAIT,
+    ) -> None:
+        """
+        Args:
+            requests_per_second (float): The request quota, which is also the largest burst of requests allowed.
+            tokens_per_minute (float | None): The (LLM) token quota, if any, which is also the largest burst allowed.
+            max_queue_depth (int): Calls beyond this many waiting at once are rejected.
+            max_wait (float | None): Calls that waited this many seconds are rejected; None to wait indefinitely.
+        """
+        self._requests = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self._queue: list[tuple[Priority, int]] = []  # heap of the waiting callers
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._metrics = LimiterMetrics()
+
+    def acquire(self, tokens: float = 0, priority: Priority | None = None) -> float:
+        """
+        Blocks until the backend's quotas allow a request that uses `tokens` tokens.
+
+        Args:
+            tokens (float): The number of (LLM) tokens the request uses, if the backend has a token quota.
+            priority (Priority | None): The caller's priority; by default, the priority of the current context.
+
+        Returns:
+            float: How long the caller waited, in seconds.
+
+        Raises:
+            RateLimitExceeded: If the queue is full, or the caller waited longer than `max_wait`.
+        """
+        entry = (priority if priority is not None else _current_priority.get(), next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            if len(self._queue) >= self.max_queue_depth:
+                self._metrics.rejected += 1
+                msg = f"{len(self._queue)} calls are already waiting for the rate limiter"
+                raise RateLimitExceeded(msg)
+            heapq.heappush(self._queue, entry)
+            self._metrics.queue_depth = len(self._queue)
+            self._metrics.peak_queue_depth = max(self._metrics.peak_queue_depth, len(self._queue))
+            delayed = False
+            try:
+                while True:
+                    timeout = None  # until the head of the queue changes
+                    if self._queue[0] == entry:
+                        timeout = self._delay(tokens)
+                        if timeout == 0:
+                            break
+                    if self.max_wait is not None:
+                        remaining = start + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            self._metrics.rejected += 1
+                            msg = f"waited more than {self.max_wait} seconds for the rate limiter"
+                            raise RateLimitExceeded(msg)
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._condition.wait(timeout)
+                    delayed = True
+                self._requests.take(1)
+                if self._tokens is not None:
+                    self._tokens.take(tokens)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._metrics.queue_depth = len(self._queue)
+                self._condition.notify_all()  # the head of the queue may have changed
+            waited = time.monotonic() - start
+            self._metrics.granted += 1
+            self._metrics.delayed += delayed
+            self._metrics.total_wait += waited
+        return waited
+
+    def charge(self, tokens: float) -> None:
+        """
+        Charges `tokens` more (LLM) tokens to a request that was already granted, without waiting.
+
+        The number of tokens a response takes is only known once it is generated, so `acquire` can only take those of
+        the prompt; charging the response's tokens afterwards delays the calls that follow instead.
+        """
+        if self._tokens is None or tokens <= 0:
+            return
+        with self._condition:
+            self._tokens.take(tokens)
+            self._condition.notify_all()  # the head of the queue has to wait longer now
+
+    def metrics(self) -> LimiterMetrics:
+        with self._condition:
+            return LimiterMetrics(**vars(self._metrics))
+
+    def _delay(self, tokens: float) -> float:
+        delay = self._requests.delay(1)
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.delay(tokens))
+        return delay
+
+
+class Scheduler:
+    """
+    The rate limiters of each backend, e.g., "bedrock-agent-runtime", "bedrock-runtime:<model ID>", and "tlm".
+
+    Calls to backends without a limiter are not limited.
+    """
+
+    def __init__(self, limiters: Mapping[str, RateLimiter]) -> None:
+        self.limiters = dict(limiters)
+
+    @classmethod
+    def from_defaults(cls) -> "Scheduler":
+        """Creates a scheduler with the quotas in `RATE_LIMITS` (see `constants.py`)."""
+        return cls(
+            {
+                backend: RateLimiter(requests_per_second, tokens_per_minute)
+                for backend, (requests_per_second, tokens_per_minute) in RATE_LIMITS.items()
+            }
+        )
+
+    def acquire(self, backend: str, tokens: float = 0) -> None:
+        """
+        Waits until `backend`'s quotas allow a request, at the priority of the current context.
+
+        The time spent waiting is recorded as a "rate_limit" stage of the current trace.
+
+        Raises:
+            RateLimitExceeded: If the request can't be scheduled (see `RateLimiter.acquire`).
+        """
+        if (limiter := self.limiters.get(backend)) is None:
+            return
+        with stage("rate_limit") as attributes:
+            attributes["backend"] = backend
+            limiter.acquire(tokens)
+
+    def charge(self, backend: str, tokens: float) -> None:
+        """Charges `tokens` more tokens to a call to `backend` that was already granted (see `RateLimiter.charge`)."""
+        if (limiter := self.limiters.get(backend)) is not None:
+            limiter.charge(tokens)
+
+    def metrics(self) -> dict[str, LimiterMetrics]:
+        return {backend: limiter.metrics() for backend, limiter in self.limiters.items()}
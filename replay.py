@@ -0,0 +1,141 @@
+"""
+Replays the queries of a result store (see `result_store.py`) against the current configuration, and compares them.
+
+Change `PROMPT_TEMPLATE` or `MODEL_ID` in `constants.py`, or the `EVAL_THRESHOLDS` of the RAG in use (selected with
+`USE_SOLUTION`, as in `cli.py`), then run `uv run replay.py --store .results --output .results-replay`. Each stored
+question is queried again, and the new results are appended to the output store. Then the before and after
+results are compared: how many responses and verdicts changed, the bad response rate, the mean score of each eval,
+and the latency percentiles. The comparison is computed with Arrow compute kernels on the memory-mapped stores, so it
+scales to millions of rows.
+
+Requires the optional `pyarrow` package (`uv sync --extra store`).
+"""
+
+import argparse
+import collections
+import itertools
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pyarrow as pa  # type: ignore
+import pyarrow.compute as pc  # type: ignore
+from dotenv import load_dotenv
+
+from cli import load_rag_class
+from constants import BATCH_MAX_WORKERS, RESULT_STORE_DIR
+from local_index import LocalIndex
+from rag_base import RAGOptions
+from result_store import ResultStore
+from retrieval import HybridRetriever
+
+
+def stored_questions(store: ResultStore, limit: int | None) -> Iterator[str]:
+    """Yields the questions of the stored records in order, one record batch at a time."""
+    questions = (question for batch in store.batches() for question in batch.column("question").to_pylist())
+    return itertools.islice(questions, limit)
+
+
+def eval_means(table: Any) -> dict[str, float]:
+    """Returns the mean score of each eval over the records of `table`."""
+    evals = pc.list_flatten(table.column("evals"))
+    scores = pa.table({"name": pc.struct_field(evals, "name"), "score": pc.struct_field(evals, "score")})
+    means = scores.group_by("name").aggregate([("score", "mean")])
+    return dict(zip(means.column("name").to_pylist(), means.column("score_mean").to_pylist(), strict=True))
+
+
+def align(before: Any, after: Any) -> tuple[Any, Any]:
+    """
+    Pairs up the replayed records with the stored records they replay.
+
+    Replayed records are stored as their queries complete, so they are matched to the stored records by question (in
+    order, for repeated questions). Stored records whose replay failed are left out.
+    """
+    rows: dict[str, collections.deque[int]] = collections.defaultdict(collections.deque)
+    for index, question in enumerate(after.column("question").to_pylist()):
+        rows[question].append(index)
+    before_indices, after_indices = [], []
+    for index, question in enumerate(before.column("question").to_pylist()):
+        if rows[question]:
+            before_indices.append(index)
+            after_indices.append(rows[question].popleft())
+    return before.take(before_indices), after.take(after_indices)
+
+
+def compare(before: Any, after: Any) -> None:
+    """Prints how the replayed records (`after`) differ from the stored records they replay (`before`)."""
+    rows = after.num_rows
+
+    def changed(column: str) -> int:
+        return int(pc.sum(pc.not_equal(before.column(column), after.column(column))).as_py() or 0)
+
+    def rate(table: Any, column: str) -> float:
+        return float(pc.mean(pc.cast(table.column(column), "int8")).as_py() or 0.0)
+
+    def flips(old: bool, new: bool) -> int:
+        mask = pc.and_(pc.equal(before.column("is_bad_response"), old), pc.equal(after.column("is_bad_response"), new))
+        return int(pc.sum(mask).as_py() or 0)
+
+    def distinct(table: Any, column: str) -> str:
+        return ", ".join(str(value)[:16] for value in pc.unique(table.column(column)).to_pylist())
+
+    print(f"Replayed {rows} queries")
+    print(f"  model ID:           {distinct(before, 'model_id')} -> {distinct(after, 'model_id')}")
+    print(f"  fingerprint:        {distinct(before, 'fingerprint')} -> {distinct(after, 'fingerprint')}")
+    print(f"  contexts changed:   {changed('context_hash')}")
+    print(f"  responses changed:  {changed('response')}")
+    print(f"  bad response rate:  {rate(before, 'is_bad_response'):.1%} -> {rate(after, 'is_bad_response'):.1%}")
+    print(f"  verdicts flipped:   {flips(False, True)} good -> bad, {flips(True, False)} bad -> good")
+    print(f"  expert answer rate: {rate(before, 'is_expert_answer'):.1%} -> {rate(after, 'is_expert_answer'):.1%}")
+    for q in (50, 95, 99):
+        old, new = (pc.quantile(table.column("latency"), q=q / 100)[0].as_py() for table in (before, after))
+        print(f"  p{q} latency:        {old * 1000:.0f} ms -> {new * 1000:.0f} ms")
+    means_before, means_after = eval_means(before), eval_means(after)
+    for name in sorted(means_before.keys() | means_after.keys()):
+        old, new = means_before.get(name), means_after.get(name)
+        print(f"  mean {name}: {'-' if old is None else f'{old:.3f}'} -> {'-' if new is None else f'{new:.3f}'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", type=Path, default=Path(RESULT_STORE_DIR), help="the store to replay")
+    parser.add_argument("--output", type=Path, required=True, help="the store to write the replayed results to")
+    parser.add_argument("--limit", type=int, help="replay only the first this many queries")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS, help="questions to run concurrently")
+    parser.add_argument(
+        "--local-index", type=Path, help="retrieve from this local index (see local_index.py) instead of Bedrock"
+    )
+    args = parser.parse_args()
+    if args.output.resolve() == args.store.resolve():
+        parser.error("--output must differ from --store")
+
+    load_dotenv()
+    store = ResultStore(args.store)
+    output = ResultStore(args.output)
+    if len(output):
+        parser.error(f"{args.output} already holds results")
+    # every stored query must run through retrieval, generation, and validation again, rather than being served from a
+    # cache or sharing the result of an identical question in flight, so that its timings are comparable too
+    options: RAGOptions = {
+        "result_store": output,
+        "retrieval_cache": None,
+        "response_cache": None,
+        "semantic_cache": None,
+        "single_flight": None,
+    }
+    if args.local_index is not None:
+        options["retriever"] = HybridRetriever(LocalIndex.load(args.local_index))
+    rag = load_rag_class()(**options)
+
+    replayed = 0
+    for result in rag.query_batch(stored_questions(store, args.limit), max_workers=args.workers, ordered=False):
+        replayed += 1
+        if result["error"] is not None:
+            print(f"Query {result['index']} failed: {result['error']}", file=sys.stderr)
+    output.close()
+    compare(*align(store.read().slice(0, replayed), output.read()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+An append-only, columnar on-disk store of query results.
+
+With `RAG(result_store=ResultStore(".results"))`, every query appends a `QueryRecord` (the question, a hash of its
+context, the response and its evals, the per-stage timings, and the model and configuration it ran with) to the
+store, so that results can be analyzed, and replayed against a new configuration (see `replay.py`), offline.
+
+Records are buffered and written in Arrow record batches to segment files in Arrow's IPC streaming format. Each writer
+(process) appends to segments of its own, so several processes can share a store, and a segment cut short by a crash
+loses only its unflushed records. Reading memory-maps the segments, so even stores of millions of rows are scanned
+without loading them into memory (uncompressed columns are read zero-copy).
+
+Requires the optional `pyarrow` package (`uv sync --extra store`).
+"""
+
+import atexit
+import os
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, TypedDict
+
+from constants import RESULT_STORE_BATCH_SIZE, RESULT_STORE_COMPRESSION, RESULT_STORE_SEGMENT_ROWS
+
+
+class RecordEval(TypedDict):
+    name: str
+    score: float | None  # null for evals that were skipped (e.g., by eval routing), so that they count as not run
+    is_bad: bool
+
+
+class RecordTiming(TypedDict):
+    name: str
+    duration: float  # seconds
+
+
+class QueryRecord(TypedDict):
+    timestamp: float  # Unix time the query started
+    question: str
+    context_hash: str  # of the formatted context the response was generated from; empty if unknown
+    response: str
+    is_bad_response: bool
+    is_expert_answer: bool
+    evals: list[RecordEval]  # for expert answers, the evals of the generated response they replaced, if traced
+    timings: list[RecordTiming]  # per pipeline stage; empty if the query wasn't traced
+    latency: float  # seconds
+    model_id: str
+    fingerprint: str  # identifies the prompt template, evals, eval thresholds, and validation settings
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.ipc  # type: ignore # noqa: F401
+    except ImportError as e:
+        msg = "ResultStore requires the optional pyarrow package; install it with `uv sync --extra store`"
+        raise ImportError(msg) from e
+    return pa
+
+
+def schema() -> Any:
+    """Returns the Arrow schema of the store's records (the columns of `QueryRecord`)."""
+    pa = _import_pyarrow()
+    return pa.schema(
+        [
+            ("timestamp", pa.float64()),
+            ("question", pa.string()),
+            ("context_hash", pa.string()),
+            ("response", pa.string()),
+            ("is_bad_response", pa.bool_()),
+            ("is_expert_answer", pa.bool_()),
+            ("evals", pa.list_(pa.struct([("name", pa.string()), ("score", pa.float64()), ("is_bad", pa.bool_())]))),
+            ("timings", pa.list_(pa.struct([("name", pa.string()), ("duration", pa.float64())]))),
+            ("latency", pa.float64()),
+            ("model_id", pa.string()),
+            ("fingerprint", pa.string()),
+        ]
+    )
+
+
+class ResultStore:
+    """
+    A directory of Arrow IPC stream segments that query records are appended to.
+
+    Appends are thread-safe. Records are buffered until `batch_size` of them have accumulated, so call `flush` (or
+    `close`) to make the latest records readable; open stores are closed when the interpreter exits.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        batch_size: int = RESULT_STORE_BATCH_SIZE,
+        segment_rows: int = RESULT_STORE_SEGMENT_ROWS,
+        compression: str | None = RESULT_STORE_COMPRESSION,
+    ) -> None:
+        """
+        Args:
+            path (str | Path): The store's directory, which is created if needed.
+            batch_size (int): Number of records per record batch (and per write).
+            segment_rows (int): Number of records after which the writer starts a new segment file.
+            compression (str | None): Compression codec of the record batches ("lz4" or "zstd"), or None to store
+                them uncompressed, so they can be read zero-copy.
+        """
+        self._pa = _import_pyarrow()
+        self._schema = schema()
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.segment_rows = segment_rows
+        self._options = self._pa.ipc.IpcWriteOptions(compression=compression)
+        self._buffer: list[QueryRecord] = []
+        self._writer: Any = None
+        self._segment_rows = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def append(self, record: QueryRecord) -> None:
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Writes the buffered records to the current segment."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Writes the buffered records and closes the current segment; later appends start a new segment."""
+        with self._lock:
+            self._flush()
+            self._close_segment()
+
+    def batches(self) -> Iterator[Any]:
+        """
+        Yields the stored records, one memory-mapped `pyarrow.RecordBatch` at a time, segment by segment.
+
+        Segments that are still being written (or were cut short) yield the batches that were completely written.
+        """
+        for segment in sorted(self.path.glob("*.arrows")):
+            # not closed explicitly, since the batches read from it reference its memory
+            source = self._pa.memory_map(str(segment))
+            try:
+                reader = self._pa.ipc.open_stream(source)
+            except self._pa.ArrowInvalid:
+                continue  # nothing was flushed to the segment yet
+            while True:
+                try:
+                    yield reader.read_next_batch()
+                except StopIteration:
+                    break
+                except (self._pa.ArrowInvalid, OSError):
+                    break  # a batch that was cut short
+
+    def read(self) -> Any:
+        """Returns all stored records as a `pyarrow.Table` (whose uncompressed columns are memory-mapped)."""
+        return self._pa.Table.from_batches(list(self.batches()), schema=self._schema)
+
+    def __len__(self) -> int:
+        return sum(batch.num_rows for batch in self.batches())
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        if self._writer is None:
+            # sortable by creation time, and unique across processes
+            name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.arrows"
+            self._writer = self._pa.ipc.new_stream(str(self.path / name), self._schema, options=self._options)
+        self._writer.write_batch(self._pa.RecordBatch.from_pylist(self._buffer, schema=self._schema))
+        self._segment_rows += len(self._buffer)
+        self._buffer = []
+        if self._segment_rows >= self.segment_rows:
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._segment_rows = 0
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, TypedDict
+
+import tracing
+from cache import Cache, normalize_question
+from constants import HYBRID_BM25_MIDPOINT, HYBRID_CANDIDATES, KB_VERSION_CHECK_INTERVAL, RETRIEVAL_RESULTS, RRF_K
+from local_index import LocalIndex
+from rate_limit import Scheduler
+from vector_index import top_k
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalResult(TypedDict):
+    text: str
+    score: float  # relevance score between 0 and 1; higher is more relevant
+
+
+class Retriever(ABC):
+    """A source of context chunks for the RAG system."""
+
+    @abstractmethod
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        """Returns the chunks most relevant to `question`, most relevant first."""
+
+    @property
+    @abstractmethod
+    def fingerprint(self) -> str:
+        """
+        Identifies the corpus and retrieval settings, so cached results can be keyed on it.
+
+        This changes whenever the same question could retrieve different results (e.g., after the corpus is re-synced).
+        """
+
+
+class BedrockRetriever(Retriever):
+    """
+    Retrieves from an Amazon Bedrock Knowledge Base.
+
+    If a `bedrock_agent` (control plane) client is provided, the fingerprint includes the most recent completed
+    ingestion job for each of the knowledge base's data sources (checked at most every `KB_VERSION_CHECK_INTERVAL`
+    seconds), so that re-syncing the knowledge base invalidates cached results. If a `scheduler` is provided,
+    retrievals wait for its "bedrock-agent-runtime" rate limiter.
+    """
+
+    def __init__(
+        self,
+        bedrock_agent_runtime: Any,
+        knowledge_base_id: str,
+        number_of_results: int = RETRIEVAL_RESULTS,
+        bedrock_agent: Any | None = None,
+        scheduler: Scheduler | None = None,
+    ) -> None:
+        self._bedrock_agent_runtime = bedrock_agent_runtime
+        self._scheduler = scheduler
+        self._bedrock_agent = bedrock_agent
+        self._knowledge_base_id = knowledge_base_id
+        self._number_of_results = number_of_results
+        self._version = ""
+        self._version_checked_at = float("-inf")
+        self._version_lock = threading.Lock()
+
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        if self._scheduler is not None:
+            self._scheduler.acquire("bedrock-agent-runtime")
+        response = self._bedrock_agent_runtime.retrieve(
+            retrievalQuery={"text": question},
+            knowledgeBaseId=self._knowledge_base_id,
+            retrievalConfiguration={
+                "vectorSearchConfiguration": {
+                    "numberOfResults": self._number_of_results,
+                    "overrideSearchType": "HYBRID",
+                }
+            }
+        )
+        return [RetrievalResult(text=result["content"]["text"], score=result["score"])
+                for result in response["retrievalResults"]]
+
+    @property
+    def fingerprint(self) -> str:
+        return f"bedrock:{self._knowledge_base_id}@{self._kb_version()}:{self._number_of_results}"
+
+    def _kb_version(self) -> str:
+        if self._bedrock_agent is None:
+            return self._version
+        bedrock_agent = self._bedrock_agent
+        with self._version_lock:
+            if time.monotonic() - self._version_checked_at < KB_VERSION_CHECK_INTERVAL:
+                return self._version
+            self._version_checked_at = time.monotonic()
+            try:
+                self._version = self._latest_ingestion_jobs(bedrock_agent)
+            except Exception:
+                # e.g., missing permissions for the control plane API; cached results then only expire via their TTL
+                logger.warning("Could not check knowledge base %s for re-syncs", self._knowledge_base_id, exc_info=True)
+                self._bedrock_agent = None
+            return self._version
+
+    def _latest_ingestion_jobs(self, bedrock_agent: Any) -> str:
+        job_ids: list[str] = []
+        data_sources = bedrock_agent.list_data_sources(knowledgeBaseId=self._knowledge_base_id)
+        for data_source in data_sources["dataSourceSummaries"]:
+            jobs = bedrock_agent.list_ingestion_jobs(
+                knowledgeBaseId=self._knowledge_base_id,
+                dataSourceId=data_source["dataSourceId"],
+                filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+                sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+                maxResults=1,
+            )
+            job_ids.extend(job["ingestionJobId"] for job in jobs["ingestionJobSummaries"])
+        return hashlib.sha256(",".join(sorted(job_ids)).encode()).hexdigest()[:16]
+
+
+class LocalRetriever(Retriever):
+    """
+    Retrieves from a `LocalIndex` in this process, with no network round trip (e.g., for offline development or
+    benchmarking without AWS credentials).
+
+    Scores are the cosine similarities between the question and chunk embeddings. With the default `HashingEmbedder`
+    they measure word overlap, so they are not on the same scale as the scores of a Bedrock Knowledge Base.
+    """
+
+    def __init__(self, index: LocalIndex, number_of_results: int = RETRIEVAL_RESULTS) -> None:
+        self._index = index
+        self._number_of_results = number_of_results
+
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        return [RetrievalResult(text=self._index.chunks[position]["text"], score=score)
+                for position, score in self._index.dense_search(question, self._number_of_results)]
+
+    @property
+    def fingerprint(self) -> str:
+        return f"local:{self._index.version}:{self._number_of_results}"
+
+
+class HybridRetriever(Retriever):
+    """
+    Retrieves from a `LocalIndex` by combining keyword (BM25) and embedding similarity search, like the HYBRID search
+    type of Bedrock Knowledge Bases.
+
+    The top `candidates` chunks of each search are ranked with reciprocal rank fusion (RRF): each chunk scores
+    `1 / (rrf_k + rank)` for every ranking it appears in. Since BM25 and cosine similarity scores are on unrelated
+    scales, RRF only uses ranks, and a larger `rrf_k` gives lower-ranked chunks relatively more weight.
+
+    Ranks say nothing about whether the best chunks are relevant at all, so each result is reported with the better of
+    its two relevance scores: its cosine similarity to the question, or its BM25 score scaled into [0, 1) (see
+    `HYBRID_BM25_MIDPOINT`). `SIMILARITY_SCORE_THRESHOLD` thus keeps a chunk if either search found it relevant
+    enough, including chunks that only keyword search finds, and drops every result of a question that matches
+    nothing (with the default `HashingEmbedder`, whose similarities measure word overlap, that is a question that
+    shares few words with the corpus).
+    """
+
+    def __init__(
+        self,
+        index: LocalIndex,
+        number_of_results: int = RETRIEVAL_RESULTS,
+        candidates: int = HYBRID_CANDIDATES,
+        rrf_k: int = RRF_K,
+        bm25_midpoint: float = HYBRID_BM25_MIDPOINT,
+    ) -> None:
+        self._index = index
+        self._number_of_results = number_of_results
+        self._candidates = candidates
+        self._rrf_k = rrf_k
+        self._bm25_midpoint = bm25_midpoint
+
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        similarities = self._index.similarities(question)
+        keyword_results = self._index.keyword_search(question, self._candidates)
+        rankings = [top_k(similarities, self._candidates), keyword_results]
+        keyword_scores = dict(keyword_results)
+
+        def relevance(position: int) -> float:
+            keyword_score = keyword_scores.get(position, 0.0)
+            return max(float(similarities[position]), keyword_score / (keyword_score + self._bm25_midpoint))
+
+        fused: dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (position, _) in enumerate(ranking, start=1):
+                fused[position] = fused.get(position, 0.0) + 1 / (self._rrf_k + rank)
+        best = sorted(fused, key=fused.__getitem__, reverse=True)[: self._number_of_results]
+        return [RetrievalResult(text=self._index.chunks[position]["text"], score=relevance(position))
+                for position in best]
+
+    @property
+    def fingerprint(self) -> str:
+        settings = f"{self._number_of_results}:{self._candidates}:{self._rrf_k}:{self._bm25_midpoint}"
+        return f"hybrid:{self._index.version}:{settings}"
+
+
+class CachedRetriever(Retriever):
+    """
+    Caches the results of another retriever, keyed on the normalized question and the retriever's fingerprint.
+
+    Results are cached before any similarity score threshold is applied, so they stay valid if the threshold changes.
+    """
+
+    def __init__(self, retriever: Retriever, cache: Cache[list[RetrievalResult]]) -> None:
+        self._retriever = retriever
+        self.cache = cache
+
+    def retrieve(self, question: str) -> list[RetrievalResult]:
+        key = f"{self.fingerprint}:{hashlib.sha256(normalize_question(question).encode()).hexdigest()}"
+        results = self.cache.get(key)
+        tracing.record("retrieval_cache", "miss" if results is None else "hit")
+        if results is None:
+            results = self._retriever.retrieve(question)
+            self.cache.set(key, results)
+        return results
+
+    @property
+    def fingerprint(self) -> str:
+        return self._retriever.fingerprint
+
+    def invalidate(self) -> int:
+        """Drops all cached results for the current corpus and retrieval settings."""
+        return self.cache.invalidate(self.fingerprint)
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from cache import CacheStats
+from constants import SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL
+from embeddings import Embedder, HashingEmbedder
+from vector_index import NumpyIndex, VectorIndex
+
+
+@dataclass
+class _Entry[V]:
+    question: str
+    value: V
+    namespace: str
+    expires_at: float
+
+
+class SemanticCache[V]:
+    """
+    A cache that matches paraphrases: a lookup hits if a cached question is similar enough to the new one.
+
+    Questions are embedded with a local `Embedder` and matched against an in-process `VectorIndex` (exact NumPy
+    search by default, or an approximate index like `HnswIndex` for large caches). The least recently used entries
+    are evicted beyond `maxsize`, and entries expire `ttl` seconds after they are set.
+
+    Each entry is set under a `namespace` (`BaseRAG` uses its response fingerprint and its retriever's fingerprint),
+    and only matches lookups under the same namespace: once the model, prompt, evals, or corpus change, the entries set
+    before are stale, and are dropped as lookups come across them.
+
+    Since a hit returns the answer to a *different* question, every hit can be recorded in a JSONL audit log so that
+    false hits (similar wording, different meaning) can be reviewed and the threshold tuned.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder | None = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        maxsize: int = SEMANTIC_CACHE_SIZE,
+        ttl: float | None = SEMANTIC_CACHE_TTL,
+        index: VectorIndex | None = None,
+        audit_log: str | Path | None = None,
+    ) -> None:
+        self._embedder = embedder or HashingEmbedder()
+        self.threshold = threshold  # minimum cosine similarity between questions for a hit
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._index = index or NumpyIndex(self._embedder.dimension)
+        self._audit_log = Path(audit_log) if audit_log is not None else None
+        self._entries: OrderedDict[int, _Entry[V]] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def get(self, question: str, namespace: str = "") -> V | None:
+        """
+        Returns the cached value for the most similar cached question under `namespace`, if it is similar enough,
+        else None.
+        """
+        vector = self._embedder.embed([question])[0]
+        with self._lock:
+            while True:
+                matches = self._index.search(vector, 1)
+                if not matches or matches[0][1] < self.threshold:
+                    self.stats.misses += 1
+                    return None
+                entry_id, similarity = matches[0]
+                entry = self._entries[entry_id]
+                if entry.namespace == namespace and entry.expires_at > time.time():
+                    break
+                # expired, or set before the fingerprints changed (a cache serves a single RAG), so it can't match again
+                del self._entries[entry_id]
+                self._index.remove([entry_id])
+                self.stats.expirations += 1
+            self._entries.move_to_end(entry_id)
+            self.stats.hits += 1
+        if self._audit_log is not None:
+            record = {
+                "time": time.time(),
+                "question": question,
+                "cached_question": entry.question,
+                "similarity": round(similarity, 4),
+            }
+            with self._audit_log.open("a") as f:
+                f.write(json.dumps(record) + "\n")
+        return entry.value
+
+    def set(self, question: str, value: V, namespace: str = "") -> None:
+        """Caches `value` as the answer to `question` under `namespace`."""
+        vector = self._embedder.embed([question])
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add([entry_id], vector)
+            expires_at = time.time() + self.ttl if self.ttl is not None else float("inf")
+            self._entries[entry_id] = _Entry(question, value, namespace, expires_at)
+            while len(self._entries) > self.maxsize:
+                evicted_id, _ = self._entries.popitem(last=False)
+                self._index.remove([evicted_id])
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        """Drops every cached entry."""
+        with self._lock:
+            self._index.remove(list(self._entries))
+            self._entries.clear()
@@ -0,0 +1,188 @@
+"""
+Production serving of the UI: several worker processes behind one port.
+
+`ui.py` serves the UI from a single process, so it uses a single core. `uv run serve.py --workers 4` instead starts
+four UI processes, each listening on a local port of its own, and a reverse proxy on `--port` in front of them. The
+workers keep their retrieval and response caches in one SQLite database (`--cache`, by default `SHARED_CACHE_PATH`),
+so a question answered by one worker is a cache hit for all of them, and the caches survive restarts. Workers that
+exit are restarted.
+
+Gradio keeps each session's queue in the process that serves it, so all requests of a session must reach the same
+worker. The proxy routes each request by the session hash that Gradio's client sends with it (in the query string,
+the path, or the JSON body), and spreads requests without one (pages, static assets) across the workers. Only JSON
+bodies are read by the proxy, up to `PROXY_MAX_JSON_BODY_SIZE`; other bodies are streamed to the workers.
+
+Other settings (`USE_SOLUTION`, `VALIDATION_MODE`, `RESULT_STORE`, ...) are read from the environment by each worker,
+as for `ui.py`; the result store is safe to share between processes.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import zlib
+from pathlib import Path
+
+from aiohttp import ClientConnectionError, ClientSession, ClientTimeout, web
+
+from constants import PROXY_MAX_JSON_BODY_SIZE, SHARED_CACHE_PATH, UI_PORT
+
+logger = logging.getLogger(__name__)
+
+# headers that apply to a single connection, so they aren't forwarded (see RFC 9110, section 7.6.1)
+HOP_BY_HOP_HEADERS = frozenset(
+    {
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    }
+)
+
+CLIENT_SESSION = web.AppKey("client_session", ClientSession)
+SUPERVISOR = web.AppKey("supervisor", asyncio.Task[None])
+
+# e.g., /gradio_api/heartbeat/{session_hash} and /gradio_api/stream/{session_hash}/...
+SESSION_PATH = re.compile(r"/(?:heartbeat|stream)/([^/]+)")
+
+
+def run_worker(port: int) -> None:
+    import ui
+
+    ui.main(server_port=port, server_name="127.0.0.1")
+
+
+def session_hash(request: web.Request, body: bytes) -> str | None:
+    """Returns the Gradio session that a request belongs to, if any."""
+    if session := request.query.get("session_hash"):
+        return session
+    if match := SESSION_PATH.search(request.path):
+        return match.group(1)
+    if body and request.content_type == "application/json":
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        session = data.get("session_hash") if isinstance(data, dict) else None
+        if isinstance(session, str):
+            return session
+    return None
+
+
+class WorkerPool:
+    """Runs `ui.main` in worker processes on consecutive local ports, restarting the workers that exit."""
+
+    def __init__(self, workers: int, base_port: int) -> None:
+        self.ports = [base_port + index for index in range(workers)]
+        # spawned rather than forked, so that workers don't inherit the proxy's event loop
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {port: self._start(port) for port in self.ports}
+        self._next = itertools.cycle(self.ports)
+
+    def port_for(self, session: str | None) -> int:
+        """Returns the worker port for a session (always the same one), or the next worker's for no session."""
+        if session is None:
+            return next(self._next)
+        return self.ports[zlib.crc32(session.encode()) % len(self.ports)]
+
+    async def supervise(self, interval: float = 1.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for port, process in self._processes.items():
+                if not process.is_alive():
+                    logger.warning("Worker on port %d exited with code %s; restarting it", port, process.exitcode)
+                    self._processes[port] = self._start(port)
+
+    def stop(self) -> None:
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join()
+
+    def _start(self, port: int) -> multiprocessing.process.BaseProcess:
+        process = self._context.Process(target=run_worker, args=(port,), name=f"ui-{port}", daemon=True)
+        process.start()
+        return process
+
+
+def make_app(pool: WorkerPool) -> web.Application:
+    async def start(app: web.Application) -> None:
+        # no timeout: Gradio streams each response (and the queue's status) over a long-lived response
+        app[CLIENT_SESSION] = ClientSession(timeout=ClientTimeout(total=None), auto_decompress=False)
+        app[SUPERVISOR] = asyncio.create_task(pool.supervise())
+
+    async def stop(app: web.Application) -> None:
+        app[SUPERVISOR].cancel()
+        await app[CLIENT_SESSION].close()
+
+    async def proxy(request: web.Request) -> web.StreamResponse:
+        # only JSON bodies can carry the session hash; reading them is limited by the application's `client_max_size`
+        is_json = request.content_type == "application/json"
+        body = await request.read() if is_json else b""
+        port = pool.port_for(session_hash(request, body))
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        if request.remote is not None:
+            headers["X-Forwarded-For"] = request.remote
+        try:
+            upstream = await request.app[CLIENT_SESSION].request(
+                request.method,
+                f"http://127.0.0.1:{port}{request.rel_url}",
+                headers=headers,
+                data=(body if is_json else request.content) if request.body_exists else None,
+                allow_redirects=False,
+            )
+        except ClientConnectionError:
+            # e.g., the worker is still starting up, or restarting
+            return web.Response(status=503, text="The server is starting up", headers={"Retry-After": "1"})
+        async with upstream:
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+            for name, value in upstream.headers.items():
+                if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "content-length":
+                    response.headers.add(name, value)
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+            except ConnectionResetError:
+                pass  # the client went away, e.g., by closing the page while a response was streaming
+            return response
+
+    app = web.Application(client_max_size=PROXY_MAX_JSON_BODY_SIZE)
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    app.router.add_route("*", "/{path:.*}", proxy)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--host", default="0.0.0.0", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=UI_PORT, help="the port to listen on")
+    parser.add_argument(
+        "--worker-base-port", type=int, help="workers listen on consecutive local ports from this one (default: port+1)"
+    )
+    parser.add_argument("--cache", type=Path, default=Path(SHARED_CACHE_PATH), help="the shared cache database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # read by each worker (see ui.py)
+    os.environ["SHARED_CACHE"] = str(args.cache)
+    pool = WorkerPool(args.workers, args.worker_base_port or args.port + 1)
+    try:
+        web.run_app(make_app(pool), host=args.host, port=args.port)
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
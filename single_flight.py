@@ -0,0 +1,198 @@
+"""
+In-flight coalescing ("single-flight") of identical concurrent calls.
+
+When a popular question spikes, many users ask it at the same moment, and before the first of them has been answered
+(and cached), each would run the whole pipeline against Bedrock and TLM. With a `SingleFlight`, the first call for a
+key (the leader) runs, and identical calls that arrive while it is in flight (the followers) wait for it and receive
+(copies of) its result instead of running themselves. Leaders and followers can be synchronous or asynchronous calls,
+from any thread or event loop.
+
+If the leader fails, its followers receive the exception. If the leader is cancelled (e.g., its client disconnected),
+its followers retry, one of them becoming the new leader.
+"""
+
+import asyncio
+import concurrent.futures
+import copy
+import threading
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from dataclasses import dataclass, field
+
+from tracing import Trace, current_trace, record, stage, use_trace
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    coalesced: int = 0  # calls that received the result of an identical call in flight instead of running
+    retried: int = 0  # coalesced calls that had to run (or wait) again because their leader was cancelled
+
+    @property
+    def coalesce_rate(self) -> float:
+        return self.coalesced / self.calls if self.calls else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.coalesced} of {self.calls} calls coalesced ({self.coalesce_rate:.0%}), {self.retried} retried"
+
+
+@dataclass
+class _Flight[R]:
+    future: concurrent.futures.Future[R] = field(default_factory=concurrent.futures.Future)
+    followers: int = 0
+
+
+class SingleFlight[R]:
+    """Runs one call at a time per key, sharing its result with the identical calls that arrive meanwhile."""
+
+    def __init__(self, copy: Callable[[R], R] = copy.deepcopy) -> None:
+        """
+        Args:
+            copy (Callable): Copies a result, so that each follower receives its own (e.g., to add its own timings to).
+        """
+        self.copy = copy
+        self.stats = SingleFlightStats()
+        self._flights: dict[str, _Flight[R]] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, call: Callable[[], R]) -> R:
+        """Runs `call`, or waits for the identical call in flight for `key`, and returns its result."""
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                return self._lead(key, flight, call)
+            try:
+                with stage("coalesced"):
+                    return self.copy(flight.future.result())
+            except concurrent.futures.CancelledError:
+                self._retry()
+
+    async def arun(self, key: str, call: Callable[[], Awaitable[R]]) -> R:
+        """Asynchronously runs `call`, or waits for the identical call in flight for `key`, and returns its result."""
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                try:
+                    result = await call()
+                except asyncio.CancelledError:
+                    self._abandon(key, flight)
+                    raise
+                except BaseException as e:
+                    self._fail(key, flight, e)
+                    raise
+                self._finish(key, flight, result)
+                return result
+            try:
+                with stage("coalesced"):
+                    return self.copy(await _wait(flight))
+            except asyncio.CancelledError:
+                if not flight.future.cancelled() or _cancelling():
+                    raise  # this call itself was cancelled
+                self._retry()
+
+    async def astream[U](
+        self,
+        key: str,
+        stream: Callable[[], AsyncGenerator[U]],
+        result_of: Callable[[U], R | None],
+        update_of: Callable[[R], U],
+        trace: Trace | None = None,
+    ) -> AsyncGenerator[U]:
+        """
+        Streams the updates of `stream`, or waits for the identical call in flight for `key` and yields its result as
+        a single update.
+
+        Args:
+            key (str): The key of identical calls.
+            stream (Callable): Starts the stream, if this call leads.
+            result_of (Callable): Returns the result that an update carries, if any (the stream's last update should).
+            update_of (Callable): Wraps a result (of the call in flight) into an update.
+            trace (Trace | None): The trace to record waiting for the call in flight in (by default, the current trace,
+                which an async generator's steps may not share).
+        """
+        trace = trace or current_trace()
+        while True:
+            with use_trace(trace):
+                flight, leader = self._join(key)
+            if not leader:
+                try:
+                    with stage("coalesced", trace):
+                        result = self.copy(await _wait(flight))
+                except asyncio.CancelledError:
+                    if not flight.future.cancelled() or _cancelling():
+                        raise
+                    self._retry()
+                    continue
+                yield update_of(result)
+                return
+            updates = stream()
+            finished = False
+            try:
+                async for update in updates:
+                    if not finished and (final := result_of(update)) is not None:
+                        self._finish(key, flight, final)
+                        finished = True
+                    yield update
+            except Exception as e:
+                if not finished:
+                    self._fail(key, flight, e)
+                    finished = True
+                raise
+            finally:
+                await updates.aclose()
+                if not finished:
+                    # the stream was closed early, or cancelled
+                    self._abandon(key, flight)
+            return
+
+    def _join(self, key: str) -> tuple[_Flight[R], bool]:
+        """Returns the flight for `key`, and whether the caller leads it (i.e., no identical call was in flight)."""
+        with self._lock:
+            self.stats.calls += 1
+            if (flight := self._flights.get(key)) is not None:
+                flight.followers += 1
+                self.stats.coalesced += 1
+                record("single_flight", "coalesced")
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _lead(self, key: str, flight: _Flight[R], call: Callable[[], R]) -> R:
+        try:
+            result = call()
+        except BaseException as e:
+            self._fail(key, flight, e)
+            raise
+        self._finish(key, flight, result)
+        return result
+
+    def _finish(self, key: str, flight: _Flight[R], result: R) -> None:
+        with self._lock:
+            del self._flights[key]
+        # a snapshot for the followers to copy, since the leader's caller may go on to modify its result
+        flight.future.set_result(self.copy(result) if flight.followers else result)
+
+    def _fail(self, key: str, flight: _Flight[R], error: BaseException) -> None:
+        with self._lock:
+            del self._flights[key]
+        flight.future.set_exception(error)
+
+    def _abandon(self, key: str, flight: _Flight[R]) -> None:
+        with self._lock:
+            del self._flights[key]
+        flight.future.cancel()
+
+    def _retry(self) -> None:
+        with self._lock:
+            self.stats.calls -= 1  # counted again when the call rejoins
+            self.stats.coalesced -= 1
+            self.stats.retried += 1
+
+
+async def _wait[R](flight: _Flight[R]) -> R:
+    # shielded, since cancelling the wrapper of a `concurrent.futures.Future` cancels the future itself, which is shared
+    return await asyncio.shield(asyncio.wrap_future(flight.future))
+
+
+def _cancelling() -> bool:
+    task = asyncio.current_task()
+    return task is not None and task.cancelling() > 0
@@ -1,24 +1,21 @@
-import os
-from typing import Any, TypedDict
+from typing import Any, NotRequired, TypedDict, Unpack
 
-import boto3  # type: ignore
-from botocore.config import Config  # type: ignore
-from cleanlab_codex.validator import BadResponseThresholds, Validator
 from cleanlab_tlm.utils.rag import Eval as TrustworthyRAGEval
 from cleanlab_tlm.utils.rag import get_default_evals
 
 from constants import (
     MODEL_ID,
     PROMPT_TEMPLATE,
-    RETRIEVAL_RESULTS,
     SIMILARITY_SCORE_THRESHOLD,
 )
+from rag_base import BaseRAG, RAGOptions
 
 
 class Eval(TypedDict):
     name: str
-    score: float
+    score: float | None  # None for evals that were skipped
     is_bad: bool
+    skipped: NotRequired[bool]  # set (to True) for evals that eval routing skipped for the query
 
 
 class Response(TypedDict):
@@ -52,20 +49,15 @@ EVAL_THRESHOLDS: dict[str, float] = {
 }
 
 
-class RAG:
-    def __init__(self) -> None:
-        config = Config(region_name=os.environ["AWS_REGION"])
-        self._bedrock_runtime = boto3.client("bedrock-runtime", config=config)  # data plane API for models
-        self._bedrock_agent_runtime = boto3.client("bedrock-agent-runtime", config=config)  # data plane API for agents
+class RAG(BaseRAG):
+    # query() implements the complete pipeline, so aquery() can run the same stages concurrently
+    native_pipeline = True
+
+    def __init__(self, **options: Unpack[RAGOptions]) -> None:
         evals = get_default_evals()
         if ENABLE_CUSTOM_EVALS:
             evals = evals + CUSTOM_EVALS
-        self._validator = Validator(
-            codex_access_key=os.environ["CLEANLAB_CODEX_ACCESS_KEY"],
-            tlm_api_key=os.environ["CLEANLAB_TLM_API_KEY"],
-            trustworthy_rag_config={"evals": evals},
-            bad_response_thresholds=BadResponseThresholds.model_validate(EVAL_THRESHOLDS).model_dump(),
-        )
+        super().__init__(evals, EVAL_THRESHOLDS, **options)
 
     def _retrieve(self, question: str) -> list[str]:
         """
@@ -79,19 +71,8 @@ class RAG:
         Returns:
             list[str]: A list of context chunks that are relevant to the given question.
         """
-        response = self._bedrock_agent_runtime.retrieve(
-            retrievalQuery={"text": question},
-            knowledgeBaseId=os.environ["RAG_KNOWLEDGE_BASE_ID"],
-            retrievalConfiguration={
-            "vectorSearchConfiguration": {
-                "numberOfResults": RETRIEVAL_RESULTS,
-                "overrideSearchType": "HYBRID",
-                }
-            }
-        )
-        return [result["content"]["text"]
-                for result in response["retrievalResults"]
-                if result["score"] >= SIMILARITY_SCORE_THRESHOLD]
+        results = self._retriever.retrieve(question)
+        return [result["text"] for result in results if result["score"] >= SIMILARITY_SCORE_THRESHOLD]
 
     def _format_contexts(self, contexts: list[str]) -> str:
         """
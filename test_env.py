@@ -1,12 +1,11 @@
 import os
 
-import boto3  # type: ignore
-from botocore.config import Config  # type: ignore
 from cleanlab_codex import Project as CodexProject
 from cleanlab_tlm import TLM
 from dotenv import load_dotenv
 
 import patch_aiohttp  # noqa: F401
+from aws_clients import get_client
 from constants import MODEL_ID
 
 load_dotenv()
@@ -30,8 +29,7 @@ def main() -> None:
     project.query(QUESTION)  # Just verify we can query without error
 
     # check that we can retrieve from the Bedrock knowledge base
-    config = Config(region_name=os.environ["AWS_REGION"])
-    bedrock_agent_runtime = boto3.client("bedrock-agent-runtime", config=config)  # data plane API for agents
+    bedrock_agent_runtime = get_client("bedrock-agent-runtime")  # data plane API for agents
     retrieval_response = bedrock_agent_runtime.retrieve(
         retrievalQuery={"text": "What models does Cursor support?"},
         knowledgeBaseId=os.environ["RAG_KNOWLEDGE_BASE_ID"],
@@ -46,7 +44,7 @@ def main() -> None:
         raise ValueError("Knowledge base query returned no results: did you forget to sync the knowledge base (step 0.3)?")  # noqa: E501
 
     # check that we can generate text with the Bedrock model
-    bedrock_runtime = boto3.client("bedrock-runtime", config=config)  # data plane API for models
+    bedrock_runtime = get_client("bedrock-runtime")  # data plane API for models
     bedrock_runtime.converse(
         modelId=MODEL_ID,
         messages=[{"role": "user", "content": [{"text": QUESTION}]}],
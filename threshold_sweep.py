@@ -0,0 +1,169 @@
+"""
+Re-evaluates bad response thresholds over the eval scores in a result store (see `result_store.py`), without
+re-running any queries.
+
+The stored scores are loaded into a NumPy matrix (records x evals), and for each eval, a grid of thresholds is swept
+with the other thresholds held at their current values. Each setting reports the bad response rate, how well the
+flagged responses overlap with the ones that got expert answers, and the escalation volume: flagged responses without
+an expert answer, which are escalated to SMEs in Codex. Sweeps sort each eval's scores once and then count with binary
+search, so they take milliseconds even over millions of records. Note that expert answers are only looked up for
+responses that were flagged when they were recorded, so the overlap is a lower bound at lower thresholds.
+
+Run with `uv run threshold_sweep.py --store .results`. Pass `--set trustworthiness=0.8` to evaluate other thresholds,
+and `--export thresholds.json` to save them in `BadResponseThresholds` form. The current thresholds are those of the
+RAG in use (selected with `USE_SOLUTION`, as in `cli.py`).
+
+Requires the optional `pyarrow` package (`uv sync --extra store`).
+"""
+
+import argparse
+import importlib
+import json
+import time
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pyarrow.compute as pc  # type: ignore
+from cleanlab_codex.validator import BadResponseThresholds
+
+from cli import load_rag_class
+from constants import RESULT_STORE_DIR
+from result_store import ResultStore
+from tiered_validation import LOCAL_CHECKS
+
+
+@dataclass
+class SweepPoint:
+    threshold: float
+    bad_rate: float  # fraction of responses flagged as bad
+    expert_coverage: float  # fraction of the responses that got expert answers that are flagged
+    expert_overlap: float  # fraction of the flagged responses that got expert answers
+    escalations: int  # flagged responses without an expert answer
+
+
+@dataclass
+class EvalScores:
+    """The stored eval scores, as a matrix with a row per record and a column per eval."""
+
+    names: list[str]
+    scores: npt.NDArray[np.float64]  # NaN where an eval didn't run (e.g., was skipped by eval routing or tiering)
+    is_expert_answer: npt.NDArray[np.bool_]
+    locally_bad: npt.NDArray[np.bool_]  # flagged by the local checks of tiered validation, whatever the thresholds
+
+    @classmethod
+    def load(cls, store: ResultStore) -> "EvalScores":
+        table = store.read().select(["evals", "is_expert_answer"])
+        evals = pc.list_flatten(table.column("evals"))
+        rows = pc.list_parent_indices(table.column("evals")).to_numpy()
+        names = pc.struct_field(evals, "name").to_numpy(zero_copy_only=False)
+        # null scores (of evals skipped by eval routing) load as NaN, i.e., as not having run
+        values = pc.fill_null(pc.struct_field(evals, "score"), np.nan).to_numpy(zero_copy_only=False).astype(np.float64)
+        is_bad = pc.struct_field(evals, "is_bad").to_numpy(zero_copy_only=False).astype(np.bool_)
+        unique_names, columns = np.unique(names, return_inverse=True)
+        local = np.isin(unique_names, list(LOCAL_CHECKS))
+
+        scores = np.full((table.num_rows, len(unique_names)), np.nan)
+        scores[rows, columns] = values
+        locally_bad = np.zeros(table.num_rows, dtype=np.bool_)
+        np.logical_or.at(locally_bad, rows, is_bad & local[columns])
+        return cls(
+            names=[str(name) for name in unique_names[~local]],
+            scores=scores[:, ~local],
+            is_expert_answer=table.column("is_expert_answer").to_numpy(zero_copy_only=False).astype(np.bool_),
+            locally_bad=locally_bad,
+        )
+
+    def is_bad(self, thresholds: Mapping[str, float], exclude: str | None = None) -> npt.NDArray[np.bool_]:
+        """Returns which responses are bad under `thresholds` (ignoring the eval `exclude`)."""
+        columns = [index for index, name in enumerate(self.names) if name != exclude and thresholds.get(name)]
+        limits = np.array([thresholds[self.names[index]] for index in columns])
+        # NaN scores compare as False, so evals that didn't run never flag a response
+        return self.locally_bad | (self.scores[:, columns] < limits).any(axis=1)
+
+    def evaluate(self, thresholds: Mapping[str, float]) -> SweepPoint:
+        bad = self.is_bad(thresholds)
+        return self._point(float("nan"), int(bad.sum()), int((bad & self.is_expert_answer).sum()))
+
+    def sweep(self, name: str, grid: Sequence[float], thresholds: Mapping[str, float]) -> list[SweepPoint]:
+        """Evaluates each threshold of `grid` for the eval `name`, with the other evals at `thresholds`."""
+        others_bad = self.is_bad(thresholds, exclude=name)
+        column = self.scores[:, self.names.index(name)]
+        undecided = ~others_bad & ~np.isnan(column)
+        # the number of scores below each threshold, by binary search in the sorted scores
+        below = np.searchsorted(np.sort(column[undecided]), grid, side="left")
+        expert_below = np.searchsorted(np.sort(column[undecided & self.is_expert_answer]), grid, side="left")
+        bad = int(others_bad.sum()) + below
+        expert_bad = int((others_bad & self.is_expert_answer).sum()) + expert_below
+        return [self._point(t, int(b), int(e)) for t, b, e in zip(grid, bad, expert_bad, strict=True)]
+
+    def _point(self, threshold: float, bad: int, expert_bad: int) -> SweepPoint:
+        records, experts = len(self.scores), int(self.is_expert_answer.sum())
+        return SweepPoint(
+            threshold=threshold,
+            bad_rate=bad / records if records else 0.0,
+            expert_coverage=expert_bad / experts if experts else 0.0,
+            expert_overlap=expert_bad / bad if bad else 0.0,
+            escalations=bad - expert_bad,
+        )
+
+
+def current_thresholds() -> dict[str, float]:
+    """Returns the thresholds of the RAG in use, with Codex's defaults filled in."""
+    module = importlib.import_module(load_rag_class().__module__)
+    thresholds: dict[str, float] = BadResponseThresholds.model_validate(module.EVAL_THRESHOLDS).model_dump()
+    return thresholds
+
+
+def parse_setting(value: str) -> tuple[str, float]:
+    name, _, threshold = value.partition("=")
+    return name, float(threshold)
+
+
+def print_point(label: str, point: SweepPoint) -> None:
+    print(
+        f"{label:>10}  bad {point.bad_rate:6.1%}  expert coverage {point.expert_coverage:6.1%}  "
+        f"expert overlap {point.expert_overlap:6.1%}  escalations {point.escalations}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", type=Path, default=Path(RESULT_STORE_DIR), help="the result store to load")
+    parser.add_argument("--evals", nargs="+", help="the evals to sweep (by default, all stored evals)")
+    parser.add_argument("--step", type=float, default=0.05, help="spacing of the threshold grid, from 0 to 1")
+    parser.add_argument(
+        "--set", type=parse_setting, action="append", default=[], metavar="EVAL=THRESHOLD", help="change a threshold"
+    )
+    parser.add_argument("--export", type=Path, help="save the resulting thresholds to this JSON file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scores = EvalScores.load(ResultStore(args.store))
+    print(f"Loaded {len(scores.names)} evals of {len(scores.scores)} records in {time.perf_counter() - start:.2f} s")
+    thresholds = current_thresholds()
+
+    grid = np.round(np.arange(0, 1 + args.step / 2, args.step), 6).tolist()
+    start = time.perf_counter()
+    sweeps = {name: scores.sweep(name, grid, thresholds) for name in args.evals or scores.names}
+    elapsed = time.perf_counter() - start
+    for name, points in sweeps.items():
+        print(f"\n{name} (current threshold: {thresholds.get(name, 0.0):g})")
+        for point in points:
+            print_point(f"{point.threshold:g}", point)
+    print(f"\nSwept {sum(map(len, sweeps.values()))} settings in {elapsed * 1000:.1f} ms")
+
+    print()
+    print_point("current", scores.evaluate(thresholds))
+    if args.set:
+        chosen = BadResponseThresholds.model_validate({**thresholds, **dict(args.set)}).model_dump()
+        print_point("new", scores.evaluate(chosen))
+        print(f"\nEVAL_THRESHOLDS = {json.dumps(chosen)}")
+        if args.export is not None:
+            args.export.write_text(json.dumps(chosen, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
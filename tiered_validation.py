@@ -0,0 +1,151 @@
+"""
+Tiered validation: cheap local checks that run before TrustworthyRAG, to skip as much of it as possible.
+
+TrustworthyRAG is the slowest and most expensive step of a query, and it runs every configured eval on every response.
+Some of that work can be done (or ruled out) locally, in microseconds:
+
+- An empty context means nothing was retrieved, so the response can't be grounded in the knowledge base: it is bad,
+  and TrustworthyRAG is skipped altogether (the question is still sent to Codex for an expert answer).
+- A response that declines to answer ("I don't know", "the context doesn't say", ...) is unhelpful, which is what the
+  `response_helpfulness` eval would flag: it is bad, and TrustworthyRAG is skipped.
+- `mentions_context` (the custom eval of `solutions/part4.py`) is a regular expression, so it is computed locally
+  rather than by an LLM.
+- If (almost) every content word of the response appears in the context, the response is lexically grounded, so the
+  informational `response_groundedness` eval is skipped.
+
+Evals that determine whether a response is bad (those with a threshold, and trustworthiness) are never skipped unless
+the response is already known to be bad. `TieredValidation.stats` reports how much work the checks saved.
+"""
+
+import re
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from bm25 import tokenize
+from constants import GROUNDED_OVERLAP_THRESHOLD
+
+# phrases with which the LLM declines to answer, e.g., because the retrieved context doesn't cover the question
+REFUSAL_PATTERN = re.compile(
+    r"\b(?:I (?:don't|do not) (?:know|have (?:enough |any )?information)|I(?:'m| am) (?:not sure|unable to)"
+    r"|I (?:can't|cannot) (?:answer|help|find|provide)"
+    r"|(?:context|documentation|information provided) (?:doesn't|does not) (?:mention|say|contain|provide|include))",
+    re.IGNORECASE,
+)
+CONTEXT_MENTION_PATTERN = re.compile(r"\bcontexts?\b", re.IGNORECASE)
+# the scores of the local checks, which are added to TrustworthyRAG's scores but aren't TrustworthyRAG evals
+LOCAL_CHECKS = frozenset({"retrieved_context", "answered", "context_overlap"})
+
+
+def context_overlap(response: str, context: str) -> float:
+    """Returns the fraction of the response's distinct content words that appear in the context."""
+    response_words = set(tokenize(response))
+    if not response_words:
+        return 1.0
+    return len(response_words & set(tokenize(context))) / len(response_words)
+
+
+@dataclass
+class ValidationPlan:
+    """What the local checks found, and what remains for TrustworthyRAG."""
+
+    local_scores: dict[str, dict[str, Any]]  # thresholded scores, in the format of TrustworthyRAG's scores
+    is_bad_response: bool  # according to the local checks
+    tlm_evals: list[str] | None  # the TrustworthyRAG evals to run, or None to skip TrustworthyRAG
+
+
+@dataclass
+class TieredStats:
+    """How much TrustworthyRAG work tiered validation saved."""
+
+    validations: int = 0
+    tlm_skipped: int = 0  # validations decided by the local checks alone
+    evals_run: int = 0  # TrustworthyRAG evals run, counting trustworthiness
+    evals_skipped: int = 0  # TrustworthyRAG evals skipped or computed locally, counting trustworthiness
+    local_seconds: float = 0.0  # time spent in the local checks
+    tlm_seconds: float = 0.0  # time spent waiting for TrustworthyRAG
+    tlm_calls: int = 0
+
+    @property
+    def cost_saved(self) -> float:
+        """The fraction of TrustworthyRAG evals (a proxy for its cost) that were skipped."""
+        total = self.evals_run + self.evals_skipped
+        return self.evals_skipped / total if total else 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        """An estimate of the time saved by skipping TrustworthyRAG, at its mean latency (not counting local checks)."""
+        return self.tlm_skipped * self.tlm_seconds / self.tlm_calls if self.tlm_calls else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.tlm_skipped} of {self.validations} validations decided locally; {self.cost_saved:.0%} of"
+            f" TrustworthyRAG evals skipped; about {self.seconds_saved:.1f} seconds saved"
+            f" (local checks took {self.local_seconds * 1000:.1f} ms)"
+        )
+
+
+class TieredValidation:
+    """Plans each validation: runs the local checks, then picks the TrustworthyRAG evals that are still needed."""
+
+    def __init__(self, grounded_overlap_threshold: float = GROUNDED_OVERLAP_THRESHOLD) -> None:
+        """
+        Args:
+            grounded_overlap_threshold (float): Fraction of the response's content words that must appear in the
+                context for `response_groundedness` to be skipped; above 1 to never skip it.
+        """
+        self.grounded_overlap_threshold = grounded_overlap_threshold
+        self.stats = TieredStats()
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self) -> str:
+        return f"tiered:{self.grounded_overlap_threshold}"
+
+    def plan(self, context: str, response: str, evals: list[str], threshold: Callable[[str], float]) -> ValidationPlan:
+        """
+        Args:
+            context (str): The formatted context the response was generated from.
+            response (str): The response to validate.
+            evals (list[str]): The configured TrustworthyRAG evals (not counting trustworthiness).
+            threshold (Callable[[str], float]): Returns the bad response threshold of an eval (0 if it has none).
+
+        Returns:
+            ValidationPlan: The local scores and the remaining TrustworthyRAG evals.
+        """
+        start = time.perf_counter()
+        has_context = bool(context.strip())
+        refusal = REFUSAL_PATTERN.search(response) is not None
+        overlap = context_overlap(response, context)
+        local_scores: dict[str, dict[str, Any]] = {
+            "retrieved_context": {"score": float(has_context), "is_bad": not has_context},
+            "answered": {"score": float(not refusal), "is_bad": refusal},
+            "context_overlap": {"score": overlap, "is_bad": False},
+        }
+        remaining = list(evals)
+        if "mentions_context" in remaining:
+            mentions = float(CONTEXT_MENTION_PATTERN.search(response) is not None)
+            local_scores["mentions_context"] = {"score": mentions, "is_bad": mentions < threshold("mentions_context")}
+            remaining.remove("mentions_context")
+        if overlap >= self.grounded_overlap_threshold and not threshold("response_groundedness"):
+            remaining = [name for name in remaining if name != "response_groundedness"]
+
+        is_bad_response = not has_context or refusal
+        tlm_evals = None if is_bad_response else remaining
+        with self._lock:
+            self.stats.validations += 1
+            self.stats.local_seconds += time.perf_counter() - start
+            if tlm_evals is None:
+                self.stats.tlm_skipped += 1
+                self.stats.evals_skipped += 1 + len(evals)
+            else:
+                self.stats.evals_run += 1 + len(tlm_evals)
+                self.stats.evals_skipped += len(evals) - len(tlm_evals)
+        return ValidationPlan(local_scores=local_scores, is_bad_response=is_bad_response, tlm_evals=tlm_evals)
+
+    def record_tlm_call(self, seconds: float) -> None:
+        with self._lock:
+            self.stats.tlm_calls += 1
+            self.stats.tlm_seconds += seconds
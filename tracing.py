@@ -0,0 +1,295 @@
+"""
+Per-query instrumentation for the RAG pipeline.
+
+Each query is recorded as a `Trace`: the wall time and output size of each pipeline stage, plus query-level
+attributes like cache hits and Bedrock retry counts. The current trace is tracked in a context variable, so stages
+can record themselves wherever they run (`run_blocking` carries the context over to the I/O thread pool). Finished
+traces are passed to the `Tracer`'s exporters: an in-memory histogram, a JSONL file, and/or OpenTelemetry spans.
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator, Sequence
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TypedDict
+
+from constants import LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# query-level attributes with a distinct value per query, which aren't counted by `HistogramExporter`
+UNIQUE_ATTRIBUTES = frozenset({"context_hash", "eval_scores"})
+
+
+class StageTiming(TypedDict):
+    name: str
+    start: float  # seconds since the start of the query
+    duration: float  # seconds
+    attributes: dict[str, Any]  # e.g., the size of the stage's output
+
+
+@dataclass
+class Trace:
+    question: str
+    start_time: float = field(default_factory=time.time)  # Unix time
+    duration: float | None = None  # seconds, once the query has finished
+    stages: list[StageTiming] = field(default_factory=list)
+    attributes: dict[str, Any] = field(default_factory=dict)  # query-level, e.g., {"retrieval_cache": "hit"}
+    error: str | None = None  # the exception raised by the query, if any
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "question": self.question,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "stages": self.stages,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def use_trace(trace: Trace | None) -> Iterator[None]:
+    """Makes `trace` the current trace within the block."""
+    token = _current_trace.set(trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str, trace: Trace | None = None) -> Iterator[dict[str, Any]]:
+    """
+    Records the wall time of the block as a stage of `trace` (by default, the current trace, if any).
+
+    Yields:
+        dict: The stage's attributes, which the block can add to.
+    """
+    trace = trace or _current_trace.get()
+    attributes: dict[str, Any] = {}
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        if trace is not None:
+            trace.stages.append(
+                StageTiming(
+                    name=name,
+                    start=start - trace._start,
+                    duration=time.perf_counter() - start,
+                    attributes=attributes,
+                )
+            )
+
+
+def traced[**P, T](name: str, func: Callable[P, T]) -> Callable[P, T]:
+    """Wraps `func` so that each call is recorded as a stage of the current trace, along with the size of its result."""
+
+    @functools.wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        if _current_trace.get() is None:
+            return func(*args, **kwargs)
+        with stage(name) as attributes:
+            result = func(*args, **kwargs)
+            if isinstance(result, str | list | dict):
+                attributes["size"] = len(result)
+            return result
+
+    return wrapper
+
+
+def record(key: str, value: Any) -> None:
+    """Sets a query-level attribute of the current trace, if any."""
+    if (trace := _current_trace.get()) is not None:
+        trace.attributes[key] = value
+
+
+def increment(key: str, amount: int = 1) -> None:
+    """Adds `amount` to a query-level counter of the current trace, if any."""
+    if (trace := _current_trace.get()) is not None:
+        trace.attributes[key] = trace.attributes.get(key, 0) + amount
+
+
+class TraceExporter(ABC):
+    @abstractmethod
+    def export(self, trace: Trace) -> None:
+        """Processes a finished trace; called on the thread that ran the query."""
+
+
+class Tracer:
+    """Starts a trace for each query and passes it to the exporters when the query finishes."""
+
+    def __init__(self, exporters: Sequence[TraceExporter]) -> None:
+        self.exporters = list(exporters)
+
+    @contextlib.contextmanager
+    def trace(self, question: str) -> Iterator[Trace]:
+        """
+        Makes a new trace for `question` current within the block, then exports it.
+
+        If a trace is already current (e.g., `query` running within `aquery`), that trace is used and nothing is
+        exported, so each query is exported exactly once.
+        """
+        if (trace := _current_trace.get()) is not None:
+            yield trace
+            return
+        trace = Trace(question)
+        try:
+            with use_trace(trace):
+                yield trace
+        except BaseException as e:
+            trace.error = repr(e)
+            raise
+        finally:
+            self.finish(trace)
+
+    def finish(self, trace: Trace) -> None:
+        """Exports a trace that was made current with `use_trace` rather than `trace`."""
+        trace.duration = trace.elapsed()
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception:
+                logger.warning("%s failed to export a trace", type(exporter).__name__, exc_info=True)
+
+
+class HistogramExporter(TraceExporter):
+    """
+    Aggregates the latency of each stage (and of whole queries, as "query") into fixed-bucket histograms, like a
+    Prometheus histogram, plus counts of each query-level attribute value (e.g., cache hits and misses), except for
+    `UNIQUE_ATTRIBUTES`.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = sorted(buckets)  # upper bounds, in seconds; the last bucket is unbounded
+        self._histograms: dict[str, list[int]] = {}
+        self._sums: dict[str, float] = {}
+        self._attributes: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        durations = [(timing["name"], timing["duration"]) for timing in trace.stages]
+        if trace.duration is not None:
+            durations.append(("query", trace.duration))
+        with self._lock:
+            for name, duration in durations:
+                counts = self._histograms.setdefault(name, [0] * (len(self.buckets) + 1))
+                counts[bisect.bisect_left(self.buckets, duration)] += 1
+                self._sums[name] = self._sums.get(name, 0.0) + duration
+            for key, value in trace.attributes.items():
+                if key in UNIQUE_ATTRIBUTES:
+                    continue
+                values = self._attributes.setdefault(key, {})
+                values[str(value)] = values.get(str(value), 0) + 1
+
+    def histograms(self) -> dict[str, tuple[list[int], float]]:
+        """Returns the bucket counts and the sum of durations for each stage."""
+        with self._lock:
+            return {name: (list(counts), self._sums[name]) for name, counts in self._histograms.items()}
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Summarizes the recorded latencies.
+
+        Quantiles are estimated as the upper bound of the bucket they fall in (or the largest bucket bound, for the
+        last bucket), so they are accurate to within a bucket.
+
+        Returns:
+            dict: For each stage, the number of samples, their mean, and their estimated p50, p95, and p99 (in
+            seconds), plus the counts of each query-level attribute value under "attributes".
+        """
+        summary: dict[str, Any] = {}
+        for name, (counts, total) in self.histograms().items():
+            num_samples = sum(counts)
+            summary[name] = {
+                "count": num_samples,
+                "mean": total / num_samples,
+                **{f"p{q}": self._quantile(counts, q / 100) for q in (50, 95, 99)},
+            }
+        with self._lock:
+            summary["attributes"] = {key: dict(values) for key, values in self._attributes.items()}
+        return summary
+
+    def _quantile(self, counts: list[int], q: float) -> float:
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip([*self.buckets, self.buckets[-1]], counts, strict=True):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class JSONLExporter(TraceExporter):
+    """Appends each trace to a JSONL file, one JSON object per query."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_dict(), default=str) + "\n"
+        with self._lock, self.path.open("a") as f:
+            f.write(line)
+
+
+class OpenTelemetryExporter(TraceExporter):
+    """
+    Emits each trace as OpenTelemetry spans: a "rag.query" span with a child span per stage.
+
+    This uses the OpenTelemetry API, so spans go wherever the application's tracer provider sends them (nowhere,
+    unless one is configured). Requires the optional `opentelemetry-api` package.
+    """
+
+    def __init__(self, tracer_provider: Any | None = None) -> None:
+        try:
+            from opentelemetry import trace as otel_trace  # type: ignore[import-not-found, unused-ignore]
+        except ImportError as e:
+            msg = "OpenTelemetryExporter requires the optional opentelemetry-api package"
+            raise ImportError(msg) from e
+        self._otel_trace = otel_trace
+        self._tracer = otel_trace.get_tracer(__name__, tracer_provider=tracer_provider)
+
+    def export(self, trace: Trace) -> None:
+        start_ns = int(trace.start_time * 1e9)
+        attributes: dict[str, str | bool | int | float] = {"rag.question": trace.question}
+        attributes.update({f"rag.{key}": _otel_value(value) for key, value in trace.attributes.items()})
+        root = self._tracer.start_span("rag.query", start_time=start_ns, attributes=attributes)
+        if trace.error is not None:
+            root.set_status(self._otel_trace.Status(self._otel_trace.StatusCode.ERROR, trace.error))
+        context = self._otel_trace.set_span_in_context(root)
+        for timing in trace.stages:
+            stage_start_ns = start_ns + int(timing["start"] * 1e9)
+            span = self._tracer.start_span(
+                f"rag.{timing['name']}",
+                context=context,
+                start_time=stage_start_ns,
+                attributes={f"rag.{key}": _otel_value(value) for key, value in timing["attributes"].items()},
+            )
+            span.end(end_time=stage_start_ns + int(timing["duration"] * 1e9))
+        root.end(end_time=start_ns + int((trace.duration or 0.0) * 1e9))
+
+
+def _otel_value(value: Any) -> str | bool | int | float:
+    # OpenTelemetry attributes must be primitive values
+    return value if isinstance(value, str | bool | int | float) else json.dumps(value, default=str)
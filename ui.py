@@ -1,29 +1,62 @@
+import asyncio
 import os
-from typing import Any
+from collections.abc import AsyncIterator
+from typing import Any, Literal, cast
 
-import gradio as gr
 from dotenv import load_dotenv
 
-import patch_aiohttp  # noqa: F401
-from constants import SCORE_TO_ISSUE
-
-USE_SOLUTION = os.environ.get("USE_SOLUTION")
-if USE_SOLUTION is not None:
-    if USE_SOLUTION in {"1", "2", "3", "4"}:
-        import importlib
-        solution = importlib.import_module(f"solutions.part{USE_SOLUTION}")
-        RAG = solution.RAG
+from cli import env_options, start_rag
+from constants import SCORE_TO_ISSUE, UI_CONCURRENCY_LIMIT, UI_PORT, UI_QUEUE_MAX_SIZE
+from rag_base import RAGOptions
+
+# "deferred" shows each response as soon as it is generated, and its evals once it has been validated in the background
+VALIDATION_MODE = cast(Literal["inline", "deferred"], os.environ.get("VALIDATION_MODE", "inline"))
+if VALIDATION_MODE not in {"inline", "deferred"}:
+    msg = f"Invalid VALIDATION_MODE value: {VALIDATION_MODE}. Expected 'inline' or 'deferred'."
+    raise ValueError(msg)
+
+
+def verdict_message(response_data: dict[str, Any], retracted: bool = False) -> dict[str, Any]:
+    """Returns the metadata panel that shows the verdict of a validated response."""
+    if response_data.get("is_expert_answer"):
+        title = "\u21a9 Answer replaced by an expert answer" if retracted else "\u2705 Expert answer"
+        return {"role": "assistant", "content": "(expert answers have no evals)", "metadata": {"title": title}}
+    if response_data.get("is_bad_response"):
+        issue_names = [
+            SCORE_TO_ISSUE.get(eval["name"], eval["name"]) for eval in response_data.get("evals", []) if eval["is_bad"]
+        ]
+        title = f"\u2757 Issues detected: {', '.join(issue_names)}"
+        if retracted:
+            title = f"\u21a9 Answer retracted. {title}"
     else:
-        msg = f"Invalid USE_SOLUTION value: {USE_SOLUTION}. Expected '1', '2', '3', or '4'."
-        raise ValueError(msg)
-else:
-    from rag import RAG
-
-
-def main() -> None:
+        title = "\u2705 No issues detected"
+    evals = [
+        f"{eval['name']}: {'skipped' if eval['score'] is None else f'{eval['score']:.3f}'}"
+        for eval in response_data.get("evals", [])
+    ]
+    content = f"Evals:\n\n{'\n'.join(evals)}"
+    return {"role": "assistant", "content": content, "metadata": {"title": title}}
+
+
+def main(server_port: int = UI_PORT, server_name: str | None = None) -> None:
+    """
+    Serves the UI.
+
+    Args:
+        server_port (int): The port to listen on.
+        server_name (str | None): The address to listen on (by default, Gradio's: localhost, or `GRADIO_SERVER_NAME`).
+    """
     load_dotenv()
 
-    rag = RAG()
+    options: RAGOptions = {
+        "include_timings": True,
+        "validation_mode": VALIDATION_MODE,
+        **env_options(),
+    }
+    # the RAG (and its SDKs and clients) starts up on a background thread while Gradio is imported and the UI built
+    startup = start_rag(**options)
+
+    import gradio as gr
 
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
         gr.Markdown("# RAG Chat Interface")
@@ -35,41 +68,59 @@ def main() -> None:
         def user_input(message: str, history: list[dict[str, Any]]) -> tuple[str, list[dict[str, Any]]]:
             return "", [{"role": "user", "content": message}]
 
-        def bot_response(history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        async def bot_response(history: list[dict[str, Any]]) -> AsyncIterator[list[dict[str, Any]]]:
             message = history[-1]["content"]
             assert isinstance(message, str)
-            response_data = rag.query(message)
-
-            bot_message = response_data["response"]
-            history.append({"role": "assistant", "content": bot_message})
-
-            if response_data.get("is_expert_answer"):
-                history.append(
-                    {
-                        "role": "assistant",
-                        "content": "(expert answers have no evals)",
-                        "metadata": {"title": "\u2705 Expert answer"},
-                    }
-                )
+            # shielded, since cancelling the wrapper of a `concurrent.futures.Future` (e.g., when the client
+            # disconnects) cancels the future itself, which is shared
+            rag = await asyncio.shield(asyncio.wrap_future(startup))
+            bot_message = {"role": "assistant", "content": ""}
+            history.append(bot_message)
+            response_data: Any = None  # a `TimedResponse`, and in deferred mode also a `DeferredResponse`
+            # show the response as it is generated; the evals are added once it has been validated
+            async for update in rag.aquery_stream(message):
+                bot_message["content"] += update["delta"]
+                response_data = update["response"]
+                yield history
+            assert response_data is not None
+
+            # validation may have replaced the generated response with an expert answer
+            bot_message["content"] = response_data["response"]
+
+            # in deferred mode, the response is shown before it has been validated
+            verdict = response_data.get("verdict")
+            if verdict is None:
+                history.append(verdict_message(response_data))
             else:
-                if response_data.get("is_bad_response"):
-                    issue_names = [
-                        SCORE_TO_ISSUE.get(eval["name"], eval["name"])
-                        for eval in response_data.get("evals", [])
-                        if eval["is_bad"]
-                    ]
-                    title = f"\u2757 Issues detected: {', '.join(issue_names)}"
+                pending = {"role": "assistant", "content": "", "metadata": {"title": "\u23f3 Validating..."}}
+                history.append(pending)
+                yield history
+                try:
+                    result = await asyncio.shield(asyncio.wrap_future(verdict))
+                except Exception as e:
+                    pending["content"] = repr(e)
+                    pending["metadata"] = {"title": "\u2757 Validation failed"}
                 else:
-                    title = "\u2705 No issues detected"
-                evals = [f"{eval['name']}: {eval['score']:.3f}" for eval in response_data.get("evals", [])]
-                content = f"Evals:\n\n{'\n'.join(evals)}"
-                history.append({"role": "assistant", "content": content, "metadata": {"title": title}})
+                    history[history.index(pending)] = verdict_message(result.response, result.retracted)
+                    if result.retracted and result.response["is_expert_answer"]:
+                        bot_message["content"] = result.response["response"]
+                    elif result.retracted:
+                        bot_message["content"] = f"~~{bot_message['content']}~~"
+
+            if timings := response_data.get("timings"):
+                stages = [f"{timing['name']}: {timing['duration'] * 1000:.0f} ms" for timing in timings]
+                history.append(
+                    {"role": "assistant", "content": "\n\n".join(stages), "metadata": {"title": "\u23f1 Timings"}}
+                )
 
-            return history
+            yield history
 
-        msg.submit(user_input, [msg, chatbot], [msg, chatbot], queue=False).then(bot_response, chatbot, chatbot)
+        msg.submit(user_input, [msg, chatbot], [msg, chatbot], queue=False).then(
+            bot_response, chatbot, chatbot, concurrency_limit=UI_CONCURRENCY_LIMIT
+        )
 
-    demo.launch(show_api=False, server_port=8080)
+    demo.queue(max_size=UI_QUEUE_MAX_SIZE)
+    demo.launch(show_api=False, server_port=server_port, server_name=server_name)
 
 
 if __name__ == "__main__":
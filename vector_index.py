@@ -0,0 +1,132 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+
+def top_k(scores: npt.NDArray[np.float32], k: int) -> list[tuple[int, float]]:
+    """
+    Selects the `k` highest scores without sorting the whole array.
+
+    Args:
+        scores (np.ndarray): A 1-D array of scores.
+        k (int): The number of scores to select.
+
+    Returns:
+        list[tuple[int, float]]: (position, score) pairs, highest score first.
+    """
+    k = min(k, len(scores))
+    if k == 0:
+        return []
+    positions = np.argpartition(-scores, k - 1)[:k]
+    positions = positions[np.argsort(-scores[positions], kind="stable")]
+    return [(int(position), float(scores[position])) for position in positions]
+
+
+class VectorIndex(ABC):
+    """A mutable index of unit-norm vectors with integer IDs, searched by cosine similarity."""
+
+    @abstractmethod
+    def add(self, ids: Sequence[int], vectors: npt.NDArray[np.float32]) -> None:
+        """Adds one vector (a row of `vectors`) per ID, replacing any existing vector with the same ID."""
+
+    @abstractmethod
+    def remove(self, ids: Sequence[int]) -> None:
+        """Removes the vectors with the given IDs; unknown IDs are ignored."""
+
+    @abstractmethod
+    def search(self, vector: npt.NDArray[np.float32], k: int) -> list[tuple[int, float]]:
+        """Returns the (ID, cosine similarity) pairs of the `k` vectors most similar to `vector`, most similar first."""
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+
+class NumpyIndex(VectorIndex):
+    """
+    Exact (brute-force) search over a NumPy matrix.
+
+    A single matrix-vector product per search is fast enough for tens of thousands of vectors; beyond that, consider
+    `HnswIndex`.
+    """
+
+    def __init__(self, dimension: int) -> None:
+        self._vectors = np.zeros((16, dimension), dtype=np.float32)
+        self._ids: list[int] = []
+        self._rows: dict[int, int] = {}
+
+    def add(self, ids: Sequence[int], vectors: npt.NDArray[np.float32]) -> None:
+        for vector_id, vector in zip(ids, vectors, strict=True):
+            row = self._rows.get(vector_id)
+            if row is None:
+                row = len(self._ids)
+                if row == len(self._vectors):
+                    self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+                self._ids.append(vector_id)
+                self._rows[vector_id] = row
+            self._vectors[row] = vector
+
+    def remove(self, ids: Sequence[int]) -> None:
+        for vector_id in ids:
+            row = self._rows.pop(vector_id, None)
+            if row is None:
+                continue
+            # keep the matrix dense by moving the last vector into the freed row
+            last_id = self._ids.pop()
+            if last_id != vector_id:
+                self._vectors[row] = self._vectors[len(self._ids)]
+                self._ids[row] = last_id
+                self._rows[last_id] = row
+
+    def search(self, vector: npt.NDArray[np.float32], k: int) -> list[tuple[int, float]]:
+        scores = self._vectors[: len(self._ids)] @ vector
+        return [(self._ids[row], score) for row, score in top_k(scores, k)]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class HnswIndex(VectorIndex):
+    """
+    Approximate nearest neighbor search using an HNSW graph, for indexes too large to search exhaustively.
+
+    Requires the optional `hnswlib` package (`uv sync --extra ann`).
+    """
+
+    def __init__(
+        self, dimension: int, capacity: int = 1024, ef_construction: int = 200, m: int = 16, ef: int = 64
+    ) -> None:
+        try:
+            import hnswlib  # type: ignore
+        except ImportError as e:
+            msg = "HnswIndex requires the optional hnswlib package; install it with `uv sync --extra ann`"
+            raise ImportError(msg) from e
+        self._index = hnswlib.Index(space="ip", dim=dimension)
+        self._index.init_index(max_elements=capacity, ef_construction=ef_construction, M=m, allow_replace_deleted=True)
+        self._index.set_ef(ef)
+        self._ids: set[int] = set()
+
+    def add(self, ids: Sequence[int], vectors: npt.NDArray[np.float32]) -> None:
+        new_ids = set(ids) - self._ids
+        required = len(self._ids) + len(new_ids)
+        if required > self._index.get_max_elements():
+            self._index.resize_index(max(required, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, list(ids), replace_deleted=True)
+        self._ids |= new_ids
+
+    def remove(self, ids: Sequence[int]) -> None:
+        for vector_id in set(ids) & self._ids:
+            self._index.mark_deleted(vector_id)
+            self._ids.remove(vector_id)
+
+    def search(self, vector: npt.NDArray[np.float32], k: int) -> list[tuple[int, float]]:
+        k = min(k, len(self._ids))
+        if k == 0:
+            return []
+        labels, distances = self._index.knn_query(vector, k=k)
+        # hnswlib's inner product "distance" is 1 - dot product
+        return [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0], strict=True)]
+
+    def __len__(self) -> int:
+        return len(self._ids)